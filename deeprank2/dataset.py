@@ -1,19 +1,30 @@
 from __future__ import annotations
 
+import copy
+import hashlib
 import inspect
+import json
 import logging
+import multiprocessing
 import os
 import re
 import sys
 import warnings
-from ast import literal_eval
-from typing import Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from multiprocessing.util import Finalize
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple, Union
 
 import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import torch
+from torch.utils.data import (BatchSampler, RandomSampler, Sampler,
+                              SequentialSampler)
+from torch.utils.data import DataLoader as TorchDataLoader
+from torch_geometric.data.batch import Batch
 from torch_geometric.data.data import Data
 from torch_geometric.data.dataset import Dataset
 from tqdm import tqdm
@@ -22,10 +33,224 @@ from deeprank2.domain import edgestorage as Efeat
 from deeprank2.domain import gridstorage
 from deeprank2.domain import nodestorage as Nfeat
 from deeprank2.domain import targetstorage as targets
+from deeprank2.utils.packedgraphs import ENTRY_NAMES as PACKED_ENTRY_NAMES
+from deeprank2.utils.packedgraphs import PackedGraphs, is_packed_graphs_file
+
+try:
+    # registers additional hdf5 compression filters, needed to read blosc compressed grids
+    import hdf5plugin  # pylint: disable=unused-import # noqa: F401
+except ImportError:
+    pass
 
 _log = logging.getLogger(__name__)
 
 
+class DataCache:
+    """In-memory cache of loaded :class:`torch_geometric.data.data.Data` items, with least recently used eviction.
+
+    Give the same instance to several datasets (e.g. the training and validation sets) to share the byte budget.
+    Items are only shared between datasets that load them with the same features, transformations and target.
+    Note that each DataLoader worker process holds its own copy of the cache, see :class:`SharedDataCache` to avoid this.
+
+    Args:
+        max_bytes (int, optional): Maximum total size of the cached tensors, in bytes. Defaults to 1 GiB.
+    """
+
+    def __init__(self, max_bytes: int = 2**30):
+
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must be positive, got {max_bytes}")
+
+        self._max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __deepcopy__(self, memo: dict) -> DataCache:
+        # copies of a dataset, such as the ones made by the Trainer to split off a validation set, keep sharing the cache
+        return self
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    @staticmethod
+    def get_data_size(data: Data) -> int:
+        """Gets the size of the tensors of a data item, in bytes."""
+
+        return sum(value.element_size() * value.nelement() for _, value in data if torch.is_tensor(value))
+
+    def get(self, key: Hashable) -> Optional[Data]:
+        """Gets a cached item and marks it as most recently used, or None if it's not cached."""
+
+        if key not in self._items:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key: Hashable, data: Data):
+        """Caches an item, evicting the least recently used ones when over budget.
+
+        Items larger than the whole budget are not cached.
+        """
+
+        size = self.get_data_size(data)
+        if size > self._max_bytes:
+            return
+
+        if key in self._items:
+            self._size_bytes -= self._items.pop(key)[1]
+
+        while self._size_bytes + size > self._max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self._size_bytes -= evicted_size
+
+        self._items[key] = (data, size)
+        self._size_bytes += size
+
+    def clear(self):
+        self._items.clear()
+        self._size_bytes = 0
+
+
+class SharedDataCache(DataCache):
+    """Cache of loaded :class:`torch_geometric.data.data.Data` items in shared memory, read by all DataLoader workers.
+
+    The cache is filled in the main process, typically with `fill` before training. `share` then moves the tensors of all
+    cached items into one shared memory block per data type, after which the cache is read-only. The worker processes
+    read the items from that block, instead of each one holding (and filling) a copy of its own.
+
+    Args:
+        max_bytes (int, optional): Maximum total size of the cached tensors, in bytes. Defaults to 1 GiB.
+    """
+
+    def __init__(self, max_bytes: int = 2**30):
+
+        super().__init__(max_bytes)
+        self._owner_pid = os.getpid()
+        self._shared_tensors = None
+
+    @property
+    def is_shared(self) -> bool:
+        return self._shared_tensors is not None
+
+    def __getstate__(self) -> dict:
+        # for workers started by spawn: sending shared tensors only sends their handles
+        self.share()
+        return self.__dict__.copy()
+
+    def put(self, key: Hashable, data: Data):
+
+        # once shared, and in the worker processes, the cache is read-only
+        if self.is_shared or os.getpid() != self._owner_pid:
+            return
+
+        super().put(key, data)
+
+    def fill(self, dataset: DeeprankDataset):
+        """Loads all items of a dataset in the cache, as far as the budget allows, and shares them.
+
+        Args:
+            dataset (:class:`DeeprankDataset`): The dataset, which must use this cache.
+        """
+
+        if dataset.cache is not self:
+            raise ValueError("The dataset doesn't use this cache, set it as the dataset's `cache`.")
+
+        if self.is_shared:
+            raise ValueError("The cache has already been shared and can not be filled anymore.")
+
+        for idx in range(len(dataset)):
+            dataset.get(idx)
+
+        self.share()
+
+    def share(self):
+        """Moves the tensors of all cached items into shared memory, after which the cache is read-only."""
+
+        if self.is_shared:
+            return
+
+        flat_tensors = {}
+        for data, _ in self._items.values():
+            for _, value in data:
+                if torch.is_tensor(value):
+                    flat_tensors.setdefault(value.dtype, []).append(value.reshape(-1))
+
+        self._shared_tensors = {dtype: torch.cat(tensors).share_memory_() for dtype, tensors in flat_tensors.items()}
+
+        # replace the tensors of the items by views on the shared blocks, in the same order as they were concatenated
+        offsets = dict.fromkeys(self._shared_tensors, 0)
+        for key, (data, size) in self._items.items():
+            shared_data = copy.copy(data)
+            for attr, value in data:
+                if torch.is_tensor(value):
+                    start = offsets[value.dtype]
+                    offsets[value.dtype] += value.nelement()
+                    shared_data[attr] = self._shared_tensors[value.dtype][start:offsets[value.dtype]].view(value.shape)
+            self._items[key] = (shared_data, size)
+
+
+class BatchLoader(TorchDataLoader):
+    """Data loader getting each batch at once with :meth:`DeeprankDataset.get_batch`, instead of item by item.
+
+    A worker process thereby loads a whole batch, with its entries grouped per .HDF5 file.
+
+    Args:
+        dataset (:class:`DeeprankDataset`): The dataset to load.
+        batch_size (int, optional): Number of items per batch. Defaults to 1.
+        shuffle (bool, optional): Whether to shuffle the items at every epoch. Defaults to False.
+        drop_last (bool, optional): Whether to drop the last batch, if it's smaller than `batch_size`. Defaults to False.
+        sampler (Optional[:class:`torch.utils.data.Sampler`], optional): Sampler of the items, such as a
+            :class:`torch.utils.data.distributed.DistributedSampler`. If set, `shuffle` is ignored. Defaults to None.
+        **kwargs: Further arguments of :class:`torch.utils.data.DataLoader`, such as `num_workers` and `pin_memory`.
+    """
+
+    def __init__(self, dataset: DeeprankDataset, batch_size: int = 1, shuffle: bool = False, drop_last: bool = False, # pylint: disable=too-many-arguments
+                 sampler: Optional[Sampler] = None, **kwargs):
+
+        if sampler is None:
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        super().__init__(
+            _BatchedDataset(dataset),
+            batch_size=None,
+            sampler=BatchSampler(sampler, batch_size, drop_last),
+            collate_fn=_collate_batch,
+            **kwargs,
+        )
+
+
+class _BatchedDataset(torch.utils.data.Dataset):
+    # indexed with the lists of indices of the batch sampler
+
+    def __init__(self, dataset: DeeprankDataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, indices: List[int]) -> Batch:
+        return self.dataset.get_batch(indices)
+
+
+def _collate_batch(batch: Batch) -> Batch:
+    return batch
+
+
 class DeeprankDataset(Dataset):
     def __init__(self, # pylint: disable=too-many-arguments
                  hdf5_path: Union[str, List[str]],
@@ -36,7 +261,9 @@ class DeeprankDataset(Dataset):
                  use_tqdm: bool,
                  root_directory_path: str,
                  target_filter: Union[Dict[str, str], None],
-                 check_integrity: bool
+                 check_integrity: bool,
+                 cache: Optional[DataCache] = None,
+                 catalog_sidecar: bool = False
     ):
         """Parent class of :class:`GridDataset` and :class:`GraphDataset` which inherits from :class:`torch_geometric.data.dataset.Dataset`.
 
@@ -60,6 +287,8 @@ class DeeprankDataset(Dataset):
         self.subset = subset
 
         self.target_filter = target_filter
+        self.cache = cache
+        self.catalog_sidecar = catalog_sidecar
 
         if check_integrity:
             self._check_hdf5_files()
@@ -78,6 +307,64 @@ class DeeprankDataset(Dataset):
         # get the device
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+    def close_hdf5_files(self):
+        """Closes the read-only .HDF5 file handles kept open for loading the samples of this dataset."""
+
+        close_hdf5_files(self.hdf5_paths)
+
+    def _load_cached(self, hdf5_path: str, entry_name: str, load: Callable[[str, str], Data]) -> Data:
+        """Gets an item from the cache, or loads and caches it."""
+
+        key = (type(self).__name__, self._get_cache_signature(), hdf5_path, entry_name)
+        data = self.cache.get(key)
+        if data is None:
+            data = load(hdf5_path, entry_name)
+            self.cache.put(key, data)
+
+        # a shallow copy, such that attributes set by the caller don't end up in the cache
+        return copy.copy(data)
+
+    def _get_cache_signature(self) -> tuple:
+        # the settings that determine how an entry is loaded, datasets sharing a cache must have the same ones
+        # for items to be shared
+        return (
+            repr(self.features_dict), self.target, self.target_transform, self.task,
+            getattr(self, "clustering_method", None),
+        ) + self._get_standardization_signature()
+
+    def _get_standardization_signature(self) -> tuple:
+        # the transformations, means and standard deviations, compared by content rather than by identity: the ids of
+        # objects are reused once they are garbage collected. Transformations are identified by their code, or else
+        # kept in the signature themselves, which keeps them alive.
+        # The signature is computed again when the settings change, also when edited in place: a shallow copy of their
+        # items is kept to compare with, which is much cheaper than the signature itself.
+        features_transform = getattr(self, "features_transform", None) or {}
+        settings = (
+            tuple((feat, tuple(settings.items()) if isinstance(settings, dict) else settings)
+                  for feat, settings in features_transform.items()),
+            tuple(self.means.items()) if isinstance(self.means, dict) else self.means,
+            tuple(self.devs.items()) if isinstance(self.devs, dict) else self.devs,
+        )
+        cached = getattr(self, "_standardization_signature", None)
+        if cached is None or settings != cached[0]:
+            self._standardization_signature = (settings, self._compute_standardization_signature())
+        return self._standardization_signature[1]
+
+    def _compute_standardization_signature(self) -> tuple:
+
+        features_transform = getattr(self, "features_transform", None) or {}
+        transforms = []
+        for feat, settings in sorted(features_transform.items()):
+            transform = settings.get("transform")
+            other_settings = repr(sorted((key, value) for key, value in settings.items() if key != "transform"))
+            transforms.append((feat, other_settings, _get_transform_signature(transform) or transform))
+
+        return (
+            tuple(transforms),
+            repr(sorted(self.means.items())) if isinstance(self.means, dict) else repr(self.means),
+            repr(sorted(self.devs.items())) if isinstance(self.devs, dict) else repr(self.devs),
+        )
+
     def _check_hdf5_files(self):
         """Checks if the data contained in the .HDF5 file is valid."""
         _log.info("\nChecking dataset Integrity...")
@@ -171,68 +458,122 @@ class DeeprankDataset(Dataset):
             hdf5_path_iterator = self.hdf5_paths
         sys.stdout.flush()
 
-        for hdf5_path in hdf5_path_iterator:
+        for hdf5_path, catalog in zip(hdf5_path_iterator, _get_entry_catalogs(self.hdf5_paths, self.catalog_sidecar)):
             if self.use_tqdm:
                 hdf5_path_iterator.set_postfix(entry_name=os.path.basename(hdf5_path))
-            try:
-                with h5py.File(hdf5_path, "r") as hdf5_file:
-                    if self.subset is None:
-                        entry_names = list(hdf5_file.keys())
-                    else:
-                        entry_names = [entry_name for entry_name in self.subset if entry_name in list(hdf5_file.keys())]
+            if catalog is None:
+                continue
 
-                    #skip self._filter_targets when target_filter is None, improve performance using list comprehension.
-                    if self.target_filter is None:
-                        self.index_entries += [(hdf5_path, entry_name) for entry_name in entry_names]
-                    else:
-                        self.index_entries += [(hdf5_path, entry_name) for entry_name in entry_names \
-                        if self._filter_targets(hdf5_file[entry_name])]
+            entry_names, target_values = catalog
+            if self.subset is None:
+                entry_indices = range(len(entry_names))
+            else:
+                entry_indices_by_name = {entry_name: entry_index for entry_index, entry_name in enumerate(entry_names)}
+                entry_indices = [entry_indices_by_name[entry_name] for entry_name in self.subset if entry_name in entry_indices_by_name]
 
-            except Exception:
-                _log.exception(f"on {hdf5_path}")
+            #skip self._filter_targets when target_filter is None
+            if self.target_filter is None:
+                self.index_entries += [(hdf5_path, entry_names[entry_index]) for entry_index in entry_indices]
+            else:
+                mask = self._filter_targets(hdf5_path, target_values, len(entry_names))
+                self.index_entries += [(hdf5_path, entry_names[entry_index]) for entry_index in entry_indices if mask[entry_index]]
 
-    def _filter_targets(self, entry_group: h5py.Group) -> bool:
-        """Filters the entry according to a dictionary.
+    def _filter_targets(self, hdf5_path: str, target_values: Dict[str, np.ndarray], entry_count: int) -> np.ndarray:
+        """Filters the entries of a file according to a dictionary.
 
         The filter is based on the attribute self.target_filter that must be either
         of the form: { target_name : target_condition } or None.
+        The conditions are evaluated on the target values of all entries at once.
 
         Args:
-            entry_group (:class:`h5py.Group`): The entry group in the .HDF5 file.
+            hdf5_path (str): .HDF5 file name.
+            target_values (Dict[str, np.ndarray]): The scalar targets of all entries, NaN where missing, from the entry catalog.
+            entry_count (int): The number of entries in the file.
 
         Returns:
-            bool: True if we keep the entry False otherwise.
+            np.ndarray: Boolean mask, True for the entries to keep.
 
         Raises:
             ValueError: If an unsuported condition is provided.
         """
 
+        mask = np.ones(entry_count, dtype=bool)
         if self.target_filter is None:
-            return True
+            return mask
 
         for target_name, target_condition in self.target_filter.items():
+            if target_condition is None:
+                continue
+            condition = _parse_target_condition(target_condition)
 
-            present_target_names = list(entry_group[targets.VALUES].keys())
+            if target_name not in target_values:
+                _log.warning(f"   :Filter {target_name} not found in {hdf5_path}\n"
+                             f"   :Filter options are: {list(target_values.keys())}")
+                continue
 
-            if target_name in present_target_names:
+            values = target_values[target_name]
+            missing = np.isnan(values)
+            if np.any(missing):
+                _log.warning(f"   :Filter {target_name} not found for {np.count_nonzero(missing)} entries in {hdf5_path}, keeping them")
 
-                # If we have a given target_condition, see if it's met.
-                if isinstance(target_condition, str):
+            # entries without the target are kept
+            with np.errstate(invalid="ignore"):
+                mask &= condition(values) | missing
 
-                    operation = target_condition
-                    for operator_string in [">", "<", "==", "<=", ">=", "!="]:
-                        operation = operation.replace(operator_string, "target_value" + operator_string)
+        return mask
 
-                    if not literal_eval(operation):
-                        return False
+    def get_target_values(self) -> np.ndarray:
+        """Gets the values of the target for all items, without loading the items.
 
-                elif target_condition is not None:
-                    raise ValueError("Conditions not supported", target_condition)
+        The values are taken from the entry catalogs of the .HDF5 files, which only hold the scalar targets.
 
-            else:
-                _log.warning(f"   :Filter {target_name} not found for entry {entry_group}\n"
-                             f"   :Filter options are: {present_target_names}")
-        return True
+        Returns:
+            np.ndarray: The target value of each item, in the order of the dataset.
+
+        Raises:
+            ValueError: If no target is set, or if the target is missing for an entry.
+        """
+
+        if self.target is None:
+            raise ValueError("No target is set for this dataset.")
+
+        hdf5_paths = list(dict.fromkeys(hdf5_path for hdf5_path, _ in self.index_entries))
+        values_by_entry = {}
+        for hdf5_path, catalog in zip(hdf5_paths, _get_entry_catalogs(hdf5_paths, self.catalog_sidecar)):
+            if catalog is None:
+                raise ValueError(f"Could not read the targets of {hdf5_path}.")
+            entry_names, target_values = catalog
+            values = target_values.get(self.target, np.full(len(entry_names), np.nan))
+            values_by_entry.update(((hdf5_path, entry_name), value) for entry_name, value in zip(entry_names, values))
+
+        values = np.array([values_by_entry.get(self.index_entries[index], np.nan) for index in self.indices()])
+        missing = np.flatnonzero(np.isnan(values))
+        if len(missing) > 0:
+            hdf5_path, entry_name = self.index_entries[self.indices()[missing[0]]]
+            raise ValueError(f"Target {self.target} missing in entry {entry_name} in file {hdf5_path}, "
+                             f"and in {len(missing) - 1} other entries.")
+        return values
+
+    def get_batch(self, indices: List[int]) -> Batch:
+        """Gets several items at once, collated into one batch.
+
+        The entries are read one by one, grouped per .HDF5 file and in their order in the file, rather than in the
+        order of the indices. :class:`GraphDataset` reads the features of the entries of a file together.
+
+        Args:
+            indices (List[int]): Indices of the items, ranging from 0 to len(dataset).
+
+        Returns:
+            :class:`torch_geometric.data.batch.Batch`: The items, in the order of the indices.
+        """
+
+        dataset_indices = [self.indices()[index] for index in indices]
+        data_list = [None] * len(dataset_indices)
+        for position in sorted(range(len(dataset_indices)), key=lambda position: self.index_entries[dataset_indices[position]]):
+            data = self.get(dataset_indices[position])
+            data_list[position] = data if self.transform is None else self.transform(data)
+
+        return Batch.from_data_list(data_list)
 
     def len(self) -> int:
         """Gets the length of the dataset, either :class:`GridDataset` or :class:`GraphDataset` object.
@@ -255,14 +596,14 @@ class DeeprankDataset(Dataset):
         df_final = pd.DataFrame()
 
         for fname in self.hdf5_paths:
-            with h5py.File(fname, 'r') as f:
+            with _read_graphs_file(fname) as f:
 
                 entry_name = list(f.keys())[0]
 
                 if self.subset is not None:
-                    entry_names = [entry for entry, _ in f.items() if entry in self.subset]
+                    entry_names = [entry for entry in f.keys() if entry in self.subset]
                 else:
-                    entry_names = [entry for entry, _ in f.items()]
+                    entry_names = list(f.keys())
 
                 df_dict = {}
                 df_dict['id'] = entry_names
@@ -399,6 +740,218 @@ class DeeprankDataset(Dataset):
         self.means = means
         self.devs = devs
 
+    def _compute_mean_std_streaming(self, use_sidecar: bool = False):
+        """Computes the means and standard deviations of the features, without loading them into a DataFrame.
+
+        The features are read entry by entry, transformed, and accumulated per feature channel with Welford's method.
+        Files are processed in parallel when more than one is given and the platform can fork. The results are the
+        same as those of `hdf5_to_pandas` followed by `_compute_mean_std`.
+
+        Args:
+            use_sidecar (bool, optional): Whether to reuse and store the statistics of each file in a sidecar file next to it,
+                named `<hdf5 file>.stats.json`. Defaults to False.
+        """
+
+        transforms = {}
+        for feat_type in self.features_dict:
+            for feat in self.features_dict[feat_type]:
+                transform = None
+                if self.features_transform:
+                    transform = self.features_transform.get('all', {}).get('transform')
+                    if (transform is None) and (feat in self.features_transform):
+                        transform = self.features_transform.get(feat, {}).get('transform')
+                transforms[feat] = transform
+
+        signature = _get_statistics_signature(self.features_dict, transforms, self.subset) if use_sidecar else None
+
+        statistics = {}
+        missing_paths = []
+        for hdf5_path in self.hdf5_paths:
+            statistics[hdf5_path] = _read_statistics_sidecar(hdf5_path, signature) if signature else None
+            if statistics[hdf5_path] is None:
+                missing_paths.append(hdf5_path)
+
+        process_count = min(len(missing_paths), os.cpu_count() or 1)
+        if process_count > 1 and "fork" in multiprocessing.get_all_start_methods():
+            # the transformations may be lambdas, which can't be pickled: the initializer arguments are inherited
+            # by the forked processes instead
+            with multiprocessing.get_context("fork").Pool(process_count, initializer=_init_statistics_process,
+                                                          initargs=((self.features_dict, transforms, self.subset),)) as pool:
+                file_statistics = pool.map(_compute_file_statistics, missing_paths)
+        else:
+            file_statistics = [_compute_file_statistics(hdf5_path, (self.features_dict, transforms, self.subset))
+                               for hdf5_path in missing_paths]
+
+        for hdf5_path, accumulators in zip(missing_paths, file_statistics):
+            statistics[hdf5_path] = accumulators
+            if signature:
+                _write_statistics_sidecar(hdf5_path, signature, accumulators)
+
+        # combine the statistics of all files, in the order of the features
+        total = {}
+        for hdf5_path in self.hdf5_paths:
+            for col, accumulator in statistics[hdf5_path].items():
+                total[col] = _merge_statistics(total.get(col, (0, 0.0, 0.0)), accumulator)
+
+        self.means = {col: round(mean, 1) if count > 0 else np.nan for col, (count, mean, _) in total.items()}
+        self.devs = {col: round(float(np.sqrt(m2 / count)), 1) if count > 0 else np.nan for col, (count, _, m2) in total.items()}
+
+
+def _merge_statistics(first: Tuple[int, float, float], second: Tuple[int, float, float]) -> Tuple[int, float, float]:
+    """Merges two (count, mean, sum of squared deviations) accumulators, as in Chan et al.'s parallel variance algorithm."""
+
+    count_a, mean_a, m2_a = first
+    count_b, mean_b, m2_b = second
+    count = count_a + count_b
+    if count_b == 0:
+        return first
+    if count_a == 0:
+        return second
+    delta = mean_b - mean_a
+    return count, mean_a + delta * count_b / count, m2_a + m2_b + delta**2 * count_a * count_b / count
+
+
+# arguments of _compute_file_statistics in the processes of a statistics pool, set by _init_statistics_process
+_statistics_arguments = None
+
+
+def _init_statistics_process(arguments: Tuple[Dict[str, List[str]], Dict[str, Optional[Callable]], Optional[List[str]]]):
+
+    global _statistics_arguments # pylint: disable=global-statement
+    _statistics_arguments = arguments
+
+
+def _compute_file_statistics(
+    hdf5_path: str,
+    arguments: Optional[Tuple[Dict[str, List[str]], Dict[str, Optional[Callable]], Optional[List[str]]]] = None,
+) -> Dict[str, Tuple[int, float, float]]:
+    """Accumulates the statistics of the transformed features of one .HDF5 file, per feature channel.
+
+    Args:
+        hdf5_path (str): .HDF5 file name.
+        arguments (Optional[Tuple], optional): The features per type, the transformation per feature and the subset of entries.
+            Defaults to None, taking them from the pool initializer.
+
+    Returns:
+        Dict[str, Tuple[int, float, float]]: The count, mean and sum of squared deviations, per feature channel.
+    """
+
+    features_dict, transforms, subset = arguments or _statistics_arguments
+    if subset is not None:
+        subset = set(subset)
+
+    accumulators = {}
+    with h5py.File(hdf5_path, 'r') as f:
+        if is_packed_graphs_file(f):
+            f = PackedGraphs(f)
+        entry_names = [entry for entry in f.keys() if subset is None or entry in subset]
+
+        for entry_name in entry_names:
+            for feat_type, features in features_dict.items():
+                for feat in features:
+                    vals = f[entry_name][feat_type][feat][()]
+                    if transforms[feat]:
+                        vals = transforms[feat](vals)
+                    vals = np.asarray(vals, dtype=float)
+
+                    if vals.ndim == 2:
+                        columns = [(f"{feat}_{i}", vals[:, i]) for i in range(vals.shape[1])]
+                    else:
+                        columns = [(feat, vals.reshape(-1))]
+
+                    for col, values in columns:
+                        values = values[~np.isnan(values)]
+                        if len(values) > 0:
+                            mean = values.mean()
+                            accumulator = (len(values), mean, float(np.sum((values - mean)**2)))
+                            accumulators[col] = _merge_statistics(accumulators.get(col, (0, 0.0, 0.0)), accumulator)
+                        else:
+                            accumulators.setdefault(col, (0, 0.0, 0.0))
+
+    return accumulators
+
+
+def _get_statistics_signature(
+    features_dict: Dict[str, List[str]],
+    transforms: Dict[str, Optional[Callable]],
+    subset: Optional[List[str]],
+) -> Optional[str]:
+    """Identifies the settings of a statistics computation, or gives None if a transformation can't be identified."""
+
+    transform_signatures = {}
+    for feat, transform in transforms.items():
+        if transform is None:
+            transform_signatures[feat] = None
+        else:
+            transform_signatures[feat] = _get_transform_signature(transform)
+            if transform_signatures[feat] is None:
+                return None
+
+    settings = json.dumps([features_dict, transform_signatures, sorted(subset) if subset is not None else None], sort_keys=True)
+    return hashlib.sha1(settings.encode()).hexdigest()
+
+
+def _get_transform_signature(transform: Optional[Callable]) -> Optional[str]:
+    """Identifies a transformation by its code, or gives None if it can't be identified."""
+
+    if transform is None:
+        return None
+    if hasattr(transform, "__code__"):
+        code = transform.__code__
+        # the values captured from enclosing functions matter as well, as in lambda t: t / scale
+        closure = [cell.cell_contents for cell in transform.__closure__ or ()]
+        return f"{code.co_code.hex()}{code.co_consts!r}{code.co_names!r}{transform.__defaults__!r}{closure!r}"
+    if isinstance(transform, np.ufunc):
+        return repr(transform)
+    return None
+
+
+def _read_statistics_sidecar(hdf5_path: str, signature: str) -> Optional[Dict[str, Tuple[int, float, float]]]:
+
+    sidecar_path = f"{hdf5_path}.stats.json"
+    if not os.path.isfile(sidecar_path):
+        return None
+
+    try:
+        with open(sidecar_path, encoding="utf-8") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+    except (OSError, ValueError):
+        _log.warning(f"Ignoring unreadable statistics file {sidecar_path}")
+        return None
+
+    # statistics of a file that changed since are outdated
+    file_stat = os.stat(hdf5_path)
+    if sidecar.get("mtime") != file_stat.st_mtime or sidecar.get("size") != file_stat.st_size:
+        return None
+
+    accumulators = sidecar.get("statistics", {}).get(signature)
+    if accumulators is None:
+        return None
+    return {col: tuple(accumulator) for col, accumulator in accumulators.items()}
+
+
+def _write_statistics_sidecar(hdf5_path: str, signature: str, accumulators: Dict[str, Tuple[int, float, float]]):
+
+    sidecar_path = f"{hdf5_path}.stats.json"
+    file_stat = os.stat(hdf5_path)
+
+    sidecar = {"mtime": file_stat.st_mtime, "size": file_stat.st_size, "statistics": {}}
+    if os.path.isfile(sidecar_path):
+        try:
+            with open(sidecar_path, encoding="utf-8") as sidecar_file:
+                previous = json.load(sidecar_file)
+            if previous.get("mtime") == sidecar["mtime"] and previous.get("size") == sidecar["size"]:
+                sidecar["statistics"] = previous.get("statistics", {})
+        except (OSError, ValueError):
+            pass
+    sidecar["statistics"][signature] = {col: list(accumulator) for col, accumulator in accumulators.items()}
+
+    try:
+        with open(sidecar_path, "w", encoding="utf-8") as sidecar_file:
+            json.dump(sidecar, sidecar_file)
+    except OSError as e:
+        _log.warning(f"Could not save the statistics in {sidecar_path}: {e}")
+
 
 # Grid features are stored per dimension and named accordingly.
 # Example: position_001, position_002, position_003 (for x,y,z)
@@ -406,6 +959,322 @@ class DeeprankDataset(Dataset):
 GRID_PARTIAL_FEATURE_NAME_PATTERN = re.compile(r"^([a-zA-Z_]+)_([0-9]{3})$")
 
 
+_TARGET_CONDITION_OPERATORS = {
+    "<=": np.less_equal,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    ">": np.greater,
+}
+_TARGET_COMPARISON_PATTERN = re.compile(r"^\s*(<=|>=|==|!=|<|>)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+
+
+@lru_cache(maxsize=None)
+def _parse_target_condition(condition: str) -> Callable[[np.ndarray], np.ndarray]:
+    """Parses a target filter condition into a function evaluating it on an array of target values.
+
+    A condition is a comparison to a number, such as "<10" or ">=0.5", or comparisons combined with "and" and "or",
+    such as ">1 and <5". As in Python, "and" takes precedence over "or".
+
+    Conditions are parsed once, and then evaluated on the targets of all entries of a file at once.
+
+    Args:
+        condition (str): The condition.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Function giving a boolean mask of the values that meet the condition.
+
+    Raises:
+        ValueError: If the condition can't be parsed.
+    """
+
+    if not isinstance(condition, str):
+        raise ValueError("Conditions not supported", condition)
+
+    alternatives = []
+    for alternative in re.split(r"\bor\b", condition):
+        comparisons = []
+        for term in re.split(r"\band\b", alternative):
+            match = _TARGET_COMPARISON_PATTERN.match(term)
+            if match is None:
+                raise ValueError("Conditions not supported", condition)
+            comparisons.append((_TARGET_CONDITION_OPERATORS[match.group(1)], float(match.group(2))))
+        alternatives.append(comparisons)
+
+    def evaluate(values: np.ndarray) -> np.ndarray:
+        mask = np.zeros(values.shape, dtype=bool)
+        for comparisons in alternatives:
+            alternative_mask = np.ones(values.shape, dtype=bool)
+            for operator, threshold in comparisons:
+                alternative_mask &= operator(values, threshold)
+            mask |= alternative_mask
+        return mask
+
+    return evaluate
+
+
+# entry catalogs of the .HDF5 files read by this process, with the modification time and size of the files
+_entry_catalogs: Dict[str, Tuple[Tuple[int, int], Tuple[List[str], Dict[str, np.ndarray]]]] = {}
+# below this number of files to catalog, starting processes takes longer than reading them
+_CATALOG_PARALLEL_MIN_FILES = 8
+
+
+def _read_entry_catalog(hdf5_path: str) -> Union[Tuple[List[str], Dict[str, np.ndarray]], Exception]:
+    """Reads the entry names and scalar targets of an .HDF5 file.
+
+    Args:
+        hdf5_path (str): .HDF5 file name.
+
+    Returns:
+        Union[Tuple[List[str], Dict[str, np.ndarray]], Exception]: The entry names and the values per target name,
+            NaN for entries without the target. Or the exception raised when reading the file.
+    """
+
+    try:
+        with h5py.File(hdf5_path, "r") as hdf5_file:
+            if is_packed_graphs_file(hdf5_file):
+                # the targets of all entries are stored per target, each one is read at once
+                entry_names = hdf5_file[PACKED_ENTRY_NAMES].asstr()[()].tolist()
+                target_values = {name: np.asarray(dataset[()], dtype=float) for name, dataset in hdf5_file[targets.VALUES].items()}
+                return entry_names, target_values
+
+            entry_names = list(hdf5_file.keys())
+            target_values = {}
+            for entry_index, entry_name in enumerate(entry_names):
+                entry_group = hdf5_file[entry_name]
+                if targets.VALUES not in entry_group:
+                    continue
+                for target_name, target_item in entry_group[targets.VALUES].items():
+                    if isinstance(target_item, h5py.Dataset) and target_item.shape == () and \
+                            (np.issubdtype(target_item.dtype, np.number) or target_item.dtype == bool):
+                        if target_name not in target_values:
+                            target_values[target_name] = np.full(len(entry_names), np.nan)
+                        target_values[target_name][entry_index] = target_item[()]
+            return entry_names, target_values
+    except Exception as e: # pylint: disable=broad-except
+        return e
+
+
+def _read_catalog_sidecar(hdf5_path: str, file_version: Tuple[int, int]) -> Optional[Tuple[List[str], Dict[str, np.ndarray]]]:
+
+    sidecar_path = f"{hdf5_path}.catalog.npz"
+    if not os.path.isfile(sidecar_path):
+        return None
+
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as sidecar:
+            # the catalog of a file that changed since is outdated
+            if tuple(sidecar["file_version"].tolist()) != file_version:
+                return None
+            entry_names = sidecar["entry_names"].tolist()
+            target_values = dict(zip(sidecar["target_names"].tolist(), sidecar["target_values"]))
+    except (OSError, ValueError, KeyError):
+        _log.warning(f"Ignoring unreadable entry catalog {sidecar_path}")
+        return None
+    return entry_names, target_values
+
+
+def _write_catalog_sidecar(hdf5_path: str, file_version: Tuple[int, int], catalog: Tuple[List[str], Dict[str, np.ndarray]]):
+
+    sidecar_path = f"{hdf5_path}.catalog.npz"
+    entry_names, target_values = catalog
+
+    # written under a temporary name first, as other processes may read the catalog meanwhile
+    tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as sidecar_file:
+            np.savez(sidecar_file,
+                     file_version=np.array(file_version, dtype=np.int64),
+                     entry_names=np.array(entry_names, dtype=str),
+                     target_names=np.array(list(target_values), dtype=str),
+                     target_values=np.array(list(target_values.values()), dtype=float).reshape(len(target_values), len(entry_names)))
+        os.replace(tmp_path, sidecar_path)
+    except OSError as e:
+        _log.warning(f"Could not save the entry catalog in {sidecar_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _get_entry_catalogs(hdf5_paths: List[str], use_sidecar: bool = False) -> List[Optional[Tuple[List[str], Dict[str, np.ndarray]]]]:
+    """Gets the entry catalogs of .HDF5 files, reading the files that are new or were modified in parallel.
+
+    Args:
+        hdf5_paths (List[str]): .HDF5 file names.
+        use_sidecar (bool, optional): Whether to reuse and store the catalog of each file in a sidecar file next to it,
+            named `<hdf5 file>.catalog.npz`. Defaults to False.
+
+    Returns:
+        List[Optional[Tuple[List[str], Dict[str, np.ndarray]]]]: The catalog of each file, see :func:`_read_entry_catalog`,
+            or None for files that could not be read.
+    """
+
+    file_versions = {}
+    for hdf5_path in hdf5_paths:
+        try:
+            file_stat = os.stat(hdf5_path)
+            file_versions[hdf5_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+        except OSError:
+            file_versions[hdf5_path] = None
+
+    missing_paths = list(dict.fromkeys(hdf5_path for hdf5_path in hdf5_paths
+                                       if hdf5_path not in _entry_catalogs or
+                                       _entry_catalogs[hdf5_path][0] != file_versions[hdf5_path]))
+
+    if use_sidecar:
+        for hdf5_path in list(missing_paths):
+            catalog = _read_catalog_sidecar(hdf5_path, file_versions[hdf5_path]) if file_versions[hdf5_path] else None
+            if catalog is not None:
+                _entry_catalogs[hdf5_path] = (file_versions[hdf5_path], catalog)
+                missing_paths.remove(hdf5_path)
+
+    if len(missing_paths) >= _CATALOG_PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
+        with multiprocessing.Pool(min(len(missing_paths), os.cpu_count())) as pool:
+            results = pool.map(_read_entry_catalog, missing_paths, chunksize=max(1, len(missing_paths) // (4 * os.cpu_count())))
+    else:
+        results = [_read_entry_catalog(hdf5_path) for hdf5_path in missing_paths]
+
+    for hdf5_path, result in zip(missing_paths, results):
+        if isinstance(result, Exception):
+            _log.error(f"on {hdf5_path}: {result!r}")
+            _entry_catalogs.pop(hdf5_path, None)
+        else:
+            _entry_catalogs[hdf5_path] = (file_versions[hdf5_path], result)
+            if use_sidecar:
+                _write_catalog_sidecar(hdf5_path, file_versions[hdf5_path], result)
+
+    return [_entry_catalogs[hdf5_path][1] if hdf5_path in _entry_catalogs else None for hdf5_path in hdf5_paths]
+
+
+# read-only .HDF5 handles kept open between samples, shared by all datasets of a process
+_hdf5_handles: Dict[str, h5py.File] = {}
+_hdf5_handles_pid = None
+# readers of the packed graphs files among them
+_packed_graphs: Dict[str, PackedGraphs] = {}
+
+
+@contextmanager
+def _open_hdf5_file(hdf5_path: str) -> Iterator[h5py.File]:
+    """Gives a read-only handle to an .HDF5 file, which is kept open for the next samples.
+
+    Handles are opened lazily and pooled per process, so that each DataLoader worker opens
+    its own handles instead of reusing the ones inherited from the parent process.
+    They are closed when the process exits, or by calling :func:`close_hdf5_files`.
+
+    Args:
+        hdf5_path (str): .HDF5 file name.
+
+    Yields:
+        :class:`h5py.File`: The opened file.
+    """
+
+    global _hdf5_handles, _hdf5_handles_pid, _packed_graphs # pylint: disable=global-statement
+
+    pid = os.getpid()
+    if _hdf5_handles_pid != pid:
+        # first use in this (forked) process: never touch the handles of the parent process
+        _hdf5_handles = {}
+        _packed_graphs = {}
+        _hdf5_handles_pid = pid
+        Finalize(None, close_hdf5_files, exitpriority=10)
+
+    hdf5_file = _hdf5_handles.get(hdf5_path)
+    if hdf5_file is None or not hdf5_file.id.valid:
+        hdf5_file = h5py.File(hdf5_path, "r")
+        _hdf5_handles[hdf5_path] = hdf5_file
+
+    yield hdf5_file
+
+
+@contextmanager
+def _open_graphs_file(hdf5_path: str) -> Iterator[Union[h5py.File, PackedGraphs]]:
+    """Gives a pooled read-only handle to an .HDF5 file of graphs, see :func:`_open_hdf5_file`.
+
+    Files in the packed graphs format are given as a :class:`deeprank2.utils.packedgraphs.PackedGraphs`,
+    which is read in the same way as the :class:`h5py.File` of a processed .HDF5 file.
+
+    Args:
+        hdf5_path (str): .HDF5 file name.
+
+    Yields:
+        Union[:class:`h5py.File`, :class:`PackedGraphs`]: The opened file.
+    """
+
+    with _open_hdf5_file(hdf5_path) as hdf5_file:
+        if hdf5_path not in _packed_graphs:
+            _packed_graphs[hdf5_path] = PackedGraphs(hdf5_file) if is_packed_graphs_file(hdf5_file) else None
+
+        packed_graphs = _packed_graphs[hdf5_path]
+        yield hdf5_file if packed_graphs is None else packed_graphs
+
+
+@contextmanager
+def _read_graphs_file(hdf5_path: str) -> Iterator[Union[h5py.File, PackedGraphs]]:
+    """Opens an .HDF5 file of graphs for reading, and closes it again on exit.
+
+    Unlike :func:`_open_graphs_file`, the handle isn't pooled, such that the file can be written again afterwards.
+    It is used for the reads done once, when building a dataset, while the samples are loaded with pooled handles.
+
+    Args:
+        hdf5_path (str): .HDF5 file name.
+
+    Yields:
+        Union[:class:`h5py.File`, :class:`PackedGraphs`]: The opened file.
+    """
+
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        yield PackedGraphs(hdf5_file) if is_packed_graphs_file(hdf5_file) else hdf5_file
+
+
+def close_hdf5_files(hdf5_paths: Optional[List[str]] = None):
+    """Closes the read-only .HDF5 file handles kept open by the datasets of this process.
+
+    This is needed before opening one of these files for writing in the same process.
+
+    Args:
+        hdf5_paths (Optional[List[str]], optional): The files to close. Defaults to None, meaning all of them.
+    """
+
+    if _hdf5_handles_pid != os.getpid():
+        return
+
+    for hdf5_path in list(_hdf5_handles) if hdf5_paths is None else hdf5_paths:
+        hdf5_file = _hdf5_handles.pop(hdf5_path, None)
+        _packed_graphs.pop(hdf5_path, None)
+        if hdf5_file is not None and hdf5_file.id.valid:
+            hdf5_file.close()
+
+
+def _edge_count(grp: h5py.Group) -> int:
+    """The number of edges stored in an entry group, each edge being stored in one direction."""
+
+    if Efeat.INDEX in grp[Efeat.EDGE]:
+        return grp[f"{Efeat.EDGE}/{Efeat.INDEX}"].shape[0]
+    return 0
+
+
+def _read_grid_feature(feature_item: Union[h5py.Dataset, h5py.Group]) -> np.ndarray:
+    """Reads a grid feature from hdf5, densifying it if it was stored sparse.
+
+    Args:
+        feature_item (Union[:class:`h5py.Dataset`, :class:`h5py.Group`]): The dense feature dataset or the sparse feature group.
+
+    Returns:
+        np.ndarray: The dense feature grid.
+    """
+
+    if isinstance(feature_item, h5py.Dataset):
+        return feature_item[()]
+
+    shape = tuple(feature_item.attrs[gridstorage.SPARSE_SHAPE])
+    values = feature_item[gridstorage.SPARSE_VALUES][()]
+
+    data = np.zeros(np.prod(shape), dtype=values.dtype)
+    data[feature_item[gridstorage.SPARSE_INDICES][()]] = values
+
+    return data.reshape(shape)
+
+
 class GridDataset(DeeprankDataset):
     def __init__( # pylint: disable=too-many-arguments
         self,
@@ -421,10 +1290,16 @@ class GridDataset(DeeprankDataset):
         classes: Optional[Union[List[str], List[int], List[float]]] = None,
         tqdm: Optional[bool] = True,
         root: Optional[str] = "./",
-        check_integrity: bool = True
+        check_integrity: bool = True,
+        cache: Optional[DataCache] = None,
+        catalog_sidecar: bool = False,
     ):
         """Class to load the .HDF5 files data into grids.
 
+        The samples are loaded with read-only handles to the .HDF5 files, which are kept open between samples.
+        Call :meth:`close_hdf5_files` before writing to these files again in the same process, for instance with
+        :meth:`QueryCollection.process`.
+
         Args:
             hdf5_path (Union[str,list]): Path to .HDF5 file(s). For multiple .HDF5 files, insert the paths in a List. Defaults to None.
             subset (Optional[List[str]], optional): List of keys from .HDF5 file to include. Defaults to None (meaning include all).
@@ -470,8 +1345,16 @@ class GridDataset(DeeprankDataset):
                 Defaults to "./".
             check_integrity (bool, optional): Whether to check the integrity of the hdf5 files.
                 Defaults to True.
+            cache (Optional[:class:`DataCache`], optional): Cache in which the loaded items are kept, such that epochs after the
+                first one don't read from the .HDF5 files anymore. The same cache can be given to multiple datasets.
+                Use a :class:`SharedDataCache` to share the cached items between DataLoader worker processes.
+                Defaults to None (no caching).
+            catalog_sidecar (bool, optional): Whether to save the entry names and target values of each .HDF5 file in a
+                sidecar file next to it (`<hdf5 file>.catalog.npz`), and reuse them as long as the file is unchanged, such
+                that the files are not scanned again when creating datasets in later runs. Defaults to False.
         """
-        super().__init__(hdf5_path, subset, target, task, classes, tqdm, root, target_filter, check_integrity)
+        super().__init__(hdf5_path, subset, target, task, classes, tqdm, root, target_filter, check_integrity, cache,
+                         catalog_sidecar)
 
         self.default_vars = {
             k: v.default
@@ -581,7 +1464,9 @@ class GridDataset(DeeprankDataset):
         """
 
         file_path, entry_name = self.index_entries[idx]
-        return self.load_one_grid(file_path, entry_name)
+        if self.cache is None:
+            return self.load_one_grid(file_path, entry_name)
+        return self._load_cached(file_path, entry_name, self.load_one_grid)
 
     def load_one_grid(self, hdf5_path: str, entry_name: str) -> Data:
         """Loads one grid.
@@ -597,13 +1482,13 @@ class GridDataset(DeeprankDataset):
         feature_data = []
         target_value = None
 
-        with h5py.File(hdf5_path, 'r') as hdf5_file:
+        with _open_hdf5_file(hdf5_path) as hdf5_file:
             entry_group = hdf5_file[entry_name]
 
             mapped_features_group = entry_group[gridstorage.MAPPED_FEATURES]
             for feature_name in self.features:
                 if feature_name[0] != '_':  # ignore metafeatures
-                    feature_data.append(mapped_features_group[feature_name][:])
+                    feature_data.append(_read_grid_feature(mapped_features_group[feature_name]))
 
             target_value = entry_group[targets.VALUES][self.target][()]
 
@@ -616,6 +1501,81 @@ class GridDataset(DeeprankDataset):
         return data
 
 
+class _FeaturesPlan:
+    """Compiled plan to read one type of graph features (node or edge) into a transformed and standardized matrix.
+
+    Args:
+        steps (List[Tuple[str, slice, Optional[Callable]]]): Per feature, in order: its path in the entry group,
+            its columns in the matrix and its transformation.
+        means (np.ndarray): Mean per column, 0.0 for columns that are not standardized.
+        devs (np.ndarray): Standard deviation per column, 1.0 for columns that are not standardized.
+    """
+
+    def __init__(self, steps: List[Tuple[str, slice, Optional[Callable]]], means: np.ndarray, devs: np.ndarray):
+
+        self.steps = steps
+        self.means = means
+        self.devs = devs
+        self.standardize = bool(np.any(means != 0.0) or np.any(devs != 1.0))
+
+    @property
+    def column_count(self) -> int:
+        return len(self.means)
+
+    def apply(self, entry_group: h5py.Group, row_count: int, entry_name: str, fname: str) -> np.ndarray:
+        """Reads the features of an entry into one matrix, and applies the transformations and standardization.
+
+        Args:
+            entry_group (:class:`h5py.Group`): The entry group in the .HDF5 file.
+            row_count (int): The number of nodes or edges in the entry.
+            entry_name (str): Name of the entry, for error messages.
+            fname (str): .HDF5 file name, for error messages.
+
+        Returns:
+            np.ndarray: The features matrix, of shape (row_count, column_count).
+        """
+
+        return self.apply_batch([entry_group], [row_count], [entry_name], fname)
+
+    def apply_batch(self, entry_groups: List[h5py.Group], row_counts: List[int], entry_names: List[str], fname: str) -> np.ndarray:
+        """Reads the features of several entries into one matrix, see :meth:`apply`.
+
+        Each feature is read for all entries in turn, and is transformed per entry.
+
+        Args:
+            entry_groups (List[:class:`h5py.Group`]): The entry groups in the .HDF5 file.
+            row_counts (List[int]): The number of nodes or edges in each entry.
+            entry_names (List[str]): Names of the entries, for error messages.
+            fname (str): .HDF5 file name, for error messages.
+
+        Returns:
+            np.ndarray: The features matrix, with the rows of the entries one after the other.
+        """
+
+        offsets = np.concatenate(([0], np.cumsum(row_counts, dtype=np.int64)))
+        matrix = np.empty((offsets[-1], self.column_count))
+
+        # transformations must not produce invalid values
+        with np.errstate(divide="raise", invalid="raise", over="raise"):
+            for path, columns, transform in self.steps:
+                for entry_group, entry_name, start, end in zip(entry_groups, entry_names, offsets[:-1], offsets[1:]):
+                    vals = entry_group[path][()]
+                    if transform:
+                        try:
+                            vals = transform(vals)
+                        except FloatingPointError as e:
+                            feat = path.split("/")[-1]
+                            raise ValueError(f"Invalid value occurs in {entry_name}, file {fname},"
+                                             f"when applying {transform} for feature {feat}."
+                                             f"Please change the transformation function for {feat}.") from e
+                    matrix[start:end, columns] = np.reshape(vals, (end - start, -1))
+
+        if self.standardize:
+            matrix = (matrix - self.means) / self.devs
+
+        return matrix
+
+
 class GraphDataset(DeeprankDataset):
     def __init__( # noqa: MC0001, pylint: disable=too-many-arguments, too-many-locals
         self,
@@ -635,9 +1595,16 @@ class GraphDataset(DeeprankDataset):
         tqdm: Optional[bool] = True,
         root: Optional[str] = "./",
         check_integrity: bool = True,
+        cache: Optional[DataCache] = None,
+        statistics_sidecar: bool = False,
+        catalog_sidecar: bool = False,
     ):
         """Class to load the .HDF5 files data into graphs.
 
+        The samples are loaded with read-only handles to the .HDF5 files, which are kept open between samples.
+        Call :meth:`close_hdf5_files` before writing to these files again in the same process, for instance with
+        :meth:`QueryCollection.process`.
+
         Args:
             hdf5_path (Union[str, List[str]]): Path to .HDF5 file(s). For multiple .HDF5 files, insert the paths in a List.
                 Defaults to None.
@@ -707,9 +1674,20 @@ class GraphDataset(DeeprankDataset):
             root (Optional[str], optional): Root directory where the dataset should be saved. Defaults to "./".
             check_integrity (bool, optional): Whether to check the integrity of the hdf5 files.
                 Defaults to True.
+            cache (Optional[:class:`DataCache`], optional): Cache in which the loaded items are kept, such that epochs after the
+                first one don't read from the .HDF5 files anymore. The same cache can be given to multiple datasets.
+                Use a :class:`SharedDataCache` to share the cached items between DataLoader worker processes.
+                Defaults to None (no caching).
+            statistics_sidecar (bool, optional): Whether to save the means and standard deviations used for standardization
+                in a sidecar file next to each .HDF5 file (`<hdf5 file>.stats.json`), and reuse them as long as the file and
+                the features, transformations and subset are unchanged. Defaults to False.
+            catalog_sidecar (bool, optional): Whether to save the entry names and target values of each .HDF5 file in a
+                sidecar file next to it (`<hdf5 file>.catalog.npz`), and reuse them as long as the file is unchanged, such
+                that the files are not scanned again when creating datasets in later runs. Defaults to False.
         """
 
-        super().__init__(hdf5_path, subset, target, task, classes, tqdm, root, target_filter, check_integrity)
+        super().__init__(hdf5_path, subset, target, task, classes, tqdm, root, target_filter, check_integrity, cache,
+                         catalog_sidecar)
 
         self.default_vars = {
             k: v.default
@@ -723,6 +1701,7 @@ class GraphDataset(DeeprankDataset):
         self.clustering_method = clustering_method
         self.target_transform = target_transform
         self.features_transform = features_transform
+        self.statistics_sidecar = statistics_sidecar
         self._check_features()
 
         if not train:
@@ -753,17 +1732,71 @@ class GraphDataset(DeeprankDataset):
 
         if standardize and train:
             if self.means or self.devs is None:
-                if self.df is None:
-                    self.hdf5_to_pandas()
-                self._compute_mean_std()
+                self._compute_mean_std_streaming(self.statistics_sidecar)
         elif standardize and (not train):
             if (dataset_train.means is None) or (dataset_train.devs is None):
-                if dataset_train.df is None:
-                    dataset_train.hdf5_to_pandas()
-                dataset_train._compute_mean_std()
+                dataset_train._compute_mean_std_streaming(dataset_train.statistics_sidecar)
             self.means = dataset_train.means
             self.devs = dataset_train.devs
 
+        self._features_plans = None
+        self._features_plans_key = None
+        self._compile_features_plans()
+
+    def _compile_features_plans(self):
+        """Compiles the plans to read the node and edge features, with their transformations and standardization.
+
+        The transformation and standardization settings are resolved per feature once, instead of for every loaded graph.
+        The plans are compiled again when the settings or the means and standard deviations are replaced.
+        """
+
+        self._features_plans_key = self._get_standardization_signature() + (tuple(self.node_features), tuple(self.edge_features))
+        self._features_plans = {}
+
+        with _read_graphs_file(self.hdf5_paths[0]) as f5:
+            grp = f5[list(f5.keys())[0]]
+
+            for feat_type, features in [(Nfeat.NODE, self.node_features), (Efeat.EDGE, self.edge_features)]:
+                steps = []
+                means = []
+                devs = []
+                for feat in features:
+                    if feat[0] == '_':  # ignore metafeatures
+                        continue
+
+                    # get feat transformation and standardization
+                    transform = None
+                    standard = None
+                    if self.features_transform is not None:
+                        transform = self.features_transform.get('all', {}).get('transform')
+                        standard = self.features_transform.get('all', {}).get('standardize')
+                        # if no transformation is set for all features, check if one is set for the current feature
+                        if (transform is None) and (feat in self.features_transform):
+                            transform = self.features_transform.get(feat, {}).get('transform')
+                        # if no standardization is set for all features, check if one is set for the current feature
+                        if (standard is None) and (feat in self.features_transform):
+                            standard = self.features_transform.get(feat, {}).get('standardize')
+
+                    path = f"{feat_type}/{feat}"
+                    shape = grp[path].shape
+                    start = len(means)
+                    if len(shape) == 1: # features with only one channel
+                        means.append(self.means[feat] if standard else 0.0)
+                        devs.append(self.devs[feat] if standard else 1.0)
+                    else:
+                        # the statistics of multi-channel features are stored per channel
+                        means += [self.means[f"{feat}_{i}"] if standard else 0.0 for i in range(shape[1])]
+                        devs += [self.devs[f"{feat}_{i}"] if standard else 1.0 for i in range(shape[1])]
+                    steps.append((path, slice(start, len(means)), transform))
+
+                self._features_plans[feat_type] = _FeaturesPlan(steps, np.array(means, dtype=float), np.array(devs, dtype=float))
+
+    def _get_features_plans(self) -> Dict[str, _FeaturesPlan]:
+
+        if self._features_plans_key != self._get_standardization_signature() + (tuple(self.node_features), tuple(self.edge_features)):
+            self._compile_features_plans()
+        return self._features_plans
+
     def get(self, idx: int) -> Data:
         """Gets one graph item from its unique index.
 
@@ -775,9 +1808,41 @@ class GraphDataset(DeeprankDataset):
         """
 
         fname, mol = self.index_entries[idx]
-        return self.load_one_graph(fname, mol)
+        if self.cache is None:
+            return self.load_one_graph(fname, mol)
+        return self._load_cached(fname, mol, self.load_one_graph)
+
+    def get_batch(self, indices: List[int]) -> Batch:
+        """Gets several graph items at once, collated into one batch.
+
+        The entries of each .HDF5 file are loaded together by :meth:`load_graphs`.
+        Items in the cache, if any, are loaded one by one instead.
+
+        Args:
+            indices (List[int]): Indices of the items, ranging from 0 to len(dataset).
+
+        Returns:
+            :class:`torch_geometric.data.batch.Batch`: The items, in the order of the indices.
+        """
+
+        if self.cache is not None:
+            return super().get_batch(indices)
+
+        dataset_indices = [self.indices()[index] for index in indices]
+        positions_per_file = {}
+        for position in sorted(range(len(dataset_indices)), key=lambda position: self.index_entries[dataset_indices[position]]):
+            fname, _ = self.index_entries[dataset_indices[position]]
+            positions_per_file.setdefault(fname, []).append(position)
+
+        data_list = [None] * len(dataset_indices)
+        for fname, positions in positions_per_file.items():
+            entry_names = [self.index_entries[dataset_indices[position]][1] for position in positions]
+            for position, data in zip(positions, self.load_graphs(fname, entry_names)):
+                data_list[position] = data if self.transform is None else self.transform(data)
+
+        return Batch.from_data_list(data_list)
 
-    def load_one_graph(self, fname: str, entry_name: str)  -> Data: # pylint: disable = too-many-locals # noqa: MC0001
+    def load_one_graph(self, fname: str, entry_name: str)  -> Data:
         """Loads one graph.
 
         Args:
@@ -788,152 +1853,151 @@ class GraphDataset(DeeprankDataset):
             :class:`torch_geometric.data.data.Data`: item with tensors x, y if present, edge_index, edge_attr, pos, entry_names.
         """
 
-        with h5py.File(fname, 'r') as f5:
-            grp = f5[entry_name]
+        with _open_graphs_file(fname) as f5:
+            return self.load_graph_group(f5[entry_name], entry_name, fname)
 
-            # node features
-            if len(self.node_features) > 0:
-                node_data = ()
-                for feat in self.node_features:
+    def load_graphs(self, fname: str, entry_names: List[str]) -> List[Data]:
+        """Loads several graphs of one .HDF5 file.
 
-                    # resetting transformation and standardization for each feature
-                    transform = None
-                    standard = None
+        Each feature is read for all entries in one pass, and the features are standardized once for all entries.
+        The entries of packed graphs files are read with one read per matrix of the file.
 
-                    if feat[0] != '_':  # ignore metafeatures
-                        vals = grp[f"{Nfeat.NODE}/{feat}"][()]
-                        # get feat transformation and standardization
-                        if (self.features_transform is not None):
-                            transform = self.features_transform.get('all', {}).get('transform')
-                            standard = self.features_transform.get('all', {}).get('standardize')
-                            # if no transformation is set for all features, check if one is set for the current feature
-                            if (transform is None) and (feat in self.features_transform):
-                                transform = self.features_transform.get(feat, {}).get('transform')
-                            # if no standardization is set for all features, check if one is set for the current feature
-                            if (standard is None) and (feat in self.features_transform):
-                                standard = self.features_transform.get(feat, {}).get('standardize')
-
-                        # apply transformation
-                        if transform:
-                            with warnings.catch_warnings(record=True) as w:
-                                vals = transform(vals)
-                                if (len(w) > 0):
-                                    raise ValueError(f"Invalid value occurs in {entry_name}, file {fname},"
-                                                     f"when applying {transform} for feature {feat}."
-                                                     f"Please change the transformation function for {feat}.")
-
-                        if vals.ndim == 1: # features with only one channel
-                            vals = vals.reshape(-1, 1)
-                            if standard:
-                                vals = (vals-self.means[feat])/self.devs[feat]
-                        else:
-                            if standard:
-                                reshaped_mean = [mean_value for mean_key, mean_value in self.means.items() if feat in mean_key]
-                                reshaped_dev = [dev_value for dev_key, dev_value in self.devs.items() if feat in dev_key]
-                                vals = (vals - reshaped_mean)/reshaped_dev
-                        node_data += (vals,)
-                x = torch.tensor(np.hstack(node_data), dtype=torch.float)
-            else:
-                x = None
-                _log.warning("No node features set.")
-
-            # edge index,
-            # we have to have all the edges i.e : (i,j) and (j,i)
-            if Efeat.INDEX in grp[Efeat.EDGE]:
-                ind = grp[f"{Efeat.EDGE}/{Efeat.INDEX}"][()]
-                if ind.ndim == 2:
-                    ind = np.vstack((ind, np.flip(ind, 1))).T
-                edge_index = torch.tensor(ind, dtype=torch.long).contiguous()
+        Args:
+            fname (str): .HDF5 file name.
+            entry_names (List[str]): Names of the entries.
+
+        Returns:
+            List[:class:`torch_geometric.data.data.Data`]: The items, see :meth:`load_one_graph`.
+        """
+
+        with _open_graphs_file(fname) as f5:
+            if isinstance(f5, PackedGraphs):
+                groups = f5.read_entries(entry_names)
             else:
-                edge_index = torch.empty((2, 0), dtype=torch.long)
+                groups = [f5[entry_name] for entry_name in entry_names]
 
-            # edge feature
-            # we have to have all the edges i.e : (i,j) and (j,i)
+            plans = self._get_features_plans()
+            node_counts = [grp[f"{Nfeat.NODE}/{Nfeat.POSITION}"].shape[0] for grp in groups]
+            edge_counts = [_edge_count(grp) for grp in groups]
+            node_data = [None] * len(groups)
+            edge_data = [None] * len(groups)
+            if len(self.node_features) > 0:
+                node_data = np.split(plans[Nfeat.NODE].apply_batch(groups, node_counts, entry_names, fname),
+                                     np.cumsum(node_counts)[:-1])
             if len(self.edge_features) > 0:
-                edge_data = ()
-                for feat in self.edge_features:
+                edge_data = np.split(plans[Efeat.EDGE].apply_batch(groups, edge_counts, entry_names, fname),
+                                     np.cumsum(edge_counts)[:-1])
 
-                    # resetting transformation and standardization for each feature
-                    transform = None
-                    standard = None
+            return [self._graph_from_group(grp, entry_name, fname, True, node_data[position], edge_data[position])
+                    for position, (grp, entry_name) in enumerate(zip(groups, entry_names))]
 
-                    if feat[0] != '_':   # ignore metafeatures
-                        vals = grp[f"{Efeat.EDGE}/{feat}"][()]
-                        # get feat transformation and standardization
-                        if (self.features_transform is not None):
-                            transform = self.features_transform.get('all', {}).get('transform')
-                            standard = self.features_transform.get('all', {}).get('standardize')
-                            # if no transformation is set for all features, check if one is set for the current feature
-                            if (transform is None) and (feat in self.features_transform):
-                                transform = self.features_transform.get(feat, {}).get('transform')
-                            # if no standardization is set for all features, check if one is set for the current feature
-                            if (standard is None) and (feat in self.features_transform):
-                                standard = self.features_transform.get(feat, {}).get('standardize')
-
-                        # apply transformation
-                        if transform:
-                            with warnings.catch_warnings(record=True) as w:
-                                vals = transform(vals)
-                                if (len(w) > 0):
-                                    raise ValueError(f"Invalid value occurs in {entry_name}, file {fname},"
-                                                     f"when applying {transform} for feature {feat}."
-                                                     f"Please change the transformation function for {feat}.")
-
-                        if vals.ndim == 1:
-                            vals = vals.reshape(-1, 1)
-                            if standard:
-                                vals = (vals-self.means[feat])/self.devs[feat]
-                        else:
-                            if standard:
-                                reshaped_mean = [mean_value for mean_key, mean_value in self.means.items() if feat in mean_key]
-                                reshaped_dev = [dev_value for dev_key, dev_value in self.devs.items() if feat in dev_key]
-                                vals = (vals - reshaped_mean)/reshaped_dev
-                        edge_data += (vals,)
-                edge_data = np.hstack(edge_data)
-                edge_data = np.vstack((edge_data, edge_data))
-                edge_attr = torch.tensor(edge_data, dtype=torch.float).contiguous()
-            else:
-                edge_attr = torch.empty((edge_index.shape[1], 0), dtype=torch.float).contiguous()
+    def load_graph_group( # pylint: disable = too-many-locals # noqa: MC0001
+        self,
+        grp: h5py.Group,
+        entry_name: str,
+        fname: str,
+        load_target: bool = True
+    ) -> Data:
+        """Loads one graph from its opened entry group.
 
-            # target
-            if self.target is None:
-                y = None
-            else:
-                if targets.VALUES in grp and self.target in grp[targets.VALUES]:
-                    y = torch.tensor([grp[f"{targets.VALUES}/{self.target}"][()]], dtype=torch.float).contiguous()
+        The group may be in any .HDF5 file, for instance in an in-memory file holding a graph freshly built from a query.
 
-                    if self.task == targets.REGRESS and self.target_transform is True:
-                        y = torch.sigmoid(torch.log(y))
-                    elif self.task is not targets.REGRESS and self.target_transform is True:
-                        raise ValueError(f"Task is set to {self.task}. Please set it to regress to transform the target with a sigmoid.")
+        Args:
+            grp (:class:`h5py.Group`): The entry group.
+            entry_name (str): Name of the entry.
+            fname (str): .HDF5 file name, for error messages.
+            load_target (bool, optional): Whether to load the target value of the entry. Defaults to True.
 
-                else:
-                    possible_targets = grp[targets.VALUES].keys()
-                    raise ValueError(f"Target {self.target} missing in entry {entry_name} in file {fname}, possible targets are {possible_targets}." +
-                                     "\n Use the query class to add more target values to input data.")
-
-            # positions
-            pos = torch.tensor(grp[f"{Nfeat.NODE}/{Nfeat.POSITION}/"][()], dtype=torch.float).contiguous()
-
-            # cluster
-            cluster0 = None
-            cluster1 = None
-            if self.clustering_method is not None:
-                if 'clustering' in grp.keys():
-                    if self.clustering_method in grp["clustering"].keys():
-                        if (
-                            "depth_0" in grp[f"clustering/{self.clustering_method}"].keys() and
-                            "depth_1" in grp[f"clustering/{self.clustering_method}"].keys()
-                            ):
-
-                            cluster0 = torch.tensor(
-                                grp["clustering/" + self.clustering_method + "/depth_0"][()], dtype=torch.long)
-                            cluster1 = torch.tensor(
-                                grp["clustering/" + self.clustering_method + "/depth_1"][()], dtype=torch.long)
-                        else:
-                            _log.warning("no clusters detected")
+        Returns:
+            :class:`torch_geometric.data.data.Data`: item with tensors x, y if present, edge_index, edge_attr, pos, entry_names.
+        """
+
+        plans = self._get_features_plans()
+        node_data = None
+        edge_data = None
+        if len(self.node_features) > 0:
+            node_count = grp[f"{Nfeat.NODE}/{Nfeat.POSITION}"].shape[0]
+            node_data = plans[Nfeat.NODE].apply(grp, node_count, entry_name, fname)
+        if len(self.edge_features) > 0:
+            edge_data = plans[Efeat.EDGE].apply(grp, _edge_count(grp), entry_name, fname)
+
+        return self._graph_from_group(grp, entry_name, fname, load_target, node_data, edge_data)
+
+    def _graph_from_group( # pylint: disable = too-many-arguments, too-many-locals # noqa: MC0001
+        self,
+        grp: h5py.Group,
+        entry_name: str,
+        fname: str,
+        load_target: bool,
+        node_data: Optional[np.ndarray],
+        edge_data: Optional[np.ndarray],
+    ) -> Data:
+        # builds the graph of an entry group, from its features matrices read by a features plan
+
+        # node features
+        if node_data is not None:
+            x = torch.tensor(node_data, dtype=torch.float)
+        else:
+            x = None
+            _log.warning("No node features set.")
+
+        # edge index,
+        # we have to have all the edges i.e : (i,j) and (j,i)
+        if Efeat.INDEX in grp[Efeat.EDGE]:
+            ind = grp[f"{Efeat.EDGE}/{Efeat.INDEX}"][()]
+            if ind.ndim == 2:
+                ind = np.vstack((ind, np.flip(ind, 1))).T
+            edge_index = torch.tensor(ind, dtype=torch.long).contiguous()
+        else:
+            edge_index = torch.empty((2, 0), dtype=torch.long)
+
+        # edge feature
+        # we have to have all the edges i.e : (i,j) and (j,i)
+        if edge_data is not None:
+            edge_data = np.vstack((edge_data, edge_data))
+            edge_attr = torch.tensor(edge_data, dtype=torch.float).contiguous()
+        else:
+            edge_attr = torch.empty((edge_index.shape[1], 0), dtype=torch.float).contiguous()
+
+        # target
+        if self.target is None or not load_target:
+            y = None
+        else:
+            if targets.VALUES in grp and self.target in grp[targets.VALUES]:
+                y = torch.tensor([grp[f"{targets.VALUES}/{self.target}"][()]], dtype=torch.float).contiguous()
+
+                if self.task == targets.REGRESS and self.target_transform is True:
+                    y = torch.sigmoid(torch.log(y))
+                elif self.task is not targets.REGRESS and self.target_transform is True:
+                    raise ValueError(f"Task is set to {self.task}. Please set it to regress to transform the target with a sigmoid.")
+
+            else:
+                possible_targets = grp[targets.VALUES].keys()
+                raise ValueError(f"Target {self.target} missing in entry {entry_name} in file {fname}, possible targets are {possible_targets}." +
+                                 "\n Use the query class to add more target values to input data.")
+
+        # positions
+        pos = torch.tensor(grp[f"{Nfeat.NODE}/{Nfeat.POSITION}/"][()], dtype=torch.float).contiguous()
+
+        # cluster
+        cluster0 = None
+        cluster1 = None
+        if self.clustering_method is not None:
+            if 'clustering' in grp.keys():
+                if self.clustering_method in grp["clustering"].keys():
+                    if (
+                        "depth_0" in grp[f"clustering/{self.clustering_method}"].keys() and
+                        "depth_1" in grp[f"clustering/{self.clustering_method}"].keys()
+                        ):
+
+                        cluster0 = torch.tensor(
+                            grp["clustering/" + self.clustering_method + "/depth_0"][()], dtype=torch.long)
+                        cluster1 = torch.tensor(
+                            grp["clustering/" + self.clustering_method + "/depth_1"][()], dtype=torch.long)
                     else:
-                        _log.warning(f"no clustering/{self.clustering_method} detected")
+                        _log.warning("no clusters detected")
+                else:
+                    _log.warning(f"no clustering/{self.clustering_method} detected")
 
         # load
         data = Data(x=x, edge_index=edge_index, edge_attr=edge_attr, y=y, pos=pos)
@@ -947,18 +2011,16 @@ class GraphDataset(DeeprankDataset):
 
     def _check_features(self): #pylint: disable=too-many-branches
         """Checks if the required features exist"""
-        f = h5py.File(self.hdf5_paths[0], "r")
-        mol_key = list(f.keys())[0]
-
-        # read available node features
-        self.available_node_features = list(f[f"{mol_key}/{Nfeat.NODE}/"].keys())
-        self.available_node_features = [key for key in self.available_node_features if key[0] != '_']  # ignore metafeatures
+        with _read_graphs_file(self.hdf5_paths[0]) as f:
+            mol_key = list(f.keys())[0]
 
-        # read available edge features
-        self.available_edge_features = list(f[f"{mol_key}/{Efeat.EDGE}/"].keys())
-        self.available_edge_features = [key for key in self.available_edge_features if key[0] != '_']  # ignore metafeatures
+            # read available node features
+            self.available_node_features = list(f[f"{mol_key}/{Nfeat.NODE}/"].keys())
+            self.available_node_features = [key for key in self.available_node_features if key[0] != '_']  # ignore metafeatures
 
-        f.close()
+            # read available edge features
+            self.available_edge_features = list(f[f"{mol_key}/{Efeat.EDGE}/"].keys())
+            self.available_edge_features = [key for key in self.available_edge_features if key[0] != '_']  # ignore metafeatures
 
         # check node features
         missing_node_features = []
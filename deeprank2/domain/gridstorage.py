@@ -1,3 +1,11 @@
 
 
 MAPPED_FEATURES = "mapped_features"
+
+## atomic density channels, one per element: atomic_density_C, atomic_density_O, etc.
+ATOMIC_DENSITY = "atomic_density"
+
+## sparse features are stored as a group holding the nonzero values and their flat (raveled) grid indices
+SPARSE_INDICES = "indices"
+SPARSE_VALUES = "values"
+SPARSE_SHAPE = "shape" # attribute of the group
@@ -22,6 +22,21 @@ class AtomicElement(Enum):
         value[self.value - 1] = 1.0
         return value
 
+    @property
+    def vanderwaals_radius(self) -> float:
+        """Bondi van der Waals radius of the element, in Å."""
+        return _VANDERWAALS_RADII[self]
+
+
+_VANDERWAALS_RADII = {
+    AtomicElement.C: 1.70,
+    AtomicElement.O: 1.52,
+    AtomicElement.N: 1.55,
+    AtomicElement.S: 1.80,
+    AtomicElement.P: 1.80,
+    AtomicElement.H: 1.20,
+}
+
 
 class Atom:
     """One atom in a PDBStructure."""
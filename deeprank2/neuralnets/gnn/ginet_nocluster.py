@@ -47,7 +47,7 @@ class GINetConvLayer(torch.nn.Module):
         alpha = F.softmax(alpha, dim=1)
         h = alpha * xcol
 
-        out = torch.zeros(num_node, self.out_channels).to(alpha.device)
+        out = torch.zeros(num_node, self.out_channels, dtype=h.dtype).to(alpha.device)
         z = scatter_sum(h, row, dim=0, out=out)
 
         return z
@@ -23,7 +23,7 @@ class NaiveConvolutionalLayer(Module):
         message_input = torch.cat([node0_features, node1_features, edge_features], dim=1)
         messages_per_neighbour = self._edge_mlp(message_input)
         # aggregate messages
-        out = torch.zeros(node_features.shape[0], messages_per_neighbour.shape[1]).to(node_features.device)
+        out = torch.zeros(node_features.shape[0], messages_per_neighbour.shape[1], dtype=messages_per_neighbour.dtype).to(node_features.device)
         message_sums_per_node = scatter_sum(messages_per_neighbour, node0_indices, dim=0, out=out)
         # update nodes
         node_input = torch.cat([node_features, message_sums_per_node], dim=1)
@@ -63,7 +63,7 @@ class SGraphAttentionLayer(torch.nn.Module):
         alpha = edge_attr * alpha
 
         # scatter the resulting edge feature to get node features
-        out = torch.zeros(num_node, self.out_channels).to(alpha.device)
+        out = torch.zeros(num_node, self.out_channels, dtype=alpha.dtype).to(alpha.device)
         out = scatter_mean(alpha, row, dim=0, out=out)
 
         # if the graph is undirected and (i,j) and (j,i) are both in
@@ -28,7 +28,8 @@ from deeprank2.utils.buildgraph import (add_hydrogens, get_contact_atoms,
                                         get_surrounding_residues)
 from deeprank2.utils.graph import (Graph, build_atomic_graph,
                                    build_residue_graph)
-from deeprank2.utils.grid import Augmentation, GridSettings, MapMethod
+from deeprank2.utils.grid import (Augmentation, GridSettings,
+                                  GridStoragePolicy, MapMethod)
 from deeprank2.utils.parsing.pssm import parse_pssm
 
 _log = logging.getLogger(__name__)
@@ -258,6 +259,8 @@ class QueryCollection:
         grid_settings: Optional[GridSettings],
         grid_map_method: Optional[MapMethod],
         grid_augmentation_count: int,
+        grid_storage: Optional[GridStoragePolicy],
+        grid_atomic_densities: bool,
         query: Query
     ):
 
@@ -272,13 +275,16 @@ class QueryCollection:
             graph.write_to_hdf5(output_path)
 
             if grid_settings is not None and grid_map_method is not None:
-                graph.write_as_grid_to_hdf5(output_path, grid_settings, grid_map_method)
+                graph.write_as_grid_to_hdf5(output_path, grid_settings, grid_map_method,
+                                            storage=grid_storage, atomic_densities=grid_atomic_densities)
 
+                # repeat with random augmentations, all written in one go
+                augmentations = []
                 for _ in range(grid_augmentation_count):
-                    # repeat with random augmentation
                     axis, angle = pdb2sql.transform.get_rot_axis_angle(randrange(100))
-                    augmentation = Augmentation(axis, angle)
-                    graph.write_as_grid_to_hdf5(output_path, grid_settings, grid_map_method, augmentation)
+                    augmentations.append(Augmentation(axis, angle))
+                graph.write_as_augmented_grids_to_hdf5(output_path, grid_settings, grid_map_method, augmentations,
+                                                       grid_storage, grid_atomic_densities)
 
             return None
 
@@ -296,7 +302,9 @@ class QueryCollection:
         combine_output: bool = True,
         grid_settings: Optional[GridSettings] = None,
         grid_map_method: Optional[MapMethod] = None,
-        grid_augmentation_count: int = 0
+        grid_augmentation_count: int = 0,
+        grid_storage: Optional[GridStoragePolicy] = None,
+        grid_atomic_densities: bool = False
     ) -> List[str]:
         """
         Args:
@@ -314,6 +322,11 @@ class QueryCollection:
                 Defaults to None.
             grid_augmentation_count (int, optional): Number of grid data augmentations. May not be negative be zero or a positive number.
                 Defaults to 0.
+            grid_storage (Optional[:class:`GridStoragePolicy`], optional): How the grid features are stored in the HDF5 files
+                (dtype, chunk shape and compression). Defaults to None, which stores lzf compressed float64 values with automatic chunking.
+            grid_atomic_densities (bool, optional): Also map the atomic densities of the structure to the grids (Koes et al., Arxiv:1612.02751v1),
+                as one channel per element named atomic_density_<element>. Requires `grid_settings` and `grid_map_method` to be set as well.
+                Defaults to False.
 
         Returns:
             List[str]: The list of paths of the generated HDF5 files.
@@ -335,23 +348,14 @@ class QueryCollection:
         _log.info(f'\nNumber of CPUs for processing the queries set to: {self.cpu_count}.')
 
 
-        if feature_modules == 'all':
-            feature_names = [modname for _, modname, _ in pkgutil.iter_modules(deeprank2.features.__path__)]
-        elif isinstance(feature_modules, list):
-            feature_names = [os.path.basename(m.__file__)[:-3] if isinstance(m,ModuleType)
-                             else m.replace('.py','') for m in feature_modules]
-        elif isinstance(feature_modules, ModuleType):
-            feature_names = [os.path.basename(feature_modules.__file__)[:-3]]
-        elif isinstance(feature_modules, str):
-            feature_names = [feature_modules.replace('.py','')]
-        else:
-            raise ValueError(f'Feature_modules has received an invalid input type: {type(feature_modules)}.')
+        feature_names = get_feature_module_names(feature_modules)
         _log.info(f'\nSelected feature modules: {feature_names}.')
 
         _log.info(f'Creating pool function to process {len(self.queries)} queries...')
         pool_function = partial(self._process_one_query, prefix,
                                 feature_names,
-                                grid_settings, grid_map_method, grid_augmentation_count)
+                                grid_settings, grid_map_method, grid_augmentation_count, grid_storage,
+                                grid_atomic_densities)
 
         with Pool(self.cpu_count) as pool:
             _log.info('Starting pooling...\n')
@@ -371,6 +375,29 @@ class QueryCollection:
         return output_paths
 
 
+def get_feature_module_names(feature_modules: Union[ModuleType, List[ModuleType], str, List[str]]) -> List[str]:
+    """Gives the names of features' modules in `deeprank2.features`.
+
+    Args:
+        feature_modules (Union[ModuleType, List[ModuleType], str, List[str]]): Features' module or list of features' modules
+            (given as string or as an imported module), or 'all' for all available modules in `deeprank2.features`.
+
+    Returns:
+        List[str]: The names of the modules, to be imported as `deeprank2.features.<name>`.
+    """
+
+    if feature_modules == 'all':
+        return [modname for _, modname, _ in pkgutil.iter_modules(deeprank2.features.__path__)]
+    if isinstance(feature_modules, list):
+        return [os.path.basename(m.__file__)[:-3] if isinstance(m,ModuleType)
+                else m.replace('.py','') for m in feature_modules]
+    if isinstance(feature_modules, ModuleType):
+        return [os.path.basename(feature_modules.__file__)[:-3]]
+    if isinstance(feature_modules, str):
+        return [feature_modules.replace('.py','')]
+    raise ValueError(f'Feature_modules has received an invalid input type: {type(feature_modules)}.')
+
+
 class SingleResidueVariantResidueQuery(Query):
 
     def __init__(  # pylint: disable=too-many-arguments
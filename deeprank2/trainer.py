@@ -1,24 +1,51 @@
 import copy
+import hashlib
+import importlib
+import io
 import logging
+import multiprocessing
+import os
+import pickle
+import queue
+from collections import Counter
+from functools import partial
 from time import time
-from typing import List, Optional, Tuple, Union
+from types import ModuleType
+from typing import Iterator, List, Optional, Tuple, Union
 
 import h5py
 import numpy as np
+import pandas as pd
 import torch
 import torch.nn.functional as F
+from torch import distributed as dist
 from torch import nn
+from torch.utils.data import BatchSampler, Sampler
+from torch.utils.data.distributed import DistributedSampler
+from torch_geometric.data.batch import Batch
+from torch_geometric.data.data import Data
 from torch_geometric.loader import DataLoader
+from torch_geometric.nn.pool.consecutive import consecutive_cluster
+from torch_geometric.nn.pool.pool import pool_edge
 from tqdm import tqdm
 
-from deeprank2.dataset import GraphDataset, GridDataset
+from deeprank2.dataset import (BatchLoader, GraphDataset, GridDataset,
+                               close_hdf5_files)
+from deeprank2.domain import edgestorage as Efeat
 from deeprank2.domain import losstypes as losses
+from deeprank2.domain import nodestorage as Nfeat
 from deeprank2.domain import targetstorage as targets
-from deeprank2.utils.community_pooling import (community_detection,
-                                               community_pooling)
+from deeprank2.features import components, contact
+from deeprank2.query import Query, QueryCollection, get_feature_module_names
+from deeprank2.utils.checkpointing import (CheckpointWriter, cpu_snapshot,
+                                           get_class_name, import_class)
+from deeprank2.utils.community_pooling import community_detection
 from deeprank2.utils.earlystopping import EarlyStopping
 from deeprank2.utils.exporters import (HDF5OutputExporter, OutputExporter,
-                                       OutputExporterCollection)
+                                       OutputExporterCollection,
+                                       PredictionWriter)
+from deeprank2.utils.packedgraphs import is_packed_graphs_file
+from deeprank2.utils.prefetcher import Prefetcher
 
 _log = logging.getLogger(__name__)
 
@@ -37,6 +64,12 @@ class Trainer():
                 cuda: bool = False,
                 ngpu: int = 0,
                 output_exporters: Optional[List[OutputExporter]] = None,
+                mixed_precision: bool = False,
+                num_threads: Optional[int] = None,
+                num_interop_threads: Optional[int] = None,
+                worker_affinity: bool = False,
+                distributed: bool = False,
+                trust_legacy_checkpoint: bool = False,
             ):
         """Class from which the network is trained, evaluated and tested.
 
@@ -63,10 +96,38 @@ class Trainer():
             output_exporters (Optional[List[OutputExporter]], optional): The output exporters to use for saving/exploring/plotting predictions/targets/losses
                 over the epochs. If None, defaults to :class:`HDF5OutputExporter`, which saves all the results in an .HDF5 file stored in ./output directory.
                 Defaults to None.
+            mixed_precision (bool, optional): Whether to run the model with automatic mixed precision, in bfloat16 where
+                possible, on CPU as well as on CUDA. The losses and outputs stay in float32. For a pretrained model,
+                the setting saved with it is used. Defaults to False.
+            num_threads (Optional[int], optional): Number of threads used by PyTorch for intra-op parallelism in this
+                process. Defaults to None (PyTorch default, usually the number of physical cores).
+            num_interop_threads (Optional[int], optional): Number of threads used by PyTorch for inter-op parallelism.
+                It can only be set once per process, before any parallel work. Defaults to None (PyTorch default).
+            worker_affinity (bool, optional): Whether to pin each data loader worker process to its own CPU core, starting
+                from the last available core, such that the workers don't compete with the threads of the training process
+                for the same cores. Only used on platforms that support it (Linux). Defaults to False.
+            distributed (bool, optional): Whether to train with :class:`torch.nn.parallel.DistributedDataParallel`, with one
+                :class:`Trainer` per process. The processes are started with e.g. `torchrun`, which sets the environment
+                variables used to initialize the process group, if it hasn't been initialized yet. The backend is gloo on CPU,
+                and nccl with CUDA, where each process uses the GPU of its local rank.
+                The training entries are divided over the processes, and the evaluated entries are gathered by the first
+                process (rank 0), which is the only one to export the outputs and save the model. Defaults to False.
+            trust_legacy_checkpoint (bool, optional): Whether to load a pretrained model saved by an earlier version of
+                deeprank2, which pickled the optimizer and loss function objects. Such files are loaded with
+                `torch.load(..., weights_only=False)`, which can run arbitrary code, so only set it for files from trusted
+                sources. Otherwise, loading them raises an error. Defaults to False.
         """
         self.batch_size_train = None
         self.batch_size_test = None
         self.shuffle = None
+        self.prefetch_depth = 0
+
+        self.distributed = distributed
+        self.trust_legacy_checkpoint = trust_legacy_checkpoint
+        self.rank = 0
+        self.world_size = 1
+        if self.distributed:
+            self._init_distributed(cuda, ngpu)
 
         self._init_output_exporters(output_exporters)
 
@@ -77,9 +138,14 @@ class Trainer():
 
         self.cuda = cuda
         self.ngpu = ngpu
+        self.mixed_precision = mixed_precision
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.worker_affinity = worker_affinity
+        self._configure_threads()
 
         if self.cuda and torch.cuda.is_available():
-            self.device = torch.device("cuda")
+            self.device = torch.device("cuda", int(os.environ.get("LOCAL_RANK", 0))) if self.distributed else torch.device("cuda")
             if self.ngpu == 0:
                 self.ngpu = 1
                 _log.info("CUDA detected. Setting number of GPUs to 1.")
@@ -175,9 +241,50 @@ class Trainer():
             self._load_params()
             self._load_pretrained_model()
 
+    def _init_distributed(self, cuda: bool, ngpu: int):
+        """Joins the process group of a distributed training, initializing it from the environment if needed."""
+
+        if not dist.is_available():
+            raise ValueError("Distributed training is not available in this PyTorch build.")
+        if ngpu > 1:
+            raise ValueError("Distributed training uses one GPU per process, set ngpu to 1 and start one process per GPU.")
+
+        if not dist.is_initialized():
+            dist.init_process_group(backend="nccl" if cuda else "gloo")
+        self.rank = dist.get_rank()
+        self.world_size = dist.get_world_size()
+        _log.info(f"Distributed training, process {self.rank} of {self.world_size}.")
+
+    def _unwrapped_model(self) -> nn.Module:
+        """The model, without its :class:`DistributedDataParallel` wrapper."""
+
+        if isinstance(self.model, nn.parallel.DistributedDataParallel):
+            return self.model.module
+        return self.model
+
+    def _configure_threads(self):
+        """Applies the PyTorch thread settings to this process."""
+
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads is not None and torch.get_num_interop_threads() != self.num_interop_threads:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError as e:
+                _log.warning(f"Could not set the number of inter-op threads to {self.num_interop_threads}: {e}")
+        _log.info(f"PyTorch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op.")
+
+    def _autocast(self) -> torch.autocast:
+        """Context for running the model, with bfloat16 autocasting if mixed precision is enabled."""
+
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16, enabled=self.mixed_precision)
+
     def _init_output_exporters(self, output_exporters: Optional[List[OutputExporter]]):
 
-        if output_exporters is not None:
+        if self.rank != 0:
+            # the outputs of all processes are exported by the first one
+            self._output_exporters = OutputExporterCollection()
+        elif output_exporters is not None:
             self._output_exporters = OutputExporterCollection(*output_exporters)
         else:
             self._output_exporters = OutputExporterCollection(HDF5OutputExporter('./output'))
@@ -285,48 +392,83 @@ class Trainer():
         _log.info("Testing set loaded\n")
         self._put_model_to_device(self.dataset_test)
 
-        # load the model and the optimizer state
+        # load the model and the optimizer state, the optimizer is created for the loaded model
+        self.configure_optimizers(self._optimizer_class, self.lr, self.weight_decay)
         self.optimizer.load_state_dict(self.opt_loaded_state_dict)
-        self.model.load_state_dict(self.model_load_state_dict)
+        self._unwrapped_model().load_state_dict(self.model_load_state_dict)
 
     def _precluster(self, dataset: GraphDataset):
         """Pre-clusters nodes of the graphs
 
+        In a distributed training, the first process clusters the graphs while the others wait for it.
+        All processes close their handles to the .HDF5 files first, as the files can't be written while
+        another process holds them open.
+
         Args:
             dataset (:class:`GraphDataset`)
         """
-        for fname, mol in tqdm(dataset.index_entries):
-            data = dataset.load_one_graph(fname, mol)
+        if self.distributed:
+            close_hdf5_files(dataset.hdf5_paths)
+            dist.barrier()
+        if self.rank == 0:
+            self._cluster_dataset(dataset)
+        if self.distributed:
+            dist.barrier()
+
+    def _cluster_dataset(self, dataset: GraphDataset):
+        """Clusters the nodes of the graphs of a dataset, and writes the clusters to its .HDF5 files.
+
+        The entries are clustered in parallel, by a process pool that only reads the graph structure of the entries.
+        The clusters are written to the .HDF5 files by this process, once all entries of a file have been clustered,
+        as the pool may still be reading the file. The clusters are stored with the signature of the graph they were
+        detected on, and entries with stored clusters of the same graph are skipped.
 
-            if data is None:
-                f5 = h5py.File(fname, "a")
-                try:
-                    _log.info(f"deleting {mol}")
-                    del f5[mol]
-                except BaseException:
-                    _log.info(f"{mol} not found")
-                f5.close()
-                continue
-
-            f5 = h5py.File(fname, "a")
-            grp = f5[mol]
-            clust_grp = grp.require_group("clustering")
-
-            if self.clustering_method.lower() in clust_grp:
-                del clust_grp[self.clustering_method.lower()]
-
-            method_grp = clust_grp.create_group(self.clustering_method.lower())
-            cluster = community_detection(
-                data.edge_index, data.num_nodes, method=self.clustering_method
-            )
-            method_grp.create_dataset("depth_0", data=cluster.cpu())
-            data = community_pooling(cluster, data)
-            cluster = community_detection(
-                data.edge_index, data.num_nodes, method=self.clustering_method
-            )
-            method_grp.create_dataset("depth_1", data=cluster.cpu())
+        Args:
+            dataset (:class:`GraphDataset`)
+        """
+        # packed files are read-only, their clusters have been packed from the processed files
+        packed_paths = []
+        for fname in dataset.hdf5_paths:
+            with h5py.File(fname, "r") as f5:
+                if is_packed_graphs_file(f5):
+                    _log.info(f"{fname} is a packed graphs file, using the clusters packed in it")
+                    packed_paths.append(fname)
+
+        tasks = [(fname, mol, self.clustering_method) for fname, mol in dataset.index_entries if fname not in packed_paths]
+        if len(tasks) == 0:
+            return
+
+        # the files are written below, and the pool's processes must not inherit open handles
+        close_hdf5_files(dataset.hdf5_paths)
+
+        remaining_counts = Counter(fname for fname, _, _ in tasks)
+        clusters_per_file = {fname: [] for fname in remaining_counts}
+        skipped_count = 0
+
+        pool = None
+        if len(tasks) >= _PRECLUSTER_PARALLEL_MIN_ENTRIES and (os.cpu_count() or 1) > 1:
+            pool = multiprocessing.Pool(min(len(tasks), os.cpu_count()))
+            results = pool.imap_unordered(_cluster_entry, tasks, chunksize=max(1, len(tasks) // (4 * os.cpu_count())))
+        else:
+            results = map(_cluster_entry, tasks)
+
+        try:
+            for fname, mol, clusters in tqdm(results, total=len(tasks)):
+                if clusters is None:
+                    skipped_count += 1
+                else:
+                    clusters_per_file[fname].append((mol, clusters))
 
-            f5.close()
+                remaining_counts[fname] -= 1
+                if remaining_counts[fname] == 0:
+                    _write_clusters(fname, self.clustering_method.lower(), clusters_per_file.pop(fname))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        if skipped_count > 0:
+            _log.info(f"{skipped_count} of {len(tasks)} entries were already clustered")
 
     def _put_model_to_device(self, dataset: Union[GraphDataset, GridDataset]):
         """
@@ -378,6 +520,10 @@ class Trainer():
             ids = list(range(self.ngpu))
             self.model = nn.DataParallel(self.model, device_ids=ids).to(self.device)
 
+        if self.distributed:
+            device_ids = [self.device.index] if self.device.type == "cuda" else None
+            self.model = nn.parallel.DistributedDataParallel(self.model, device_ids=device_ids)
+
         # check for compatibility
         for output_exporter in self._output_exporters:
             if not output_exporter.is_compatible_with(self.output_shape, target_shape):
@@ -496,11 +642,20 @@ class Trainer():
         validate: bool = False,
         num_workers: int = 0,
         best_model: bool = True,
-        filename: Optional[str] = 'model.pth.tar'
+        filename: Optional[str] = 'model.pth.tar',
+        batched_loading: bool = False,
+        prefetch_depth: int = 0,
+        checkpoint_directory: Optional[str] = None,
+        checkpoint_interval: Optional[int] = None,
+        checkpoint_keep_last: Optional[int] = None,
+        checkpoint_keep_best: int = 0,
     ):
         """
         Performs the training of the model.
 
+        The models are saved as snapshots of their state on CPU, and written to files in a background thread
+        (see :class:`deeprank2.utils.checkpointing.CheckpointWriter`), such that saving doesn't stall the training.
+
         Args:
             nepoch (int, optional): Maximum number of epochs to run.
                         Defaults to 1.
@@ -524,26 +679,53 @@ class Trainer():
                         Defaults to True.
             filename (str, optional): Name of the file where to save the selected model. If not None, the model is saved to `filename`.
                 If None, the model is not saved. Defaults to 'model.pth.tar'.
+            batched_loading (bool, optional): Whether to load each batch at once, with the entries grouped per .HDF5 file
+                (see :class:`deeprank2.dataset.BatchLoader`), instead of item by item.
+                        Defaults to False.
+            prefetch_depth (int, optional): Number of batches read ahead in a background thread while the model computes,
+                see :class:`deeprank2.utils.prefetcher.Prefetcher`. 0 means that the batches are read when needed.
+                        Defaults to 0.
+            checkpoint_directory (Optional[str], optional): Directory where to save checkpoints of the model during training,
+                which can be loaded as pretrained models. Defaults to None, which saves no checkpoints.
+            checkpoint_interval (Optional[int], optional): Number of epochs between periodic checkpoints, `epoch-<epoch>.pth.tar`.
+                        Defaults to None, which saves no periodic checkpoints.
+            checkpoint_keep_last (Optional[int], optional): Number of periodic checkpoints kept, the older ones are removed.
+                        Defaults to None, which keeps all of them.
+            checkpoint_keep_best (int, optional): Number of checkpoints with the lowest validation loss (or training loss,
+                without validation) kept, `best-epoch-<epoch>.pth.tar`.
+                        Defaults to 0.
         """
         self.batch_size_train = batch_size
         self.shuffle = shuffle
+        self.prefetch_depth = prefetch_depth
 
-        self.train_loader = DataLoader(
+        self.train_loader = self._create_loader(
             self.dataset_train,
             batch_size=self.batch_size_train,
             shuffle=self.shuffle,
             num_workers=num_workers,
-            pin_memory=self.cuda
+            batched_loading=batched_loading,
+            training=True
         )
         _log.info("Training set loaded\n")
 
+        # in a distributed training, the training set is evaluated without the entries padded by its sampler
+        train_eval_loader = self.train_loader
+        if self.distributed:
+            train_eval_loader = self._create_loader(
+                self.dataset_train,
+                batch_size=self.batch_size_train,
+                num_workers=num_workers,
+                batched_loading=batched_loading
+            )
+
         if self.dataset_val is not None:
-            self.valid_loader = DataLoader(
+            self.valid_loader = self._create_loader(
                 self.dataset_val,
                 batch_size=self.batch_size_train,
                 shuffle=self.shuffle,
                 num_workers=num_workers,
-                pin_memory=self.cuda
+                batched_loading=batched_loading
             )
             _log.info("Validation set loaded\n")
         else:
@@ -552,13 +734,10 @@ class Trainer():
 
         # Assign weights to each class
         if self.task == targets.CLASSIF and self.class_weights:
-            targets_all = []
-            for batch in self.train_loader:
-                targets_all.append(batch.y)
-
-            targets_all = torch.cat(targets_all).squeeze().tolist()
+            # read from the targets of the entries, rather than from loading all of the training data
+            targets_all = self.dataset_train.get_target_values().astype(np.float32)
             self.weights = torch.tensor(
-                [targets_all.count(i) for i in self.classes], dtype=torch.float32
+                [np.count_nonzero(targets_all == i) for i in self.classes], dtype=torch.float32
             )
             _log.info(f"class occurences: {self.weights}")
             self.weights = 1.0 / self.weights
@@ -577,17 +756,24 @@ class Trainer():
 
         train_losses = []
         valid_losses = []
+        # the model selected in this call, a previous training or a pretrained model may have set the epoch
+        checkpoint_model = None
+        self.epoch_saved_model = None
 
         if earlystop_patience or earlystop_maxgap:
             early_stopping = EarlyStopping(patience=earlystop_patience, maxgap=earlystop_maxgap, min_epoch=min_epoch, trace_func=_log.info)
         else:
             early_stopping = None
 
-        with self._output_exporters:
+        # only the first process of a distributed training saves the model
+        checkpoints = CheckpointWriter(checkpoint_directory if self.rank == 0 else None, checkpoint_interval,
+                                       checkpoint_keep_last, checkpoint_keep_best)
+
+        with self._output_exporters, checkpoints:
             # Number of epochs
             self.nepoch = nepoch
             _log.info('Epoch 0:')
-            self._eval(self.train_loader, 0, "training")
+            self._eval(train_eval_loader, 0, "training")
             if validate:
                 if self.valid_loader is None:
                     raise ValueError("No validation dataset provided.")
@@ -608,15 +794,9 @@ class Trainer():
                     valid_losses.append(loss_)
                     if best_model:
                         if min(valid_losses) == loss_:
-                            checkpoint_model = self._save_model()
+                            checkpoint_model = self._save_model(epoch)
                             self.epoch_saved_model = epoch
                             _log.info(f'Best model saved at epoch # {self.epoch_saved_model}.')
-                    # check early stopping criteria (in validation case only)
-                    if early_stopping:
-                        # compare last validation and training loss
-                        early_stopping(epoch, valid_losses[-1], train_losses[-1])
-                        if early_stopping.early_stop:
-                            break
 
                 else:
                     # if no validation set, save the best performing model on the training set
@@ -625,23 +805,94 @@ class Trainer():
                             _log.warning(
                                 "Training data is used both for learning and model selection, which will to overfitting." +
                                 "\n\tIt is preferable to use an independent training and validation data sets.")
-                            checkpoint_model = self._save_model()
+                            checkpoint_model = self._save_model(epoch)
                             self.epoch_saved_model = epoch
                             _log.info(f'Best model saved at epoch # {self.epoch_saved_model}.')
 
+                if checkpoints.is_due(epoch, loss_):
+                    # reuse the snapshot of the best model, if it was taken at this epoch
+                    if checkpoint_model is not None and checkpoint_model["epoch_saved_model"] == epoch:
+                        state = checkpoint_model
+                    else:
+                        state = self._save_model(epoch)
+                    checkpoints.save_epoch(epoch, loss_, state)
+
+                # check early stopping criteria (in validation case only)
+                if validate and early_stopping:
+                    # compare last validation and training loss
+                    early_stopping(epoch, valid_losses[-1], train_losses[-1])
+                    if early_stopping.early_stop:
+                        break
+
             # Save the last model
             if best_model is False:
-                checkpoint_model = self._save_model()
+                checkpoint_model = self._save_model(epoch)
                 self.epoch_saved_model = epoch
                 _log.info(f'Last model saved at epoch # {self.epoch_saved_model}.')
 
-        # Now that the training loop is over, save the model
-        if filename:
-            torch.save(checkpoint_model, filename)
+            # Now that the training loop is over, save the model; the writing is waited for when leaving this block
+            if filename and self.rank == 0:
+                checkpoints.save(filename, checkpoint_model)
+
         self.opt_loaded_state_dict = checkpoint_model["optimizer_state"]
         self.model_load_state_dict = checkpoint_model["model_state"]
         self.optimizer.load_state_dict(self.opt_loaded_state_dict)
-        self.model.load_state_dict(self.model_load_state_dict)
+        self._unwrapped_model().load_state_dict(self.model_load_state_dict)
+
+    def _create_loader( # pylint: disable=too-many-arguments
+        self,
+        dataset: Union[GraphDataset, GridDataset],
+        batch_size: int,
+        shuffle: bool = False,
+        num_workers: int = 0,
+        batched_loading: bool = False,
+        training: bool = False
+    ) -> Union[DataLoader, BatchLoader]:
+
+        worker_init_fn = None
+        if self.worker_affinity and num_workers > 0 and hasattr(os, "sched_getaffinity"):
+            worker_init_fn = partial(_pin_worker, sorted(os.sched_getaffinity(0)))
+
+        sampler = None
+        if self.distributed:
+            # the training entries are padded to the same number per process, to keep the gradient updates in step
+            if training:
+                sampler = DistributedSampler(dataset, num_replicas=self.world_size, rank=self.rank, shuffle=shuffle)
+            else:
+                sampler = _DistributedEvalSampler(dataset, self.world_size, self.rank)
+            shuffle = False
+
+        if batched_loading:
+            return BatchLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler, num_workers=num_workers,
+                               pin_memory=self.cuda, worker_init_fn=worker_init_fn)
+        return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler, num_workers=num_workers,
+                          pin_memory=self.cuda, worker_init_fn=worker_init_fn)
+
+    def _train_sampler(self) -> DistributedSampler:
+        return _item_sampler(self.train_loader)
+
+    def _gather_outputs( # pylint: disable=too-many-arguments
+        self,
+        entry_names: List[str],
+        outputs: np.ndarray,
+        target_vals: np.ndarray,
+        sum_of_losses: float,
+        count_predictions: int
+    ) -> Tuple[List[str], np.ndarray, np.ndarray, float, int]:
+        """Gathers the outputs and losses of a pass from all processes of a distributed training."""
+
+        if not self.distributed:
+            return entry_names, outputs, target_vals, sum_of_losses, count_predictions
+
+        gathered = [None] * self.world_size
+        dist.all_gather_object(gathered, (entry_names, outputs, target_vals, sum_of_losses, count_predictions))
+
+        entry_names = [entry_name for process_outputs in gathered for entry_name in process_outputs[0]]
+        outputs = np.concatenate([process_outputs[1] for process_outputs in gathered])
+        target_vals = np.concatenate([process_outputs[2] for process_outputs in gathered])
+        sum_of_losses = sum(process_outputs[3] for process_outputs in gathered)
+        count_predictions = sum(process_outputs[4] for process_outputs in gathered)
+        return entry_names, outputs, target_vals, sum_of_losses, count_predictions
 
     def _epoch(self, epoch_number: int, pass_name: str) -> float:
         """
@@ -655,26 +906,44 @@ class Trainer():
             Running loss.
         """
 
-        sum_of_losses = 0
+        sum_of_losses = torch.zeros((), device=self.device)
         count_predictions = 0
-        target_vals = []
-        outputs = []
+        accumulator = _OutputAccumulator(len(_item_sampler(self.train_loader)))
         entry_names = []
         t0 = time()
-        for data_batch in self.train_loader:
+        # the entries padded by the distributed sampler come last on each process, they are trained on to keep
+        # the processes in step, but left out of the loss and outputs of the epoch
+        unpadded_count = None
+        item_count = 0
+        if self.distributed:
+            self._train_sampler().set_epoch(epoch_number)
+            unpadded_count = len(range(self.rank, len(self.dataset_train), self.world_size))
+        loader = Prefetcher(self.train_loader, self.prefetch_depth, self.device if self.cuda else None)
+        for data_batch in loader:
             if self.cuda:
                 data_batch = data_batch.to(self.device, non_blocking=True)
             self.optimizer.zero_grad()
-            pred = self.model(data_batch)
+            with self._autocast():
+                pred = self.model(data_batch)
+            pred = pred.float()
             pred, data_batch.y = self._format_output(pred, data_batch.y)
             loss_ = self.lossfunction(pred, data_batch.y)
             loss_.backward()
             self.optimizer.step()
+
+            batch_entry_names = data_batch.entry_names
+            item_count += pred.shape[0]
+            if unpadded_count is not None and item_count > unpadded_count:
+                kept_count = max(0, pred.shape[0] - (item_count - unpadded_count))
+                if kept_count == 0:
+                    continue
+                pred, data_batch.y = pred[:kept_count], data_batch.y[:kept_count]
+                batch_entry_names = batch_entry_names[:kept_count]
+                loss_ = self.lossfunction(pred.detach(), data_batch.y)
             count_predictions += pred.shape[0]
 
-            # convert mean back to sum
-            sum_of_losses += loss_.detach().item() * pred.detach().shape[0]
-            target_vals += data_batch.y.detach().cpu().numpy().tolist()
+            # convert mean back to sum, kept on the device until the end of the epoch
+            sum_of_losses += loss_.detach() * pred.shape[0]
 
             # Get the outputs for export
             # Remember that non-linear activation is automatically applied in CrossEntropyLoss
@@ -682,12 +951,15 @@ class Trainer():
                 pred = F.softmax(pred.detach(), dim=1)
             else:
                 pred = pred.detach().reshape(-1)
-            outputs += pred.cpu().numpy().tolist()
+            accumulator.add(pred, data_batch.y.detach())
 
             # Get the name
-            entry_names += data_batch.entry_names
+            entry_names += batch_entry_names
 
         dt = time() - t0
+        loader.log_metrics(pass_name)
+        entry_names, outputs, target_vals, sum_of_losses, count_predictions = self._gather_outputs(
+            entry_names, accumulator.outputs(), accumulator.targets(), sum_of_losses.item(), count_predictions)
         if count_predictions > 0:
             epoch_loss = sum_of_losses / count_predictions
         else:
@@ -720,25 +992,28 @@ class Trainer():
 
         # Sets the module in evaluation mode
         self.model.eval()
+        # without the synchronization of DistributedDataParallel, as the processes evaluate different numbers of batches
+        model = self._unwrapped_model()
         loss_func = self.lossfunction
-        target_vals = []
-        outputs = []
+        accumulator = _OutputAccumulator(len(_item_sampler(loader)))
         entry_names = []
-        sum_of_losses = 0
+        sum_of_losses = torch.zeros((), device=self.device)
         count_predictions = 0
         t0 = time()
+        loader = Prefetcher(loader, self.prefetch_depth, self.device if self.cuda else None)
         for data_batch in loader:
             if self.cuda:
                 data_batch = data_batch.to(self.device, non_blocking=True)
-            pred = self.model(data_batch)
+            with self._autocast():
+                pred = model(data_batch)
+            pred = pred.float()
             pred, y = self._format_output(pred, data_batch.y)
 
             # Check if a target value was provided (i.e. benchmarck scenario)
             if y is not None:
-                target_vals += y.cpu().numpy().tolist()
                 loss_ = loss_func(pred, y)
                 count_predictions += pred.shape[0]
-                sum_of_losses += loss_.detach().item() * pred.shape[0]
+                sum_of_losses += loss_.detach() * pred.shape[0]
 
             # Get the outputs for export
             # Remember that non-linear activation is automatically applied in CrossEntropyLoss
@@ -746,12 +1021,15 @@ class Trainer():
                 pred = F.softmax(pred.detach(), dim=1)
             else:
                 pred = pred.detach().reshape(-1)
-            outputs += pred.cpu().numpy().tolist()
+            accumulator.add(pred, y)
 
             # get the name
             entry_names += data_batch.entry_names
 
         dt = time() - t0
+        loader.log_metrics(pass_name)
+        entry_names, outputs, target_vals, sum_of_losses, count_predictions = self._gather_outputs(
+            entry_names, accumulator.outputs(), accumulator.targets(), sum_of_losses.item(), count_predictions)
         if count_predictions > 0:
             eval_loss = sum_of_losses / count_predictions
         else:
@@ -812,7 +1090,9 @@ class Trainer():
     def test(
         self,
         batch_size: int = 32,
-        num_workers: int = 0):
+        num_workers: int = 0,
+        batched_loading: bool = False,
+        prefetch_depth: int = 0):
         """
         Performs the testing of the model.
 
@@ -821,17 +1101,24 @@ class Trainer():
                         Defaults to 32.
             num_workers (int, optional): How many subprocesses to use for data loading. 0 means that the data will be loaded in the main process.
                         Defaults to 0.
+            batched_loading (bool, optional): Whether to load each batch at once, with the entries grouped per .HDF5 file
+                (see :class:`deeprank2.dataset.BatchLoader`), instead of item by item.
+                        Defaults to False.
+            prefetch_depth (int, optional): Number of batches read ahead in a background thread while the model computes,
+                see :class:`deeprank2.utils.prefetcher.Prefetcher`. 0 means that the batches are read when needed.
+                        Defaults to 0.
         """
         self.batch_size_test = batch_size
+        self.prefetch_depth = prefetch_depth
 
         if self.dataset_test is not None:
             _log.info("Loading independent testing dataset...")
 
-            self.test_loader = DataLoader(
+            self.test_loader = self._create_loader(
                 self.dataset_test,
                 batch_size=self.batch_size_test,
                 num_workers=num_workers,
-                pin_memory=self.cuda
+                batched_loading=batched_loading
             )
             _log.info("Testing set loaded\n")
         else:
@@ -843,12 +1130,116 @@ class Trainer():
             # Run test
             self._eval(self.test_loader, self.epoch_saved_model, "testing")
 
+    def predict( # pylint: disable=too-many-arguments, too-many-locals, dangerous-default-value
+        self,
+        data: Union[GraphDataset, GridDataset, QueryCollection, List[Query]],
+        output_path: Optional[str] = None,
+        batch_size: int = 256,
+        num_workers: int = 0,
+        batched_loading: bool = False,
+        prefetch_depth: int = 0,
+        feature_modules: Union[ModuleType, List[ModuleType], str, List[str]] = [components, contact],
+        queue_size: int = 512,
+        hdf5_prefix: Optional[str] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        Predicts the outputs of the model for new entries, for instance to rescore docking models.
+
+        Unlike :meth:`test`, no loss is computed and no target values are needed. The outputs are not passed to the
+        output exporters, but written batch by batch by a :class:`deeprank2.utils.exporters.PredictionWriter`.
+        For classification the outputs are the probabilities of the classes, for regression the predicted values.
+
+        The graphs of queries are built by worker processes and pushed through a bounded queue to the model as soon as
+        they are built, such that they are predicted in the order in which they are built. They are read in memory,
+        with the features transformations, standardization and clustering of the dataset that the Trainer was created with,
+        and are only written to .HDF5 files if `hdf5_prefix` is set. In a distributed training, each process
+        predicts its share of the entries, so each process needs its own output path.
+
+        Args:
+            data (Union[:class:`GraphDataset`, :class:`GridDataset`, :class:`QueryCollection`, List[:class:`Query`]]): The entries
+                to predict, either as a dataset or as queries of graphs.
+            output_path (Optional[str], optional): Path of the .csv, .hdf5 or .h5 file to write the predictions to.
+                        Defaults to None, which returns the predictions.
+            batch_size (int, optional): Sets the size of the batch.
+                        Defaults to 256.
+            num_workers (int, optional): How many subprocesses to use for data loading, or for building the graphs of queries.
+                0 means that the data will be loaded or built in the main process.
+                        Defaults to 0.
+            batched_loading (bool, optional): Whether to load each batch of a dataset at once, see :meth:`test`.
+                        Defaults to False.
+            prefetch_depth (int, optional): Number of batches read ahead in a background thread while the model computes,
+                see :class:`deeprank2.utils.prefetcher.Prefetcher`. 0 means that the batches are read when needed.
+                        Defaults to 0.
+            feature_modules (Union[ModuleType, List[ModuleType], str, List[str]], optional): Features' modules used to build
+                the graphs of queries, as in :meth:`deeprank2.query.QueryCollection.process`. They must generate the features
+                used by the model. Defaults to the basic feature modules `deeprank2.features.components` and `deeprank2.features.contact`.
+            queue_size (int, optional): Maximum number of graphs of queries built ahead of the model.
+                        Defaults to 512.
+            hdf5_prefix (Optional[str], optional): Prefix of the .HDF5 files to also write the graphs of queries to,
+                one file `<hdf5_prefix>-<process id>.hdf5` per building process. Defaults to None, which does not write them.
+
+        Returns:
+            Optional[:class:`pd.DataFrame`]: The entry names and outputs, if no output path is given.
+        """
+
+        if not isinstance(data, (GraphDataset, GridDataset)):
+            reference_dataset = self.dataset_train if self.dataset_train is not None else self.dataset_test
+            if not isinstance(reference_dataset, GraphDataset):
+                raise TypeError(f"Predicting from queries requires a Trainer created with a GraphDataset, not {type(reference_dataset)}.")
+            queries = list(data)
+            if self.distributed:
+                queries = queries[self.rank::self.world_size]
+            loader = _QueryPipeline(queries, reference_dataset, get_feature_module_names(feature_modules), self.clustering_method,
+                                    batch_size, num_workers, queue_size, hdf5_prefix)
+        else:
+            loader = self._create_loader(data, batch_size=batch_size, num_workers=num_workers, batched_loading=batched_loading)
+
+        self.model.eval()
+        model = self._unwrapped_model()
+        writer = PredictionWriter(output_path)
+        t0 = time()
+        loader = Prefetcher(loader, prefetch_depth, self.device if self.cuda else None)
+        with writer:
+            for data_batch in loader:
+                if self.cuda:
+                    data_batch = data_batch.to(self.device, non_blocking=True)
+
+                # the batches are loaded outside of inference mode, as cached entries may be used for training later on
+                with torch.inference_mode():
+                    with self._autocast():
+                        pred = model(data_batch)
+                    pred = pred.float()
+                    if self.task == targets.CLASSIF:
+                        pred = F.softmax(pred, dim=1)
+                    else:
+                        pred = pred.reshape(-1)
+                    writer.write(list(data_batch.entry_names), pred.cpu().numpy())
+
+        loader.log_metrics("prediction")
+        _log.info(f"prediction | time {time() - t0}")
+
+        return writer.dataframe()
+
     def _load_params(self):
         """
         Loads the parameters of a pretrained model
+
+        Raises:
+            ValueError: If the model was saved by an earlier version of deeprank2 and trust_legacy_checkpoint isn't set.
         """
 
-        state = torch.load(self.pretrained_model_path)
+        try:
+            state = torch.load(self.pretrained_model_path, map_location="cpu", weights_only=True)
+        except pickle.UnpicklingError as e:
+            # saved by earlier versions, which pickled the optimizer and loss function objects
+            if not self.trust_legacy_checkpoint:
+                raise ValueError(
+                    f"{self.pretrained_model_path} is a model saved by an earlier version of deeprank2, which can only be "
+                    "loaded with torch.load(..., weights_only=False) and can run arbitrary code. If the file comes from a "
+                    "trusted source, set trust_legacy_checkpoint=True in Trainer to load it.") from e
+            _log.warning(f"{self.pretrained_model_path} is a model saved by an earlier version of deeprank2, which is loaded "
+                         "with weights_only=False. Only load such files from trusted sources.")
+            state = torch.load(self.pretrained_model_path, map_location="cpu", weights_only=False)
 
         self.target = state["target"]
         self.batch_size_train = state["batch_size_train"]
@@ -862,29 +1253,50 @@ class Trainer():
         self.task = state["task"]
         self.classes = state["classes"]
         self.shuffle = state["shuffle"]
-        self.optimizer = state["optimizer"]
         self.opt_loaded_state_dict = state["optimizer_state"]
-        self.lossfunction = state["lossfunction"]
         self.model_load_state_dict = state["model_state"]
+        self.epoch_saved_model = state.get("epoch_saved_model")
+        if "optimizer" in state:
+            # saved by earlier versions, with the optimizer and loss function objects
+            self._optimizer_class = type(state["optimizer"])
+            self.lossfunction = state["lossfunction"]
+        else:
+            self._optimizer_class = import_class(state["optimizer_class"])
+            lossfunction_class = import_class(state["lossfunction_class"])
+            self.weights = state["weights"]
+            if self.weights is not None:
+                self.lossfunction = lossfunction_class(weight=self.weights.to(self.device))
+            else:
+                self.lossfunction = lossfunction_class()
         self.clustering_method = state["clustering_method"]
         self.node_features = state["node_features"]
         self.edge_features = state["edge_features"]
         self.features = state["features"]
         self.cuda = state["cuda"]
         self.ngpu = state["ngpu"]
+        # models saved by earlier versions were trained in float32
+        self.mixed_precision = state.get("mixed_precision", False)
 
-    def _save_model(self):
+    def _save_model(self, epoch: Optional[int] = None) -> dict:
         """
-        Saves the model to a file.
+        Takes a snapshot of the model to save, with the model and optimizer states copied to CPU.
+
+        Only serializable settings are saved, the optimizer and the loss function are saved as the names of their classes.
 
         Args:
-            filename (str, optional): Name of the file. Defaults to None.
+            epoch (Optional[int], optional): The epoch of the model. Defaults to None.
+
+        Returns:
+            dict: The state to save.
         """
+        lossfunction_class = self.lossfunction if isinstance(self.lossfunction, type) else type(self.lossfunction)
         state = {
-            "model_state": self.model.state_dict(),
-            "optimizer": self.optimizer,
-            "optimizer_state": self.optimizer.state_dict(),
-            "lossfunction": self.lossfunction,
+            "model_state": cpu_snapshot(self._unwrapped_model().state_dict()),
+            "optimizer_class": get_class_name(type(self.optimizer)),
+            "optimizer_state": cpu_snapshot(self.optimizer.state_dict()),
+            "lossfunction_class": get_class_name(lossfunction_class),
+            "weights": cpu_snapshot(self.weights) if self.class_weights else None,
+            "epoch_saved_model": epoch,
             "target": self.target,
             "task": self.task,
             "classes": self.classes,
@@ -902,12 +1314,392 @@ class Trainer():
             "edge_features": self.edge_features,
             "features": self.features,
             "cuda": self.cuda,
-            "ngpu": self.ngpu
+            "ngpu": self.ngpu,
+            "mixed_precision": self.mixed_precision,
+            "num_threads": torch.get_num_threads(),
+            "num_interop_threads": torch.get_num_interop_threads(),
+            "worker_affinity": self.worker_affinity,
         }
 
         return state
 
 
+class _OutputAccumulator:
+    """Accumulates the outputs and targets of the batches of a pass in tensors on the device of the model.
+
+    The tensors are allocated for the expected number of items at the first batch, and copied to the host once,
+    when the arrays are requested, rather than converting every batch to Python lists.
+
+    Args:
+        size (int): The expected number of items. The tensors grow if more items are added.
+    """
+
+    def __init__(self, size: int):
+        self._size = max(size, 1)
+        self._count = 0
+        self._outputs = None
+        self._targets = None
+
+    @staticmethod
+    def _store(buffer: Optional[torch.Tensor], values: torch.Tensor, count: int, size: int) -> torch.Tensor:
+        if buffer is None:
+            buffer = values.new_empty((max(size, len(values)),) + values.shape[1:])
+        elif count + len(values) > len(buffer):
+            grown = buffer.new_empty((max(2 * len(buffer), count + len(values)),) + buffer.shape[1:])
+            grown[:count] = buffer[:count]
+            buffer = grown
+        buffer[count:count + len(values)] = values
+        return buffer
+
+    def add(self, outputs: torch.Tensor, targets: Optional[torch.Tensor] = None):
+        """Adds the outputs of a batch, and its targets if any."""
+
+        self._outputs = self._store(self._outputs, outputs, self._count, self._size)
+        if targets is not None:
+            self._targets = self._store(self._targets, targets, self._count, self._size)
+        self._count += len(outputs)
+
+    def outputs(self) -> np.ndarray:
+        if self._outputs is None:
+            return np.empty(0)
+        return self._outputs[:self._count].cpu().numpy()
+
+    def targets(self) -> np.ndarray:
+        """The targets, or an empty array if no targets were added."""
+
+        if self._targets is None:
+            return np.empty(0)
+        return self._targets[:self._count].cpu().numpy()
+
+
+class _QueryPipeline:
+    """Builds the graphs of queries in worker processes, and gives them in batches as soon as they are built.
+
+    Each worker builds every `num_workers`-th query, and pushes the graphs through a queue of at most `queue_size` graphs,
+    such that the workers wait when the consumer of the batches falls behind. The graphs are given in the order
+    in which they are built. With 0 workers, the graphs are built in the calling process.
+    Queries that cannot be built are skipped with a warning, as in :meth:`QueryCollection.process`.
+
+    Args:
+        queries (List[:class:`Query`]): The queries.
+        dataset (:class:`GraphDataset`): The dataset whose features plans and settings are used to read the graphs.
+        feature_names (List[str]): The names of the features' modules in `deeprank2.features` used to build the graphs.
+        clustering_method (Optional[str]): Clustering method of the model, None if it does not use clusters.
+        batch_size (int): Number of graphs per batch.
+        num_workers (int, optional): Number of processes building the graphs. Defaults to 0.
+        queue_size (int, optional): Maximum number of built graphs waiting to be batched. Defaults to 512.
+        hdf5_prefix (Optional[str], optional): If set, each process also writes the graphs it builds, with their clusters,
+            to its own .HDF5 file `<hdf5_prefix>-<process id>.hdf5`, as :meth:`QueryCollection.process` with
+            `combine_output=False` does. Defaults to None.
+    """
+
+    def __init__( # pylint: disable=too-many-arguments
+        self,
+        queries: List[Query],
+        dataset: GraphDataset,
+        feature_names: List[str],
+        clustering_method: Optional[str],
+        batch_size: int,
+        num_workers: int = 0,
+        queue_size: int = 512,
+        hdf5_prefix: Optional[str] = None
+    ):
+        if num_workers < 0:
+            raise ValueError(f"The number of workers can't be negative, got {num_workers}")
+        if queue_size < 1:
+            raise ValueError(f"The queue size must be positive, got {queue_size}")
+
+        self.queries = queries
+        self.dataset = dataset
+        self.feature_names = feature_names
+        self.clustering_method = clustering_method
+        self.batch_size = batch_size
+        self.num_workers = min(num_workers, len(queries))
+        self.queue_size = queue_size
+        self.hdf5_prefix = hdf5_prefix
+
+    def __len__(self) -> int:
+        return -(-len(self.queries) // self.batch_size)
+
+    def _batches(self, graphs: Iterator[Data]) -> Iterator[Batch]:
+        data_list = []
+        for data in graphs:
+            data_list.append(data)
+            if len(data_list) == self.batch_size:
+                yield Batch.from_data_list(data_list)
+                data_list = []
+        if len(data_list) > 0:
+            yield Batch.from_data_list(data_list)
+
+    def __iter__(self) -> Iterator[Batch]:
+
+        if self.num_workers == 0:
+            return self._batches(_build_query_graphs(
+                self.queries, self.dataset, self.feature_names, self.clustering_method, self.hdf5_prefix))
+        return self._batches(self._received_graphs())
+
+    def _received_graphs(self) -> Iterator[Data]:
+
+        # tensors are passed through shared memory, which the workers keep sharing until all graphs are received
+        context = torch.multiprocessing.get_context()
+        graphs = context.Queue(maxsize=self.queue_size)
+        received = context.Event()
+        workers = [
+            context.Process(
+                target=_push_query_graphs,
+                args=(self.queries[worker_index::self.num_workers], self.dataset, self.feature_names,
+                      self.clustering_method, self.hdf5_prefix, graphs, received),
+                name=f"deeprank2-query-builder-{worker_index}",
+                daemon=True)
+            for worker_index in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            finished_count = 0
+            while finished_count < len(workers):
+                try:
+                    data = graphs.get(timeout=1.0)
+                except queue.Empty:
+                    failed = [worker.name for worker in workers if worker.exitcode not in (None, 0)]
+                    if len(failed) > 0:
+                        raise RuntimeError(f"Graph building process(es) {', '.join(failed)} exited unexpectedly.") # pylint: disable=raise-missing-from
+                    continue
+
+                if data is None:
+                    finished_count += 1
+                else:
+                    yield data
+        finally:
+            received.set()
+            for worker in workers:
+                worker.join(timeout=1.0)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+
+def _build_query_graphs(
+    queries: List[Query],
+    dataset: GraphDataset,
+    feature_names: List[str],
+    clustering_method: Optional[str],
+    hdf5_prefix: Optional[str]
+) -> Iterator[Data]:
+    """Builds the graphs of queries, see :class:`_QueryPipeline`."""
+
+    feature_modules = [importlib.import_module("deeprank2.features." + name) for name in feature_names]
+    # because only one process may access an hdf5 file at a time:
+    hdf5_path = None if hdf5_prefix is None else f"{hdf5_prefix}-{os.getpid()}.hdf5"
+
+    for query in queries:
+        try:
+            data = _query_to_data(query, dataset, feature_modules, clustering_method, hdf5_path)
+        except (ValueError, AttributeError, KeyError, TimeoutError) as e:
+            _log.warning(f'\nGraph/Query with ID {query.get_query_id()} ran into an Exception ({e.__class__.__name__}: {e}),'
+                         ' and it has not been predicted. More details below:')
+            _log.exception(e)
+            continue
+        yield data
+
+
+def _push_query_graphs( # pylint: disable=too-many-arguments
+    queries: List[Query],
+    dataset: GraphDataset,
+    feature_names: List[str],
+    clustering_method: Optional[str],
+    hdf5_prefix: Optional[str],
+    graphs: torch.multiprocessing.Queue,
+    received: torch.multiprocessing.Event
+):
+    """Builds the graphs of queries in a worker process of a :class:`_QueryPipeline`, followed by None when done.
+
+    The process waits for the consumer to have received all graphs before exiting, as the memory of their tensors is shared by it.
+    """
+
+    for data in _build_query_graphs(queries, dataset, feature_names, clustering_method, hdf5_prefix):
+        graphs.put(data)
+    graphs.put(None)
+    received.wait()
+
+
+def _query_to_data( # pylint: disable=too-many-arguments
+    query: Query,
+    dataset: GraphDataset,
+    feature_modules: List[ModuleType],
+    clustering_method: Optional[str],
+    hdf5_path: Optional[str] = None
+) -> Data:
+    """Builds the graph of a query and reads it as an entry of a graph dataset.
+
+    Args:
+        query (:class:`Query`): The query.
+        dataset (:class:`GraphDataset`): The dataset whose features plans and settings are used to read the graph.
+        feature_modules (List[ModuleType]): The features' modules used to build the graph.
+        clustering_method (Optional[str]): Clustering method for the nodes, None to skip clustering.
+        hdf5_path (Optional[str], optional): .HDF5 file to write the graph to. Defaults to None, which writes it to an in-memory file.
+
+    Returns:
+        :class:`torch_geometric.data.data.Data`: The graph, without target value.
+    """
+
+    graph = query.build(feature_modules)
+
+    if hdf5_path is None:
+        hdf5_path = io.BytesIO()
+    graph.write_to_hdf5(hdf5_path)
+    with h5py.File(hdf5_path, "a") as f5:
+        grp = f5[graph.id]
+        if clustering_method is not None:
+            clusters = _cluster_group(grp, clustering_method)
+            if clusters is not None:
+                _write_group_clusters(grp, clustering_method.lower(), *clusters)
+        fname = hdf5_path if isinstance(hdf5_path, str) else "<in-memory graph>"
+        return dataset.load_graph_group(grp, graph.id, fname, load_target=False)
+
+
+def _item_sampler(loader: Union[DataLoader, BatchLoader]) -> Sampler:
+    """The sampler of the items of a loader, whether they are batched by the loader or by its sampler."""
+
+    sampler = loader.batch_sampler if loader.batch_sampler is not None else loader.sampler
+    if isinstance(sampler, BatchSampler):
+        sampler = sampler.sampler
+    return sampler
+
+
+class _DistributedEvalSampler(Sampler):
+    """Samples every `world_size`-th item from `rank` on, such that each item is evaluated once by one of the processes."""
+
+    def __init__(self, dataset: Union[GraphDataset, GridDataset], world_size: int, rank: int):
+        super().__init__()
+        self._indices = range(rank, len(dataset), world_size)
+
+    def __iter__(self):
+        return iter(self._indices)
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+
+def _pin_worker(cores: List[int], worker_id: int):
+    """Pins a data loader worker process to one core, starting from the last one."""
+
+    os.sched_setaffinity(0, {cores[-1 - worker_id % len(cores)]})
+
+
+# below this number of entries to cluster, starting processes takes longer than clustering them
+_PRECLUSTER_PARALLEL_MIN_ENTRIES = 16
+
+
+def _cluster_entry(task: Tuple[str, str, str]) -> Tuple[str, str, Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]]:
+    """Clusters the nodes of a graph at depth 0, and the clusters of the pooled graph at depth 1.
+
+    Only the number of nodes and the edge index of the entry are read.
+
+    Args:
+        task (Tuple[str, str, str]): .HDF5 file name, entry name and clustering method.
+
+    Returns:
+        Tuple[str, str, Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]]: The file name, the entry name, and
+            the clusters at depth 0 and 1 with the signature of the graph, see :func:`_graph_signature`.
+            The clusters are None if the stored clusters of the entry were detected on the same graph.
+    """
+
+    fname, mol, method = task
+    with h5py.File(fname, "r") as f5:
+        return fname, mol, _cluster_group(f5[mol], method)
+
+
+def _graph_signature(node_count: int, ind: np.ndarray) -> Tuple[int, str]:
+    """The signature of a graph, which tells whether stored clusters were detected on it.
+
+    Args:
+        node_count (int): The number of nodes.
+        ind (np.ndarray): The edge index, as stored in the .HDF5 file.
+
+    Returns:
+        Tuple[int, str]: The number of edges, and a hash of the number of nodes and of the edge index.
+    """
+
+    digest = hashlib.sha1(f"{node_count}:{ind.shape}:{ind.dtype.str}:".encode())
+    digest.update(np.ascontiguousarray(ind).tobytes())
+    return len(ind), digest.hexdigest()
+
+
+def _cluster_group(grp: h5py.Group, method: str) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]:
+    """Clusters the nodes of the graph in an entry group, see :func:`_cluster_entry`.
+
+    Args:
+        grp (:class:`h5py.Group`): The entry group.
+        method (str): Clustering method.
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]: The clusters at depth 0 and 1 with the signature of
+            the graph, or None if the stored clusters of the entry were detected on the same graph.
+    """
+
+    node_count = grp[f"{Nfeat.NODE}/{Nfeat.POSITION}"].shape[0]
+    if Efeat.INDEX in grp[Efeat.EDGE]:
+        ind = grp[f"{Efeat.EDGE}/{Efeat.INDEX}"][()]
+    else:
+        ind = np.empty((0, 2), dtype=np.int64)
+    signature = _graph_signature(node_count, ind)
+
+    method_path = f"clustering/{method.lower()}"
+    if method_path in grp and "depth_0" in grp[method_path] and "depth_1" in grp[method_path]:
+        method_grp = grp[method_path]
+        stored_signature = (method_grp.attrs.get("edge_count"), method_grp.attrs.get("graph_hash"))
+        if stored_signature == signature and len(method_grp["depth_0"]) == node_count:
+            return None
+
+    # we have to have all the edges i.e : (i,j) and (j,i), as in GraphDataset.load_one_graph
+    if len(ind) > 0:
+        if ind.ndim == 2:
+            ind = np.vstack((ind, np.flip(ind, 1))).T
+        edge_index = torch.tensor(ind, dtype=torch.long).contiguous()
+    else:
+        edge_index = torch.empty((2, 0), dtype=torch.long)
+
+    cluster = community_detection(edge_index, node_count, method=method)
+
+    # the graph pooled by community_pooling: its edges only depend on the clusters, not on the features
+    pooled_cluster, _ = consecutive_cluster(cluster)
+    pooled_edge_index, _ = pool_edge(pooled_cluster, edge_index)
+    pooled_cluster_depth_1 = community_detection(pooled_edge_index, int(pooled_cluster.max()) + 1, method=method)
+
+    return cluster.cpu().numpy(), pooled_cluster_depth_1.cpu().numpy(), signature
+
+
+def _write_clusters(fname: str, method: str, clusters: List[Tuple[str, Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]]):
+    """Writes the clusters of entries to an .HDF5 file.
+
+    Args:
+        fname (str): .HDF5 file name.
+        method (str): Clustering method.
+        clusters (List[Tuple[str, Tuple[np.ndarray, np.ndarray, Tuple[int, str]]]]): The entry names, with their
+            clusters at depth 0 and 1 and the signature of their graph.
+    """
+
+    if len(clusters) == 0:
+        return
+
+    with h5py.File(fname, "a") as f5:
+        for mol, (depth_0, depth_1, signature) in clusters:
+            _write_group_clusters(f5[mol], method, depth_0, depth_1, signature)
+
+
+def _write_group_clusters(grp: h5py.Group, method: str, depth_0: np.ndarray, depth_1: np.ndarray, signature: Tuple[int, str]):
+
+    clust_grp = grp.require_group("clustering")
+    if method in clust_grp:
+        del clust_grp[method]
+    method_grp = clust_grp.create_group(method)
+    method_grp.create_dataset("depth_0", data=depth_0)
+    method_grp.create_dataset("depth_1", data=depth_1)
+    method_grp.attrs["edge_count"], method_grp.attrs["graph_hash"] = signature
+
+
 def _divide_dataset(dataset: Union[GraphDataset, GridDataset], splitsize: Optional[Union[float, int]] = None) -> \
         Union[Tuple[GraphDataset, GraphDataset], Tuple[GridDataset, GridDataset]]:
 
@@ -942,6 +1734,11 @@ def _divide_dataset(dataset: Union[GraphDataset, GridDataset], splitsize: Option
     else:
         indices = np.arange(full_size)
         np.random.shuffle(indices)
+        if dist.is_available() and dist.is_initialized():
+            # all processes of a distributed training must split the same way
+            shared_indices = [indices]
+            dist.broadcast_object_list(shared_indices, src=0)
+            indices = shared_indices[0]
 
         dataset_main = copy.deepcopy(dataset)
         dataset_main.index_entries = [dataset.index_entries[i] for i in indices[n_split:]]
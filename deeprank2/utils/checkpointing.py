@@ -0,0 +1,244 @@
+import importlib
+import logging
+import os
+import queue
+import threading
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+_log = logging.getLogger(__name__)
+
+
+def cpu_snapshot(state: Any) -> Any:
+    """Copies the tensors of a state, such as a state dict, to CPU.
+
+    The copy is not changed by further training, and can be saved while training goes on.
+
+    Args:
+        state (Any): Tensor, or dict, list or tuple of them, possibly nested. Other values are kept as they are.
+
+    Returns:
+        Any: The state, with copies of its tensors on CPU.
+    """
+
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, cpu_snapshot(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(cpu_snapshot(value) for value in state)
+    return state
+
+
+def get_class_name(cls: type) -> str:
+    """Gives the full name of a class, from which :func:`import_class` can import it again."""
+
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def import_class(name: str) -> type:
+    """Imports a class from its full name, see :func:`get_class_name`.
+
+    Args:
+        name (str): The module name, followed by the name of the class in the module.
+
+    Raises:
+        ValueError: If the class can't be imported, for instance because it was defined in a function.
+    """
+
+    module_name, _, qualname = name.rpartition(".")
+    while module_name:
+        try:
+            obj = importlib.import_module(module_name)
+            break
+        except ImportError:
+            # nested class: move the last part of the module name to the qualified name
+            module_name, _, outer_name = module_name.rpartition(".")
+            qualname = f"{outer_name}.{qualname}"
+    else:
+        raise ValueError(f"Cannot import the module of class {name}.")
+
+    try:
+        for attribute in qualname.split("."):
+            obj = getattr(obj, attribute)
+    except AttributeError as e:
+        raise ValueError(f"Cannot import class {name}, make sure that it is defined at module level.") from e
+    return obj
+
+
+class CheckpointWriter:
+    """Writes training checkpoints in a background thread, such that saving them doesn't stall the training.
+
+    The states given are expected to be snapshots (see :func:`cpu_snapshot`), as they are written later on.
+    Each file is written under a temporary name first, so that an existing checkpoint is never left half-written.
+    Besides single files, the checkpoints of epochs can be kept in a directory:
+    - periodic checkpoints `epoch-<epoch>.pth.tar`, every `interval` epochs, of which the last `keep_last` are kept;
+    - the `keep_best` checkpoints with the lowest loss, `best-epoch-<epoch>.pth.tar`.
+
+    Args:
+        directory_path (Optional[str], optional): Directory of the checkpoints of epochs. Defaults to None, meaning none are written.
+        interval (Optional[int], optional): Number of epochs between periodic checkpoints. Defaults to None, meaning no periodic checkpoints.
+        keep_last (Optional[int], optional): Number of periodic checkpoints kept, the older ones are removed.
+            Defaults to None, meaning all are kept.
+        keep_best (int, optional): Number of checkpoints with the lowest loss kept. Defaults to 0.
+        max_pending (int, optional): Maximum number of checkpoints waiting to be written, beyond which saving waits
+            for the writes to catch up. Defaults to 2.
+    """
+
+    def __init__( # pylint: disable=too-many-arguments
+        self,
+        directory_path: Optional[str] = None,
+        interval: Optional[int] = None,
+        keep_last: Optional[int] = None,
+        keep_best: int = 0,
+        max_pending: int = 2
+    ):
+
+        if interval is not None and interval < 1:
+            raise ValueError(f"The checkpoint interval must be positive, got {interval}")
+        if keep_last is not None and keep_last < 1:
+            raise ValueError(f"The number of periodic checkpoints kept must be positive, got {keep_last}")
+        if keep_best < 0:
+            raise ValueError(f"The number of best checkpoints kept can't be negative, got {keep_best}")
+        if max_pending < 1:
+            raise ValueError(f"The number of pending checkpoints must be positive, got {max_pending}")
+
+        self._directory_path = directory_path
+        self._interval = interval
+        self._keep_last = keep_last
+        self._keep_best = keep_best
+        self._max_pending = max_pending
+
+        self._periodic_paths: List[str] = []
+        self._best: List[Tuple[float, int, str]] = []
+
+        self._tasks = None
+        self._thread = None
+        self._error = None
+
+    def __enter__(self):
+
+        self._periodic_paths = []
+        self._best = []
+        self._error = None
+        self._tasks = queue.Queue(maxsize=self._max_pending)
+        self._thread = threading.Thread(target=self._run, name="deeprank2-checkpoint-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+
+        self._tasks.put(None)
+        self._thread.join()
+        self._thread = None
+        if exception is None:
+            self._raise_error()
+
+    def _run(self):
+
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            if self._error is not None:
+                # stop writing after an error, it's raised in the training thread
+                continue
+            try:
+                task()
+            except Exception as e: # pylint: disable=broad-except
+                self._error = e
+
+    def _raise_error(self):
+
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _submit(self, task):
+
+        if self._thread is None:
+            raise ValueError("The checkpoint writer must be used as a context manager.")
+        self._raise_error()
+        self._tasks.put(task)
+
+    @staticmethod
+    def _write(path: str, state: Dict[str, Any]):
+
+        directory_path = os.path.dirname(path)
+        if directory_path and not os.path.exists(directory_path):
+            os.makedirs(directory_path, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            torch.save(state, tmp_path)
+        except Exception:
+            CheckpointWriter._remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        _log.debug(f"Checkpoint written to {path}")
+
+    @staticmethod
+    def _remove(path: str):
+
+        if os.path.exists(path):
+            os.remove(path)
+
+    def save(self, path: str, state: Dict[str, Any]):
+        """Writes a state to a file, in the background.
+
+        Args:
+            path (str): The file to write.
+            state (Dict[str, Any]): The state to save.
+        """
+
+        self._submit(partial(self._write, path, state))
+
+    def _is_periodic(self, epoch: int) -> bool:
+        return self._directory_path is not None and self._interval is not None and epoch % self._interval == 0
+
+    def _is_best(self, loss: float) -> bool:
+        return (self._directory_path is not None and self._keep_best > 0 and
+                (len(self._best) < self._keep_best or loss < self._best[-1][0]))
+
+    def is_due(self, epoch: int, loss: float) -> bool:
+        """Whether :meth:`save_epoch` writes a checkpoint for this epoch, such that a snapshot is only made when needed.
+
+        Args:
+            epoch (int): The epoch.
+            loss (float): The loss of the model after the epoch, used for selecting the best checkpoints.
+        """
+
+        return self._is_periodic(epoch) or self._is_best(loss)
+
+    def save_epoch(self, epoch: int, loss: float, state: Dict[str, Any]):
+        """Writes the checkpoints of an epoch, if due, and removes those that are no longer kept.
+
+        Args:
+            epoch (int): The epoch.
+            loss (float): The loss of the model after the epoch, used for selecting the best checkpoints.
+            state (Dict[str, Any]): The state to save.
+        """
+
+        if self._is_periodic(epoch):
+            path = os.path.join(self._directory_path, f"epoch-{epoch}.pth.tar")
+            self.save(path, state)
+            self._periodic_paths.append(path)
+            if self._keep_last is not None and len(self._periodic_paths) > self._keep_last:
+                removed_path = self._periodic_paths.pop(0)
+                self._submit(partial(self._remove, removed_path))
+
+        if self._is_best(loss):
+            path = os.path.join(self._directory_path, f"best-epoch-{epoch}.pth.tar")
+            self.save(path, state)
+            self._best.append((loss, epoch, path))
+            self._best.sort(key=lambda best: best[:2])
+            if len(self._best) > self._keep_best:
+                _, _, removed_path = self._best.pop()
+                self._submit(partial(self._remove, removed_path))
+
+    @property
+    def best_paths(self) -> List[str]:
+        """The paths of the best checkpoints kept, from the lowest loss."""
+        return [path for _, _, path in self._best]
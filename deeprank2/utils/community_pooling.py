@@ -1,11 +1,11 @@
 import warnings
 
 import community
-import markov_clustering as mc
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 import torch
+from scipy import sparse
 from torch_geometric.data import Batch, Data
 from torch_geometric.nn.pool.consecutive import consecutive_cluster
 from torch_geometric.nn.pool.pool import pool_batch, pool_edge
@@ -20,11 +20,140 @@ def plot_graph(graph, cluster):
 
 
 def get_preloaded_cluster(cluster, batch):
+    """Offsets the clusters of the graphs in a batch, such that each graph has its own cluster indices.
 
-    nbatch = torch.max(batch) + 1
-    for ib in range(1, nbatch):
-        cluster[batch == ib] += torch.max(cluster[batch == ib - 1]) + 1
-    return cluster
+    The clusters of a graph are offset by the number of clusters (maximum cluster index + 1) of the preceding graphs.
+
+    Args:
+        cluster (Tensor): Cluster index of each node, starting from 0 in each graph.
+        batch (Tensor): Graph index of each node.
+
+    Returns:
+        Tensor: The offset cluster indices.
+    """
+
+    nbatch = int(torch.max(batch)) + 1
+    cluster_counts = scatter_max(cluster, batch, dim=0, dim_size=nbatch)[0] + 1
+    offsets = torch.cumsum(cluster_counts, dim=0) - cluster_counts
+    return cluster + offsets[batch]
+
+
+def _adjacency_matrix(edge_index, num_nodes: int, edge_attr=None) -> sparse.csr_matrix:
+    """Builds the symmetric adjacency matrix of an undirected graph, directly from its edge index.
+
+    As in a networkx graph, the weight of an edge is the last one given for its pair of nodes, in either direction.
+
+    Args:
+        edge_index (Tensor): Edge index.
+        num_nodes (int): Number of nodes.
+        edge_attr (Tensor, optional): Edge attributes, used as weights. Defaults to None (weights of 1).
+
+    Returns:
+        :class:`scipy.sparse.csr_matrix`: The adjacency matrix.
+    """
+
+    rows, cols = edge_index.detach().cpu().numpy().astype(np.int64).reshape(2, -1)
+    if edge_attr is None:
+        weights = np.ones(len(rows))
+    else:
+        weights = torch.as_tensor(edge_attr).detach().cpu().numpy().astype(float).reshape(len(rows))
+
+    # keep the last edge of each pair of nodes
+    pair_keys = np.minimum(rows, cols) * num_nodes + np.maximum(rows, cols)
+    _, last_index = np.unique(pair_keys[::-1], return_index=True)
+    last_index = len(rows) - 1 - last_index
+    rows, cols, weights = rows[last_index], cols[last_index], weights[last_index]
+
+    # both directions, loops once
+    reverse = rows != cols
+    return sparse.coo_matrix(
+        (np.concatenate((weights, weights[reverse])),
+         (np.concatenate((rows, cols[reverse])), np.concatenate((cols, rows[reverse])))),
+        shape=(num_nodes, num_nodes)).tocsr()
+
+
+def _normalize_columns(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    column_sums = np.asarray(abs(matrix).sum(axis=0)).ravel()
+    column_sums[column_sums == 0] = 1.0
+    return (matrix @ sparse.diags(1.0 / column_sums)).tocsr()
+
+
+def _prune(matrix: sparse.csr_matrix, threshold: float) -> sparse.csr_matrix:
+    """Removes the entries below the threshold, except for the maximum of each column."""
+
+    matrix = matrix.tocoo()
+    column_max_rows = np.asarray(matrix.tocsc().argmax(axis=0)).ravel()
+    keep = (matrix.data >= threshold) | (matrix.row == column_max_rows[matrix.col])
+    return sparse.csr_matrix((matrix.data[keep], (matrix.row[keep], matrix.col[keep])), shape=matrix.shape)
+
+
+def markov_clustering( # pylint: disable=too-many-arguments
+    matrix: sparse.spmatrix,
+    expansion: int = 2,
+    inflation: float = 2,
+    loop_value: float = 1,
+    iterations: int = 100,
+    pruning_threshold: float = 0.001,
+) -> np.ndarray:
+    """Clusters a graph with the Markov cluster algorithm (see https://micans.org/mcl/), on a sparse matrix.
+
+    This follows `markov_clustering.run_mcl` and `markov_clustering.get_clusters`, with the same defaults, but the
+    matrix stays sparse throughout the expansions and inflations, and is pruned after each iteration.
+
+    Args:
+        matrix (:class:`scipy.sparse.spmatrix`): Adjacency matrix of the graph.
+        expansion (int, optional): Cluster expansion factor. Defaults to 2.
+        inflation (float, optional): Cluster inflation factor. Defaults to 2.
+        loop_value (float, optional): Weight of the self loops added to the nodes. Defaults to 1.
+        iterations (int, optional): Maximum number of iterations. Defaults to 100.
+        pruning_threshold (float, optional): Value below which the entries are removed. Defaults to 0.001.
+
+    Returns:
+        np.ndarray: The cluster of each node.
+    """
+
+    matrix = sparse.csr_matrix(matrix, dtype=float)
+    if loop_value > 0:
+        matrix = matrix - sparse.diags(matrix.diagonal()) + loop_value * sparse.identity(matrix.shape[0])
+    matrix = _normalize_columns(matrix)
+
+    for _ in range(iterations):
+        last_matrix = matrix
+
+        # expansion and inflation
+        expanded = matrix
+        for _ in range(expansion - 1):
+            expanded = expanded @ matrix
+        matrix = _normalize_columns(expanded.power(inflation))
+        if pruning_threshold > 0:
+            matrix = _prune(matrix, pruning_threshold)
+
+        # convergence, as np.allclose(matrix, last_matrix)
+        difference = abs(matrix - last_matrix) - 1e-5 * abs(last_matrix)
+        if difference.max() <= 1e-8:
+            break
+
+    # the nodes in the same row as each attractor form a cluster
+    matrix.eliminate_zeros()
+    attractors = matrix.diagonal().nonzero()[0]
+    clusters = sorted({tuple(np.sort(matrix.getrow(attractor).indices).tolist()) for attractor in attractors})
+
+    index = np.zeros(matrix.shape[0]).astype("int")
+    for ic, c in enumerate(clusters):
+        index[list(c)] = ic
+    return index
+
+
+def _louvain_clustering(matrix: sparse.spmatrix) -> np.ndarray:
+    """Clusters a graph with the Louvain method, from its adjacency matrix.
+
+    Returns:
+        np.ndarray: The cluster of each node.
+    """
+
+    g = nx.from_scipy_sparse_array(matrix)
+    cluster = community.best_partition(g)
+    return np.array([cluster[node] for node in range(matrix.shape[0])])
 
 
 def community_detection_per_batch( # pylint: disable=too-many-locals
@@ -45,52 +174,37 @@ def community_detection_per_batch( # pylint: disable=too-many-locals
         cluster Tensor
     """
 
-    # make the networkX graph
-    g = nx.Graph()
-    g.add_nodes_from(range(num_nodes))
+    if method not in ("mcl", "louvain"):
+        raise ValueError(f"Clustering method {method} not supported")
 
-    for iedge, (i, j) in enumerate(edge_index.transpose(0, 1).tolist()):
-        if edge_attr is None:
-            g.add_edge(i, j)
-        else:
-            g.add_edge(i, j, weight=edge_attr[iedge])
+    matrix = _adjacency_matrix(edge_index, num_nodes, edge_attr)
+    batch = torch.as_tensor(batch).cpu().numpy()
 
     num_batch = max(batch) + 1
-    all_index = range(num_nodes)
     cluster, ncluster = [], 0
 
     for ib in range(num_batch):
 
-        index = torch.tensor(all_index)[batch == ib].tolist()
-        subg = g.subgraph(index)
+        index = np.flatnonzero(batch == ib)
+        submatrix = matrix[index][:, index]
 
         # detect the communities using Louvain method
         if method == "louvain":
-            c = community.best_partition(subg)
-            cluster += [v + ncluster for k, v in c.items()]
-            ncluster = max(cluster)
+            c = _louvain_clustering(submatrix)
 
         # detect communities using MCL
-        elif method == "mcl":
-            matrix = nx.to_scipy_sparse_array(subg)
-            # run MCL with default parameters
-            result = mc.run_mcl(matrix.toarray())
-            mc_clust = mc.get_clusters(result)  # get clusters
-
-            index = np.zeros(subg.number_of_nodes()).astype("int")
-            for ic, c in enumerate(mc_clust):
-                index[list(c)] = ic + ncluster
-            cluster += index.tolist()
-            ncluster = max(cluster)
-
         else:
-            raise ValueError(f"Clustering method {method} not supported")
+            c = markov_clustering(submatrix)
+
+        cluster += (c + ncluster).tolist()
+        ncluster = max(cluster)
+
     # return
     device = edge_index.device
     return torch.tensor(cluster).to(device)
 
 
-def community_detection(edge_index, num_nodes: int, edge_attr=None, method: str = "mcl"): # pylint: disable=too-many-locals
+def community_detection(edge_index, num_nodes: int, edge_attr=None, method: str = "mcl"):
     """Detects clusters of nodes based on the edge attributes (distances).
 
     Args:
@@ -117,40 +231,18 @@ def community_detection(edge_index, num_nodes: int, edge_attr=None, method: str
         >>> data.pos = torch.tensor(np.random.rand(data.num_nodes, 3))
         >>> c = community_detection(data.edge_index, data.num_nodes)
     """
-    # make the networkX graph
-    g = nx.Graph()
-    g.add_nodes_from(range(num_nodes))
-
-    for iedge, (i, j) in enumerate(edge_index.transpose(0, 1).tolist()):
-        if edge_attr is None:
-            g.add_edge(i, j)
-        else:
-            g.add_edge(i, j, weight=edge_attr[iedge])
-
     # get the device
     device = edge_index.device
 
     # detect the communities using Louvain detection
     if method == "louvain":
-        cluster = community.best_partition(g)
-        return torch.tensor([v for k, v in cluster.items()]).to(device)
+        matrix = _adjacency_matrix(edge_index, num_nodes, edge_attr)
+        return torch.tensor(_louvain_clustering(matrix)).to(device)
 
     # detect the communities using MCL detection
     if method == "mcl":
-
-        matrix = nx.to_scipy_sparse_array(g)
-
-        # run MCL with default parameters
-
-        result = mc.run_mcl(matrix.toarray())
-
-        clusters = mc.get_clusters(result)  # get clusters
-
-        index = np.zeros(num_nodes).astype("int")
-        for ic, c in enumerate(clusters):
-            index[list(c)] = ic
-
-        return torch.tensor(index).to(device)
+        matrix = _adjacency_matrix(edge_index, num_nodes, edge_attr)
+        return torch.tensor(markov_clustering(matrix)).to(device)
 
     raise ValueError(f"Clustering method {method} not supported")
 
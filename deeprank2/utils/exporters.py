@@ -4,10 +4,12 @@ import random
 from math import sqrt
 from typing import Any, Dict, List, Optional, Tuple
 
+import h5py
+import numpy as np
 import pandas as pd
 from matplotlib import pyplot
 from sklearn.metrics import roc_auc_score
-from torch import argmax, tensor
+from torch import tensor
 from torch.nn.functional import cross_entropy
 from torch.utils.tensorboard import SummaryWriter
 
@@ -36,7 +38,10 @@ class OutputExporter:
 
     def process(self, pass_name: str, epoch_number: int, # pylint: disable=too-many-arguments
                 entry_names: List[str], output_values: List[Any], target_values: List[Any], loss: float):
-        "the entry_names, output_values, target_values MUST have the same length"
+        """The entry_names, output_values, target_values MUST have the same length.
+
+        The Trainer passes the output and target values as :class:`np.ndarray`, one row per entry.
+        """
         pass # pylint: disable=unnecessary-pass
 
     def is_compatible_with( # pylint: disable=unused-argument
@@ -97,29 +102,19 @@ class TensorboardBinaryClassificationExporter(OutputExporter):
                 entry_names: List[str], output_values: List[Any], target_values: List[Any], loss: float):
         "write to tensorboard"
 
+        output_values = np.asarray(output_values, dtype=float)
+        target_values = np.asarray(target_values)
+
         ce_loss = cross_entropy(tensor(output_values), tensor(target_values)).item()
         self._writer.add_scalar(f"{pass_name} cross entropy loss", ce_loss, epoch_number)
 
-        probabilities = []
-        fp, fn, tp, tn = 0, 0, 0, 0
-        for entry_index, _ in enumerate(entry_names):
-            probability = output_values[entry_index][1]
-            probabilities.append(probability)
-
-            prediction_value = argmax(tensor(output_values[entry_index]))
-            target_value = target_values[entry_index]
-
-            if prediction_value > 0.0 and target_value > 0.0:
-                tp += 1
-
-            elif prediction_value <= 0.0 and target_value <= 0.0:
-                tn += 1
+        probabilities = output_values[:, 1]
+        prediction_values = np.argmax(output_values, axis=1)
 
-            elif prediction_value > 0.0 and target_value <= 0.0: # pylint: disable=chained-comparison
-                fp += 1
-
-            elif prediction_value <= 0.0 and target_value > 0.0: # pylint: disable=chained-comparison
-                fn += 1
+        tp = int(np.count_nonzero((prediction_values > 0.0) & (target_values > 0.0)))
+        tn = int(np.count_nonzero((prediction_values <= 0.0) & (target_values <= 0.0)))
+        fp = int(np.count_nonzero((prediction_values > 0.0) & (target_values <= 0.0)))
+        fn = int(np.count_nonzero((prediction_values <= 0.0) & (target_values > 0.0)))
 
         mcc_numerator = tn * tp - fp * fn
         if mcc_numerator == 0.0:
@@ -135,7 +130,7 @@ class TensorboardBinaryClassificationExporter(OutputExporter):
         self._writer.add_scalar(f"{pass_name} accuracy", accuracy, epoch_number)
 
         # for ROC curves to work, we need both class values in the set
-        if len(set(target_values)) == 2:
+        if len(np.unique(target_values)) == 2:
             roc_auc = roc_auc_score(target_values, probabilities)
             self._writer.add_scalar(f"{pass_name} ROC AUC", roc_auc, epoch_number)
 
@@ -272,6 +267,9 @@ class HDF5OutputExporter(OutputExporter):
         loss: float):
 
         self.phase = pass_name
+        if isinstance(output_values, np.ndarray) and output_values.ndim > 1:
+            # one list of values per entry, as stored before
+            output_values = output_values.tolist()
         pass_name = [pass_name] * len(output_values)
         loss = [loss] * len(output_values)
         epoch_number = [epoch_number] * len(output_values)
@@ -281,3 +279,101 @@ class HDF5OutputExporter(OutputExporter):
 
         self.df = pd.concat([self.df, df_epoch])
         self.df.reset_index(drop=True, inplace=True)
+
+
+# file extensions of the files written by PredictionWriter
+_PREDICTION_EXTENSIONS = (".csv", ".hdf5", ".h5")
+
+
+class PredictionWriter:
+    """Writes the predictions of a model batch by batch, so that they need not be kept in memory.
+
+    The file format is chosen from the extension of the output path:
+    - .csv: a table with an `entry` column and one `output` column, or one `output_<i>` column per class.
+    - .hdf5 or .h5: an `entry` dataset with the entry names and an `output` dataset with one row per entry.
+    Without an output path, the predictions are kept in memory and given as a Pandas dataframe with the columns of the .csv table.
+    """
+
+    def __init__(self, output_path: Optional[str] = None):
+        """
+        Args:
+            output_path (Optional[str], optional): Path of the .csv, .hdf5 or .h5 file to write. An existing file is overwritten.
+                Defaults to None, which keeps the predictions in memory.
+        """
+
+        if output_path is not None and os.path.splitext(output_path)[1] not in _PREDICTION_EXTENSIONS:
+            raise ValueError(f"Cannot write predictions to {output_path}, "
+                             f"the file extension must be one of {', '.join(_PREDICTION_EXTENSIONS)}.")
+        self._output_path = output_path
+        self._hdf5_file = None
+        self._frames = []
+        self._count = 0
+
+    def __enter__(self):
+
+        self._frames = []
+        self._count = 0
+        if self._output_path is not None:
+            directory_path = os.path.dirname(self._output_path)
+            if directory_path and not os.path.exists(directory_path):
+                os.makedirs(directory_path)
+            if os.path.exists(self._output_path):
+                os.remove(self._output_path)
+            if not self._output_path.endswith(".csv"):
+                self._hdf5_file = h5py.File(self._output_path, "w")
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+
+        if self._hdf5_file is not None:
+            self._hdf5_file.close()
+            self._hdf5_file = None
+
+    @staticmethod
+    def _frame(entry_names: List[str], output_values: np.ndarray) -> pd.DataFrame:
+
+        if output_values.ndim > 1:
+            columns = {f"output_{index}": output_values[:, index] for index in range(output_values.shape[1])}
+        else:
+            columns = {"output": output_values}
+        return pd.DataFrame(data={"entry": entry_names, **columns})
+
+    def write(self, entry_names: List[str], output_values: np.ndarray):
+        """Writes the predictions of a batch.
+
+        Args:
+            entry_names (List[str]): The names of the entries.
+            output_values (np.ndarray): The outputs of the model, one row per entry.
+        """
+
+        if self._hdf5_file is not None:
+            if self._count == 0:
+                self._hdf5_file.create_dataset("entry", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype())
+                self._hdf5_file.create_dataset("output", shape=(0,) + output_values.shape[1:],
+                                               maxshape=(None,) + output_values.shape[1:], dtype=output_values.dtype)
+            for name, values in (("entry", entry_names), ("output", output_values)):
+                dataset = self._hdf5_file[name]
+                dataset.resize(self._count + len(entry_names), axis=0)
+                dataset[self._count:] = values
+
+        elif self._output_path is not None:
+            self._frame(entry_names, output_values).to_csv(
+                self._output_path, mode="a", header=self._count == 0, index=False)
+
+        else:
+            self._frames.append(self._frame(entry_names, output_values))
+
+        self._count += len(entry_names)
+
+    def dataframe(self) -> Optional[pd.DataFrame]:
+        """Gives the predictions kept in memory.
+
+        Returns:
+            Optional[:class:`pd.DataFrame`]: The predictions, or None when they have been written to a file.
+        """
+
+        if self._output_path is not None:
+            return None
+        if len(self._frames) == 0:
+            return pd.DataFrame(data={"entry": [], "output": []})
+        return pd.concat(self._frames, ignore_index=True)
@@ -1,19 +1,18 @@
 import logging
-import os
-from typing import Callable, List, Optional, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import h5py
 import numpy as np
-import pdb2sql.transform
 from scipy.spatial import distance_matrix
 
 from deeprank2.domain import edgestorage as Efeat
 from deeprank2.domain import nodestorage as Nfeat
 from deeprank2.domain import targetstorage as targets
-from deeprank2.molstruct.atom import Atom
+from deeprank2.molstruct.atom import Atom, AtomicElement
 from deeprank2.molstruct.pair import AtomicContact, Contact, ResidueContact
 from deeprank2.molstruct.residue import Residue
-from deeprank2.utils.grid import Augmentation, Grid, GridSettings, MapMethod
+from deeprank2.utils.grid import (Augmentation, Grid, GridSettings,
+                                  GridStoragePolicy, MapMethod, rotate_points)
 
 _log = logging.getLogger(__name__)
 
@@ -140,26 +139,14 @@ class Graph:
 
         return False
 
-    def _map_point_features(self, grid: Grid, method: MapMethod,  # pylint: disable=too-many-arguments
-                            feature_name: str, points: List[np.ndarray],
-                            values: List[Union[float, np.ndarray]],
-                            augmentation: Optional[Augmentation] = None):
+    def _get_point_features(self) -> List[Tuple[str, np.ndarray, List[Union[float, np.ndarray]]]]:
+        """Orders the edge and node features by xyz point, for mapping them to a grid.
 
-        points = np.stack(points, axis=0)
+        Returns:
+            List[Tuple[str, np.ndarray, List[Union[float, np.ndarray]]]]: feature name, point coordinates and values per point.
+        """
 
-        if augmentation is not None:
-            points = pdb2sql.transform.rot_xyz_around_axis(points,
-                                                           augmentation.axis,
-                                                           augmentation.angle,
-                                                           self.center)
-
-        for point_index in range(points.shape[0]):
-            position = points[point_index]
-            value = values[point_index]
-
-            grid.map_feature(position, feature_name, value, method)
-
-    def map_to_grid(self, grid: Grid, method: MapMethod, augmentation: Optional[Augmentation] = None):
+        point_features = []
 
         # order edge features by xyz point
         points = []
@@ -171,9 +158,9 @@ class Graph:
             for feature_name, feature_value in edge.features.items():
                 feature_values[feature_name] = feature_values.get(feature_name, []) + [feature_value, feature_value]
 
-        # map edge features to grid
-        for feature_name, values in feature_values.items():
-            self._map_point_features(grid, method, feature_name, points, values, augmentation)
+        if len(points) > 0:
+            points = np.stack(points, axis=0)
+            point_features += [(feature_name, points, values) for feature_name, values in feature_values.items()]
 
         # order node features by xyz point
         points = []
@@ -185,9 +172,50 @@ class Graph:
             for feature_name, feature_value in node.features.items():
                 feature_values[feature_name] = feature_values.get(feature_name, []) + [feature_value]
 
-        # map node features to grid
-        for feature_name, values in feature_values.items():
-            self._map_point_features(grid, method, feature_name, points, values, augmentation)
+        if len(points) > 0:
+            points = np.stack(points, axis=0)
+            point_features += [(feature_name, points, values) for feature_name, values in feature_values.items()]
+
+        return point_features
+
+    def _get_atoms(self) -> List[Atom]:
+        """The atoms of the graph, for atomic as well as residue graphs."""
+
+        atoms = []
+        for node in self._nodes.values():
+            if isinstance(node.id, Atom):
+                atoms.append(node.id)
+            else:
+                atoms += node.id.atoms
+
+        return atoms
+
+    @staticmethod
+    def _map_atomic_densities(grid: Grid, atoms: List[Atom], positions: np.ndarray):
+
+        grid.map_atomic_densities(positions,
+                                  [atom.element.name for atom in atoms],
+                                  np.array([atom.element.vanderwaals_radius for atom in atoms]),
+                                  channel_names=[element.name for element in AtomicElement])
+
+    def map_to_grid(self, grid: Grid, method: MapMethod, augmentation: Optional[Augmentation] = None,
+                    atomic_densities: bool = False):
+
+        for feature_name, points, values in self._get_point_features():
+
+            if augmentation is not None:
+                points = rotate_points(points, [augmentation], self.center)[0]
+
+            grid.map_features(points, feature_name, values, method)
+
+        if atomic_densities:
+            atoms = self._get_atoms()
+            positions = np.stack([atom.position for atom in atoms], axis=0)
+
+            if augmentation is not None:
+                positions = rotate_points(positions, [augmentation], self.center)[0]
+
+            self._map_atomic_densities(grid, atoms, positions)
 
     def write_to_hdf5(self, hdf5_path: str): # pylint: disable=too-many-locals
         """Write a featured graph to an hdf5 file, according to deeprank standards."""
@@ -260,52 +288,92 @@ class Graph:
                 score_group.create_dataset(target_name, data=target_data)
 
     @staticmethod
-    def _find_unused_augmentation_name(unaugmented_id: str, hdf5_path: str) -> str:
+    def _find_unused_augmentation_names(unaugmented_id: str, entry_names: List[str], count: int) -> List[str]:
 
         prefix = f"{unaugmented_id}_"
 
-        entry_names_taken = []
-        if os.path.isfile(hdf5_path):
-            with h5py.File(hdf5_path, 'r') as hdf5_file:
-                for entry_name in hdf5_file:
-                    if entry_name.startswith(prefix):
-                        entry_names_taken.append(entry_name)
+        entry_names_taken = {entry_name for entry_name in entry_names if entry_name.startswith(prefix)}
 
+        chosen_names = []
         augmentation_count = 0
-        chosen_name = f"{prefix}{augmentation_count:03}"
-        while chosen_name in entry_names_taken:
-            augmentation_count += 1
+        while len(chosen_names) < count:
             chosen_name = f"{prefix}{augmentation_count:03}"
+            if chosen_name not in entry_names_taken:
+                chosen_names.append(chosen_name)
+            augmentation_count += 1
 
-        return chosen_name
+        return chosen_names
+
+    def _write_grid_to_hdf5_file(self, hdf5_file: h5py.File, grid: Grid, storage: Optional[GridStoragePolicy] = None):
+
+        grid.to_hdf5_file(hdf5_file, storage)
+
+        # store target values
+        targets_group = hdf5_file[grid.id].require_group(targets.VALUES)
+        for target_name, target_data in self.targets.items():
+            if target_name not in targets_group:
+                targets_group.create_dataset(target_name, data=target_data)
+            else:
+                targets_group[target_name][()] = target_data
 
     def write_as_grid_to_hdf5(
         self, hdf5_path: str,
         settings: GridSettings,
         method: MapMethod,
-        augmentation: Optional[Augmentation] = None
+        augmentation: Optional[Augmentation] = None,
+        storage: Optional[GridStoragePolicy] = None,
+        atomic_densities: bool = False
     ) -> str:
 
-        id_ = self.id
         if augmentation is not None:
-            id_ = self._find_unused_augmentation_name(id_, hdf5_path)
+            return self.write_as_augmented_grids_to_hdf5(hdf5_path, settings, method, [augmentation], storage, atomic_densities)
 
-        grid = Grid(id_, self.center.tolist(), settings)
+        grid = Grid(self.id, self.center.tolist(), settings)
+        self.map_to_grid(grid, method, atomic_densities=atomic_densities)
 
-        self.map_to_grid(grid, method, augmentation)
-        grid.to_hdf5(hdf5_path)
+        with h5py.File(hdf5_path, 'a') as hdf5_file:
+            self._write_grid_to_hdf5_file(hdf5_file, grid, storage)
+
+        return hdf5_path
+
+    def write_as_augmented_grids_to_hdf5(
+        self, hdf5_path: str,
+        settings: GridSettings,
+        method: MapMethod,
+        augmentations: List[Augmentation],
+        storage: Optional[GridStoragePolicy] = None,
+        atomic_densities: bool = False
+    ) -> str:
+        """Writes one augmented grid per augmentation to hdf5, in a single pass over the file.
+
+        The points are rotated for all augmentations at once and the entry names are chosen
+        from a single scan of the file, named <graph id>_000, <graph id>_001, etc.
+        """
+
+        if len(augmentations) == 0:
+            return hdf5_path
 
-        # store target values
         with h5py.File(hdf5_path, 'a') as hdf5_file:
 
-            entry_group = hdf5_file[id_]
+            names = self._find_unused_augmentation_names(self.id, list(hdf5_file.keys()), len(augmentations))
+            grids = [Grid(name, self.center.tolist(), settings) for name in names]
 
-            targets_group = entry_group.require_group(targets.VALUES)
-            for target_name, target_data in self.targets.items():
-                if target_name not in targets_group:
-                    targets_group.create_dataset(target_name, data=target_data)
-                else:
-                    targets_group[target_name][()] = target_data
+            for feature_name, points, values in self._get_point_features():
+
+                augmented_points = rotate_points(points, augmentations, self.center)
+
+                for augmentation_index, grid in enumerate(grids):
+                    grid.map_features(augmented_points[augmentation_index], feature_name, values, method)
+
+            if atomic_densities:
+                atoms = self._get_atoms()
+                augmented_positions = rotate_points(np.stack([atom.position for atom in atoms], axis=0), augmentations, self.center)
+
+                for augmentation_index, grid in enumerate(grids):
+                    self._map_atomic_densities(grid, atoms, augmented_positions[augmentation_index])
+
+            for grid in grids:
+                self._write_grid_to_hdf5_file(hdf5_file, grid, storage)
 
         return hdf5_path
 
@@ -3,7 +3,8 @@
 import itertools
 import logging
 from enum import Enum
-from typing import Dict, List, Union
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import h5py
 import numpy as np
@@ -13,6 +14,9 @@ from deeprank2.domain import gridstorage
 
 _log = logging.getLogger(__name__)
 
+# bounds the memory used by the kernels of the points mapped simultaneously by Grid.map_features
+_MAX_KERNEL_VALUES_PER_PASS = 2 ** 19
+
 
 class MapMethod(Enum):
     """This holds the value of either one of 4 grid mapping methods.
@@ -26,6 +30,27 @@ class MapMethod(Enum):
     NEAREST_NEIGHBOURS = 4
 
 
+def _fast_gaussian_kernel(cutoff: float, x_offsets: np.ndarray, y_offsets: np.ndarray, z_offsets: np.ndarray) -> np.ndarray:
+    # the kernel of _get_mapped_feature_fast_gaussian, from the offsets of grid points to the points along each axis
+
+    distances = np.sqrt(np.square(x_offsets) + np.square(y_offsets) + np.square(z_offsets))
+    return np.where(distances < cutoff, np.exp(-distances), 0.0)
+
+
+def _bsp_line_kernel( # pylint: disable=too-many-arguments
+    order: int,
+    resolutions: np.ndarray,
+    x_offsets: np.ndarray,
+    y_offsets: np.ndarray,
+    z_offsets: np.ndarray,
+) -> np.ndarray:
+    # the kernel of _get_mapped_feature_bsp_line, from the offsets of grid points to the points along each axis
+
+    return (bspline(x_offsets / resolutions[0], order)
+            * bspline(y_offsets / resolutions[1], order)
+            * bspline(z_offsets / resolutions[2], order))
+
+
 class Augmentation:
     """A rotation around an axis, to be applied to a feature before mapping it to a grid."""
 
@@ -41,6 +66,34 @@ class Augmentation:
     def angle(self) -> float:
         return self._angle
 
+    @property
+    def rotation_matrix(self) -> np.ndarray:
+        """The 3x3 matrix of the rotation, as built by :func:`pdb2sql.transform.rot_xyz_around_axis`."""
+
+        ct, st = np.cos(self._angle), np.sin(self._angle)
+        ux, uy, uz = self._axis
+
+        return np.array([[ct + ux**2 * (1 - ct), ux * uy * (1 - ct) - uz * st, ux * uz * (1 - ct) + uy * st],
+                         [uy * ux * (1 - ct) + uz * st, ct + uy**2 * (1 - ct), uy * uz * (1 - ct) - ux * st],
+                         [uz * ux * (1 - ct) - uy * st, uz * uy * (1 - ct) + ux * st, ct + uz**2 * (1 - ct)]])
+
+
+def rotate_points(points: np.ndarray, augmentations: List[Augmentation], center: np.ndarray) -> np.ndarray:
+    """Applies all augmentations to a set of points in one vectorized call.
+
+    Args:
+        points (np.ndarray): Coordinates of the points, shape (n_points, 3).
+        augmentations (List[:class:`Augmentation`]): The rotations to apply.
+        center (np.ndarray): The center of rotation.
+
+    Returns:
+        np.ndarray: The rotated coordinates, shape (n_augmentations, n_points, 3).
+    """
+
+    rotation_matrices = np.stack([augmentation.rotation_matrix for augmentation in augmentations], axis=0)
+
+    return np.einsum("aij,pj->api", rotation_matrices, points - center) + center
+
 
 class GridSettings:
     """Objects of this class hold the settings to build a grid.
@@ -76,6 +129,119 @@ class GridSettings:
         return self._points_counts
 
 
+def _get_density_koes(distances: np.ndarray, vanderwaals_radius: Union[float, np.ndarray]) -> np.ndarray:
+    """Atomic density as a function of the distance to the atom.
+
+    The formula is equation (1) of the Koes paper
+    Protein-Ligand Scoring with Convolutional NN Arxiv:1612.02751v1.
+    """
+
+    radii = np.broadcast_to(vanderwaals_radius, distances.shape)
+    density_data = np.zeros(distances.shape)
+
+    indices_close = distances < radii
+    indices_far = (distances >= radii) & (distances < 1.5 * radii)
+
+    density_data[indices_close] = np.exp(-2.0 * np.square(distances[indices_close]) / np.square(radii[indices_close]))
+    density_data[indices_far] = 4.0 / np.square(np.e) / np.square(radii[indices_far]) * np.square(distances[indices_far]) - \
+                                12.0 / np.square(np.e) / radii[indices_far] * distances[indices_far] + \
+                                9.0 / np.square(np.e)
+
+    return density_data
+
+
+class GridStoragePolicy:
+    """Objects of this class hold the settings to store grid features in hdf5.
+
+    - dtype: the floating point type of the stored feature values: "float64", "float32" or "float16"
+    - chunks: "auto" to let h5py choose the chunk shape, "grid" to store each feature channel as a single chunk
+      (one read per channel), "slab" to chunk along the x axis one plane at a time,
+      or an explicit x, y, z chunk shape
+    - compression: "lzf", "gzip", "blosc" (requires the optional hdf5plugin package) or None
+    - compression_level: the compression level, used by "gzip" and "blosc" only
+    - sparse: store the nonzero values of a feature with their flat grid indices (COO), instead of the dense grid.
+      Features for which the sparse form would take more space are still stored dense.
+    """
+
+    def __init__( # pylint: disable=too-many-arguments
+        self,
+        dtype: str = "float64",
+        chunks: Union[str, Tuple[int, int, int]] = "auto",
+        compression: Optional[str] = "lzf",
+        compression_level: Optional[int] = None,
+        sparse: bool = False,
+    ):
+        if dtype not in ("float64", "float32", "float16"):
+            raise ValueError(f"Unsupported grid storage dtype: {dtype}")
+
+        if isinstance(chunks, str) and chunks not in ("auto", "grid", "slab"):
+            raise ValueError(f"Unsupported grid chunking: {chunks}")
+
+        if compression not in ("lzf", "gzip", "blosc", None):
+            raise ValueError(f"Unsupported grid compression: {compression}")
+
+        self._dtype = dtype
+        self._chunks = chunks
+        self._compression = compression
+        self._compression_level = compression_level
+        self._sparse = sparse
+
+    @property
+    def dtype(self) -> str:
+        return self._dtype
+
+    @property
+    def chunks(self) -> Union[str, Tuple[int, int, int]]:
+        return self._chunks
+
+    @property
+    def compression(self) -> Optional[str]:
+        return self._compression
+
+    @property
+    def compression_level(self) -> Optional[int]:
+        return self._compression_level
+
+    @property
+    def sparse(self) -> bool:
+        return self._sparse
+
+    def get_dataset_options(self, grid_shape: Tuple[int, int, int]) -> Dict:
+        """Gives the keyword arguments to pass to :meth:`h5py.Group.create_dataset` for a feature of the given shape.
+
+        Sparse features are one-dimensional, their chunk shape is always chosen by h5py.
+        """
+
+        if self._chunks == "auto" or len(grid_shape) != 3:
+            chunks = True
+        elif self._chunks == "grid":
+            chunks = tuple(grid_shape)
+        elif self._chunks == "slab":
+            chunks = (1,) + tuple(grid_shape[1:])
+        else:
+            chunks = tuple(min(chunk, size) for chunk, size in zip(self._chunks, grid_shape))
+
+        options = {"dtype": self._dtype, "chunks": chunks}
+
+        if self._compression == "blosc":
+            try:
+                import hdf5plugin  # pylint: disable=import-outside-toplevel
+            except ImportError as e:
+                raise ImportError("Blosc compression of grids requires the hdf5plugin package.") from e
+
+            clevel = 5 if self._compression_level is None else self._compression_level
+            options.update(hdf5plugin.Blosc(cname="lz4", clevel=clevel, shuffle=hdf5plugin.Blosc.SHUFFLE))
+
+        elif self._compression == "gzip":
+            options["compression"] = "gzip"
+            options["compression_opts"] = self._compression_level
+
+        elif self._compression is not None:
+            options["compression"] = self._compression
+
+        return options
+
+
 class Grid:
     """
     An instance of this class holds everything that the grid is made of:
@@ -209,44 +375,51 @@ class Grid:
 
         return value * bsp_data
 
-    def _get_mapped_feature_nearest_neighbour( # pylint: disable=too-many-locals
+    def _get_mapped_feature_nearest_neighbour(
         self, position: np.ndarray, value: float
     ) -> np.ndarray:
 
-        fx, _, _ = position
-        distances_x = np.abs(self.xs - fx)
-        distances_y = np.abs(self.ys - fx)
-        distances_z = np.abs(self.zs - fx)
+        return self._map_nearest_neighbours(np.array([position]), np.array([[value]]))[0]
 
-        indices_x = np.argsort(distances_x)[:2]
-        indices_y = np.argsort(distances_y)[:2]
-        indices_z = np.argsort(distances_z)[:2]
+    def _map_nearest_neighbours(self, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Distributes the values of all points over their 8 surrounding grid points, with trilinear weights.
 
-        sorted_x = distances_x[indices_x]
-        weights_x = sorted_x / np.sum(sorted_x)
+        The neighbouring grid points are found from the grid origin and resolution, and all points are
+        scattered in one go. Grid points that fall outside of the box are skipped.
 
-        sorted_y = distances_y[indices_y]
-        weights_y = sorted_y / np.sum(sorted_y)
+        Args:
+            positions (np.ndarray): Point coordinates, shape (n_points, 3).
+            values (np.ndarray): Point values, shape (n_points, n_channels).
 
-        sorted_z = distances_z[indices_z]
-        weights_z = sorted_z / np.sum(sorted_z)
+        Returns:
+            np.ndarray: The mapped data, shape (n_channels, x points count, y points count, z points count).
+        """
 
-        indices = [indices_x, indices_y, indices_z]
-        points = list(itertools.product(*indices))
+        grid_shape = np.array((self.xs.shape[0], self.ys.shape[0], self.zs.shape[0]))
+        origin = np.array((self.xs[0], self.ys[0], self.zs[0]))
+        resolutions = np.array(self._settings.resolutions)
 
-        weight_products = list(itertools.product(weights_x, weights_y, weights_z))
-        weights = [np.sum(p) for p in weight_products]
+        # position in units of grid points, split in the lower neighbour and the fraction towards the upper neighbour
+        scaled_positions = (np.asarray(positions, dtype=float) - origin) / resolutions
+        lower_indices = np.floor(scaled_positions).astype(int)
+        fractions = scaled_positions - lower_indices
 
-        neighbour_data = np.zeros(
-            (self.xs.shape[0], self.ys.shape[0], self.zs.shape[0])
-        )
+        corners = np.array(list(itertools.product((0, 1), repeat=3)))  # (8, 3)
+        indices = lower_indices[:, np.newaxis, :] + corners[np.newaxis, :, :]  # (n_points, 8, 3)
+        weights = np.prod(np.where(corners[np.newaxis, :, :] == 1,
+                                   fractions[:, np.newaxis, :],
+                                   1.0 - fractions[:, np.newaxis, :]), axis=2)  # (n_points, 8)
 
-        for point_index, point in enumerate(points):
-            weight = weights[point_index]
+        inside = np.all((indices >= 0) & (indices < grid_shape), axis=2)
+        flat_indices = np.ravel_multi_index(tuple(indices[inside].T), grid_shape)
+        point_indices = np.nonzero(inside)[0]
 
-            neighbour_data[point] = weight * value
+        n_channels = values.shape[1]
+        neighbour_data = np.zeros((n_channels, np.prod(grid_shape)))
+        for channel_index in range(n_channels):
+            np.add.at(neighbour_data[channel_index], flat_indices, weights[inside] * values[point_indices, channel_index])
 
-        return neighbour_data
+        return neighbour_data.reshape((n_channels,) + tuple(grid_shape))
 
     def _get_atomic_density_koes(self, position: np.ndarray, vanderwaals_radius: float) -> np.ndarray:
         """Function to map individual atomic density on the grid.
@@ -262,17 +435,69 @@ class Grid:
                             np.square(self.ygrid - position[1]) +
                             np.square(self.zgrid - position[2]))
 
-        density_data = np.zeros(distances.shape)
+        return _get_density_koes(distances, vanderwaals_radius)
+
+    def map_atomic_densities( # pylint: disable=too-many-locals
+        self,
+        positions: np.ndarray,
+        element_names: List[str],
+        vanderwaals_radii: np.ndarray,
+        channel_names: Optional[List[str]] = None,
+        max_atoms_per_pass: int = 4096,
+    ):
+        """Maps the Koes atomic densities of all atoms to one grid channel per element.
+
+        Each atom only contributes to the grid points within 1.5 times its van der Waals radius,
+        so instead of computing distances to the full grid for every atom, all atoms are handled
+        at once on a small window of grid points around them.
+
+        Args:
+            positions (np.ndarray): Atom coordinates, shape (n_atoms, 3).
+            element_names (List[str]): Element name of each atom, channels are named atomic_density_<element>.
+            vanderwaals_radii (np.ndarray): Van der Waals radius of each atom, in Å.
+            channel_names (Optional[List[str]], optional): The elements to make a channel for, also when absent from element_names.
+                Defaults to None, which makes a channel for each element in element_names.
+            max_atoms_per_pass (int, optional): Number of atoms for which the window is computed simultaneously,
+                this bounds the memory usage. Defaults to 4096.
+        """
+
+        grid_shape = np.array((self.xs.shape[0], self.ys.shape[0], self.zs.shape[0]))
+        origin = np.array((self.xs[0], self.ys[0], self.zs[0]))
+        resolutions = np.array(self._settings.resolutions)
+
+        if channel_names is None:
+            channel_names = sorted(set(element_names))
+        channel_indices = np.array([channel_names.index(name) for name in element_names])
+        vanderwaals_radii = np.asarray(vanderwaals_radii, dtype=float)
+        positions = np.asarray(positions, dtype=float)
 
-        indices_close = distances < vanderwaals_radius
-        indices_far = (distances >= vanderwaals_radius) & (distances < 1.5 * vanderwaals_radius)
+        # the window of grid point offsets that can be reached by the largest atom
+        half_widths = np.ceil(1.5 * np.max(vanderwaals_radii, initial=0.0) / resolutions).astype(int)
+        offsets = np.stack(np.meshgrid(*[np.arange(-w, w + 1) for w in half_widths], indexing="ij"), axis=-1).reshape(-1, 3)
 
-        density_data[indices_close] = np.exp(-2.0 * np.square(distances[indices_close]) /  np.square(vanderwaals_radius))
-        density_data[indices_far] = 4.0 / np.square(np.e) / np.square(vanderwaals_radius) * np.square(distances[indices_far]) - \
-                                    12.0 / np.square(np.e) / vanderwaals_radius * distances[indices_far] + \
-                                    9.0 / np.square(np.e)
+        densities = np.zeros(len(channel_names) * np.prod(grid_shape))
 
-        return density_data
+        for start in range(0, positions.shape[0], max_atoms_per_pass):
+            atom_positions = positions[start: start + max_atoms_per_pass]
+            atom_radii = vanderwaals_radii[start: start + max_atoms_per_pass]
+            atom_channels = channel_indices[start: start + max_atoms_per_pass]
+
+            nearest_indices = np.rint((atom_positions - origin) / resolutions).astype(int)
+            indices = nearest_indices[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+
+            distances = np.linalg.norm(origin + indices * resolutions - atom_positions[:, np.newaxis, :], axis=2)
+            radii = np.broadcast_to(atom_radii[:, np.newaxis], distances.shape)
+
+            inside = np.all((indices >= 0) & (indices < grid_shape), axis=2) & (distances < 1.5 * radii)
+
+            flat_indices = np.ravel_multi_index(tuple(indices[inside].T), grid_shape)
+            flat_indices += np.broadcast_to(atom_channels[:, np.newaxis], distances.shape)[inside] * np.prod(grid_shape)
+
+            np.add.at(densities, flat_indices, _get_density_koes(distances[inside], radii[inside]))
+
+        densities = densities.reshape((len(channel_names),) + tuple(grid_shape))
+        for channel_index, channel_name in enumerate(channel_names):
+            self.add_feature_values(f"{gridstorage.ATOMIC_DENSITY}_{channel_name}", densities[channel_index])
 
     def map_feature(
         self,
@@ -301,44 +526,215 @@ class Grid:
 
         # map the data to the grid
         for index_name, value in index_names_values:
+            grid_data = self._get_mapped_feature(position, value, method)
 
-            if method == MapMethod.GAUSSIAN:
-                grid_data = self._get_mapped_feature_gaussian(position, value)
+            # set to grid
+            self.add_feature_values(index_name, grid_data)
+
+    def map_features(
+        self,
+        positions: np.ndarray,
+        feature_name: str,
+        feature_values: List[Union[np.ndarray, float]],
+        method: MapMethod,
+    ):
+        """Maps the feature data of many points at once to the grid, using the given method.
+
+        Every value in feature_values should either be a single number or a one-dimensional array.
+        In contrast to repeated calls to :meth:`map_feature`, the kernels of the points are computed in passes over
+        many points, and shared by all channels of a multi-channel feature. The methods with a cutoff only compute
+        the kernel of each point on the window of grid points it can reach.
+        """
 
-            elif method == MapMethod.FAST_GAUSSIAN:
-                grid_data = self._get_mapped_feature_fast_gaussian(position, value)
+        if np.ndim(feature_values[0]) == 0:
+            index_names = [feature_name]
+            values = np.asarray(feature_values, dtype=float).reshape(-1, 1)
+        else:
+            values = np.stack(feature_values, axis=0).astype(float)
+            index_names = [f"{feature_name}_{index:03d}" for index in range(values.shape[1])]
+
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if method == MapMethod.NEAREST_NEIGHBOURS:
+            channels_data = self._map_nearest_neighbours(positions, values)
+        elif method == MapMethod.GAUSSIAN:
+            channels_data = self._map_gaussians(positions, values)
+        elif method == MapMethod.FAST_GAUSSIAN:
+            # same cutoff as _get_mapped_feature_fast_gaussian
+            cutoff = 5.0
+            channels_data = self._map_windowed(positions, values, np.ceil(cutoff / np.array(self._settings.resolutions)),
+                                               partial(_fast_gaussian_kernel, cutoff))
+        elif method == MapMethod.BSP_LINE:
+            # same order as _get_mapped_feature_bsp_line, the spline is zero beyond (order + 1) / 2 grid points
+            order = 4
+            channels_data = self._map_windowed(positions, values, np.full(3, np.ceil((order + 1) / 2)),
+                                               partial(_bsp_line_kernel, order, np.array(self._settings.resolutions)))
+        else:
+            raise ValueError(f"Unknown grid mapping method: {method}")
 
-            elif method == MapMethod.BSP_LINE:
-                grid_data = self._get_mapped_feature_bsp_line(position, value)
+        for channel_index, index_name in enumerate(index_names):
+            self.add_feature_values(index_name, channels_data[channel_index])
 
-            elif method == MapMethod.NEAREST_NEIGHBOURS:
-                grid_data = self._get_mapped_feature_nearest_neighbour(position, value)
+    def _map_gaussians(self, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Maps the values of all points with a Gaussian kernel over the whole grid, see :meth:`_get_mapped_feature_gaussian`.
 
-            # set to grid
-            self.add_feature_values(index_name, grid_data)
+        Args:
+            positions (np.ndarray): Point coordinates, shape (n_points, 3).
+            values (np.ndarray): Point values, shape (n_points, n_channels).
+
+        Returns:
+            np.ndarray: The mapped data, shape (n_channels, x points count, y points count, z points count).
+        """
+
+        channels_data = np.zeros((values.shape[1],) + self.xgrid.shape)
+
+        points_per_pass = max(1, _MAX_KERNEL_VALUES_PER_PASS // self.xgrid.size)
+        for start in range(0, positions.shape[0], points_per_pass):
+            pass_positions = positions[start: start + points_per_pass]
+
+            # the squared distances along each axis are computed once per grid line, and broadcast over the grid
+            kernels = (np.square(self.xs[np.newaxis, :] - pass_positions[:, 0, np.newaxis])[:, :, np.newaxis, np.newaxis]
+                       + np.square(self.ys[np.newaxis, :] - pass_positions[:, 1, np.newaxis])[:, np.newaxis, :, np.newaxis]
+                       + np.square(self.zs[np.newaxis, :] - pass_positions[:, 2, np.newaxis])[:, np.newaxis, np.newaxis, :])
+            np.sqrt(kernels, out=kernels)
+            np.negative(kernels, out=kernels)
+            np.exp(kernels, out=kernels)
+
+            channels_data += np.tensordot(values[start: start + points_per_pass].T, kernels, axes=1)
+
+        return channels_data
+
+    def _map_windowed( # pylint: disable=too-many-locals
+        self,
+        positions: np.ndarray,
+        values: np.ndarray,
+        half_widths: np.ndarray,
+        kernel: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        """Maps the values of all points with a kernel that is zero beyond a window of grid points around each point.
+
+        Args:
+            positions (np.ndarray): Point coordinates, shape (n_points, 3).
+            values (np.ndarray): Point values, shape (n_points, n_channels).
+            half_widths (np.ndarray): Number of grid points along each axis beyond which the kernel is zero.
+            kernel (Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]): Gives the kernel on the windows,
+                shape (n, x window size, y window size, z window size), from the offsets of the grid points to the
+                points along each axis, of shapes (n, x window size, 1, 1), (n, 1, y window size, 1) and (n, 1, 1, z window size).
+
+        Returns:
+            np.ndarray: The mapped data, shape (n_channels, x points count, y points count, z points count).
+        """
+
+        grid_axes = (self.xs, self.ys, self.zs)
+        grid_shape = np.array([len(axis_points) for axis_points in grid_axes])
+        origin = np.array([axis_points[0] for axis_points in grid_axes])
+        resolutions = np.array(self._settings.resolutions)
+
+        # one more grid point, as a point can be half a grid point away from its nearest grid point
+        half_widths = half_widths.astype(int) + 1
+        window_size = np.prod(2 * half_widths + 1)
 
-    def to_hdf5(self, hdf5_path: str):
+        channels_data = np.zeros((values.shape[1], np.prod(grid_shape)))
+
+        points_per_pass = max(1, _MAX_KERNEL_VALUES_PER_PASS // window_size)
+        for start in range(0, positions.shape[0], points_per_pass):
+            pass_positions = positions[start: start + points_per_pass]
+            nearest_indices = np.rint((pass_positions - origin) / resolutions).astype(int)
+
+            # the window along each axis: grid point indices, whether they are in the box and offsets to the points
+            axis_offsets = []
+            flat_indices = 0
+            inside = True
+            for axis, axis_points in enumerate(grid_axes):
+                shape = [len(pass_positions), 1, 1, 1]
+                shape[axis + 1] = 2 * half_widths[axis] + 1
+                indices = nearest_indices[:, axis, np.newaxis] + np.arange(-half_widths[axis], half_widths[axis] + 1)
+                axis_inside = (indices >= 0) & (indices < grid_shape[axis])
+                indices = np.clip(indices, 0, grid_shape[axis] - 1)
+                # the same grid point coordinates as on the full grid
+                axis_offsets.append((axis_points[indices] - pass_positions[:, axis, np.newaxis]).reshape(shape))
+                flat_indices = flat_indices * grid_shape[axis] + indices.reshape(shape)
+                inside = inside & axis_inside.reshape(shape)
+
+            weights = kernel(*axis_offsets)
+            mapped = inside & (weights != 0.0)
+            weights = weights[mapped]
+            flat_indices = np.broadcast_to(flat_indices, mapped.shape)[mapped]
+            point_indices = np.broadcast_to(np.arange(start, start + len(pass_positions)).reshape(-1, 1, 1, 1), mapped.shape)[mapped]
+
+            for channel_index in range(values.shape[1]):
+                channels_data[channel_index] += np.bincount(flat_indices, weights=weights * values[point_indices, channel_index],
+                                                            minlength=channels_data.shape[1])
+
+        return channels_data.reshape((values.shape[1],) + tuple(grid_shape))
+
+    def _get_mapped_feature(self, position: np.ndarray, value: float, method: MapMethod) -> np.ndarray:
+
+        if method == MapMethod.GAUSSIAN:
+            return self._get_mapped_feature_gaussian(position, value)
+
+        if method == MapMethod.FAST_GAUSSIAN:
+            return self._get_mapped_feature_fast_gaussian(position, value)
+
+        if method == MapMethod.BSP_LINE:
+            return self._get_mapped_feature_bsp_line(position, value)
+
+        if method == MapMethod.NEAREST_NEIGHBOURS:
+            return self._get_mapped_feature_nearest_neighbour(position, value)
+
+        raise ValueError(f"Unknown grid mapping method: {method}")
+
+    def to_hdf5(self, hdf5_path: str, storage: Optional[GridStoragePolicy] = None):
         """Write the grid data to hdf5, according to deeprank standards."""
 
         with h5py.File(hdf5_path, "a") as hdf5_file:
+            self.to_hdf5_file(hdf5_file, storage)
 
-            # create a group to hold everything
-            grid_group = hdf5_file.require_group(self.id)
-
-            # store grid points
-            points_group = grid_group.require_group("grid_points")
-            points_group.create_dataset("x", data=self.xs)
-            points_group.create_dataset("y", data=self.ys)
-            points_group.create_dataset("z", data=self.zs)
-            points_group.create_dataset("center", data=self.center)
+    def to_hdf5_file(self, hdf5_file: h5py.File, storage: Optional[GridStoragePolicy] = None):
+        """Write the grid data to an already opened hdf5 file, according to deeprank standards.
 
-            # store grid features
-            features_group = grid_group.require_group(gridstorage.MAPPED_FEATURES)
-            for feature_name, feature_data in self.features.items():
+        If no storage policy is given, features are stored as lzf compressed float64 with automatic chunking.
+        """
 
+        if storage is None:
+            storage = GridStoragePolicy()
+
+        # create a group to hold everything
+        grid_group = hdf5_file.require_group(self.id)
+
+        # store grid points
+        points_group = grid_group.require_group("grid_points")
+        points_group.create_dataset("x", data=self.xs)
+        points_group.create_dataset("y", data=self.ys)
+        points_group.create_dataset("z", data=self.zs)
+        points_group.create_dataset("center", data=self.center)
+
+        # store grid features
+        features_group = grid_group.require_group(gridstorage.MAPPED_FEATURES)
+        for feature_name, feature_data in self.features.items():
+
+            # sparse storage is only used when it's smaller than the dense feature
+            nonzero_indices = None
+            if storage.sparse:
+                nonzero_indices = np.flatnonzero(feature_data)
+                index_dtype = np.int32 if feature_data.size < np.iinfo(np.int32).max else np.int64
+                sparse_nbytes = nonzero_indices.size * (np.dtype(index_dtype).itemsize + np.dtype(storage.dtype).itemsize)
+                if sparse_nbytes >= feature_data.size * np.dtype(storage.dtype).itemsize:
+                    nonzero_indices = None
+
+            if nonzero_indices is not None:
+
+                sparse_group = features_group.create_group(feature_name)
+                sparse_group.attrs[gridstorage.SPARSE_SHAPE] = feature_data.shape
+
+                # an empty dataset can't be chunked, nor compressed
+                options = storage.get_dataset_options(nonzero_indices.shape) if nonzero_indices.size > 0 else {}
+                sparse_group.create_dataset(gridstorage.SPARSE_INDICES, data=nonzero_indices.astype(index_dtype),
+                                            **dict(options, dtype=index_dtype))
+                sparse_group.create_dataset(gridstorage.SPARSE_VALUES, data=feature_data.ravel()[nonzero_indices],
+                                            **dict(options, dtype=storage.dtype))
+            else:
                 features_group.create_dataset(
                     feature_name,
                     data=feature_data,
-                    compression="lzf",
-                    chunks=True,
+                    **storage.get_dataset_options(feature_data.shape),
                 )
@@ -0,0 +1,365 @@
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import h5py
+import numpy as np
+
+from deeprank2.domain import edgestorage as Efeat
+from deeprank2.domain import nodestorage as Nfeat
+from deeprank2.domain import targetstorage as targets
+
+_log = logging.getLogger(__name__)
+
+# attribute marking a packed graphs file, and the names of its datasets
+FORMAT_ATTRIBUTE = "deeprank2_format"
+FORMAT_NAME = "packed_graphs"
+ENTRY_NAMES = "entry_names"
+NODE_OFFSETS = "node_offsets"
+EDGE_OFFSETS = "edge_offsets"
+FEATURE_NAMES = "feature_names"
+FEATURE_WIDTHS = "feature_widths"
+FEATURE_NDIMS = "feature_ndims"
+CLUSTERING = "clustering"
+DEPTH_1_OFFSETS = "depth_1_offsets"
+
+
+def is_packed_graphs_file(hdf5_file: h5py.File) -> bool:
+    """Tells whether an opened .HDF5 file is in the packed graphs format, written by :func:`pack_graphs`."""
+
+    return hdf5_file.attrs.get(FORMAT_ATTRIBUTE) == FORMAT_NAME
+
+
+def _feature_names(entry_group: h5py.Group, features: Union[List[str], str]) -> List[str]:
+
+    if features == "all":
+        return [name for name in entry_group.keys() if name[0] != '_']  # ignore metafeatures
+    return list(features)
+
+
+def pack_graphs( # pylint: disable=too-many-locals, too-many-statements # noqa: MC0001
+    hdf5_path: Union[str, List[str]],
+    packed_path: str,
+    node_features: Union[List[str], str] = "all",
+    edge_features: Union[List[str], str] = "all",
+):
+    """Converts processed graphs .HDF5 files into a single file in the packed graphs format.
+
+    The selected features of all the entries are concatenated into one node and one edge matrix,
+    indexed by node and edge offsets per entry, so that loading a graph takes a slice of each matrix
+    instead of a read per feature. The matrices are stored contiguous and uncompressed, to allow memory mapping.
+    The file can be given to :class:`deeprank2.dataset.GraphDataset` like any other .HDF5 file.
+
+    Args:
+        hdf5_path (Union[str, List[str]]): Path to the processed .HDF5 file(s).
+        packed_path (str): Path to the packed .HDF5 file to create.
+        node_features (Union[List[str], str], optional): The node features to pack, or "all". Defaults to "all".
+        edge_features (Union[List[str], str], optional): The edge features to pack, or "all". Defaults to "all".
+    """
+
+    hdf5_paths = [hdf5_path] if isinstance(hdf5_path, str) else hdf5_path
+
+    # first pass: sizes of all entries and layout of the features
+    entries = []
+    node_counts = []
+    edge_counts = []
+    depth_1_counts = {}
+    target_names = []
+    layouts = {}
+    for path in hdf5_paths:
+        with h5py.File(path, "r") as hdf5_file:
+            for entry_name, entry_group in hdf5_file.items():
+                if not layouts:
+                    for feat_type, features in [(Nfeat.NODE, node_features), (Efeat.EDGE, edge_features)]:
+                        names = _feature_names(entry_group[feat_type], features)
+                        shapes = [entry_group[feat_type][name].shape for name in names]
+                        layouts[feat_type] = (names,
+                                              [shape[1] if len(shape) == 2 else 1 for shape in shapes],
+                                              [len(shape) for shape in shapes])
+                    if CLUSTERING in entry_group:
+                        depth_1_counts = {method: [] for method in entry_group[CLUSTERING]}
+
+                entries.append((path, entry_name))
+                node_counts.append(entry_group[f"{Nfeat.NODE}/{Nfeat.POSITION}"].shape[0])
+                if Efeat.INDEX in entry_group[Efeat.EDGE]:
+                    edge_counts.append(entry_group[f"{Efeat.EDGE}/{Efeat.INDEX}"].shape[0])
+                else:
+                    edge_counts.append(0)
+                if targets.VALUES in entry_group:
+                    target_names += [name for name in entry_group[targets.VALUES] if name not in target_names]
+
+                for method in list(depth_1_counts):
+                    if f"{CLUSTERING}/{method}/depth_1" in entry_group:
+                        depth_1_counts[method].append(entry_group[f"{CLUSTERING}/{method}/depth_1"].shape[0])
+                    else:
+                        _log.warning(f"Clustering {method} is missing in entry {entry_name} of {path}, it will not be packed.")
+                        del depth_1_counts[method]
+
+    if len(entries) == 0:
+        raise ValueError(f"No entries found in {hdf5_paths}.")
+
+    node_offsets = np.concatenate(([0], np.cumsum(node_counts))).astype(np.int64)
+    edge_offsets = np.concatenate(([0], np.cumsum(edge_counts))).astype(np.int64)
+
+    # second pass: fill in the contiguous datasets
+    with h5py.File(packed_path, "w") as packed_file:
+        packed_file.attrs[FORMAT_ATTRIBUTE] = FORMAT_NAME
+        packed_file.create_dataset(ENTRY_NAMES, data=np.array([entry_name for _, entry_name in entries], dtype=h5py.string_dtype()))
+        packed_file.create_dataset(NODE_OFFSETS, data=node_offsets)
+        packed_file.create_dataset(EDGE_OFFSETS, data=edge_offsets)
+
+        matrices = {}
+        for feat_type, offsets in [(Nfeat.NODE, node_offsets), (Efeat.EDGE, edge_offsets)]:
+            names, widths, ndims = layouts[feat_type]
+            group = packed_file.create_group(feat_type)
+            group.attrs[FEATURE_NAMES] = np.array(names, dtype=h5py.string_dtype())
+            group.attrs[FEATURE_WIDTHS] = np.array(widths, dtype=np.int64)
+            group.attrs[FEATURE_NDIMS] = np.array(ndims, dtype=np.int64)
+            matrices[feat_type] = group.create_dataset("values", shape=(offsets[-1], sum(widths)), dtype=np.float64)
+        positions = packed_file.create_dataset(f"{Nfeat.NODE}/{Nfeat.POSITION}", shape=(node_offsets[-1], 3), dtype=np.float64)
+        edge_index = packed_file.create_dataset(f"{Efeat.EDGE}/{Efeat.INDEX}", shape=(edge_offsets[-1], 2), dtype=np.int64)
+
+        target_values = np.full((len(target_names), len(entries)), np.nan)
+
+        depth_0 = {}
+        depth_1 = {}
+        depth_1_offsets = {}
+        for method, counts in depth_1_counts.items():
+            depth_1_offsets[method] = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            method_group = packed_file.create_group(f"{CLUSTERING}/{method}")
+            method_group.create_dataset(DEPTH_1_OFFSETS, data=depth_1_offsets[method])
+            depth_0[method] = method_group.create_dataset("depth_0", shape=(node_offsets[-1],), dtype=np.int64)
+            depth_1[method] = method_group.create_dataset("depth_1", shape=(depth_1_offsets[method][-1],), dtype=np.int64)
+
+        for entry_index, (path, entry_name) in enumerate(entries):
+            with h5py.File(path, "r") as hdf5_file:
+                entry_group = hdf5_file[entry_name]
+                node_slice = slice(node_offsets[entry_index], node_offsets[entry_index + 1])
+                edge_slice = slice(edge_offsets[entry_index], edge_offsets[entry_index + 1])
+
+                for feat_type, item_slice in [(Nfeat.NODE, node_slice), (Efeat.EDGE, edge_slice)]:
+                    names = layouts[feat_type][0]
+                    if item_slice.stop > item_slice.start and len(names) > 0:
+                        columns = [entry_group[f"{feat_type}/{name}"][()].reshape(item_slice.stop - item_slice.start, -1)
+                                   for name in names]
+                        matrices[feat_type][item_slice] = np.hstack(columns)
+
+                positions[node_slice] = entry_group[f"{Nfeat.NODE}/{Nfeat.POSITION}"][()]
+                if edge_slice.stop > edge_slice.start:
+                    edge_index[edge_slice] = entry_group[f"{Efeat.EDGE}/{Efeat.INDEX}"][()]
+
+                if targets.VALUES in entry_group:
+                    for target_index, target_name in enumerate(target_names):
+                        if target_name in entry_group[targets.VALUES]:
+                            target_values[target_index, entry_index] = entry_group[f"{targets.VALUES}/{target_name}"][()]
+
+                for method, offsets in depth_1_offsets.items():
+                    depth_0[method][node_slice] = entry_group[f"{CLUSTERING}/{method}/depth_0"][()]
+                    depth_1[method][offsets[entry_index]:offsets[entry_index + 1]] = \
+                        entry_group[f"{CLUSTERING}/{method}/depth_1"][()]
+
+        target_group = packed_file.create_group(targets.VALUES)
+        for target_index, target_name in enumerate(target_names):
+            target_group.create_dataset(target_name, data=target_values[target_index])
+
+
+def _map_dataset(dataset: h5py.Dataset) -> np.ndarray:
+    """Memory maps a contiguous uncompressed dataset, falls back to the h5py dataset otherwise."""
+
+    offset = dataset.id.get_offset()
+    if offset is None or dataset.chunks is not None or dataset.compression is not None:
+        return dataset
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+
+
+def _read_ranges(array: Union[np.ndarray, h5py.Dataset], starts: np.ndarray, ends: np.ndarray) -> List[np.ndarray]:
+    """Reads several ranges of rows of an array at once, with one read of all their rows.
+
+    Args:
+        array (Union[np.ndarray, :class:`h5py.Dataset`]): The array, memory mapped or not.
+        starts (np.ndarray): The first row of each range.
+        ends (np.ndarray): The end of each range, exclusive.
+
+    Returns:
+        List[np.ndarray]: The rows of each range.
+    """
+
+    rows = np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in zip(starts, ends)])
+    # h5py datasets only take increasing indices, and ranges may overlap
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    if len(unique_rows) == 0:
+        values = np.empty((0,) + array.shape[1:], dtype=array.dtype)
+    else:
+        values = np.asarray(array[unique_rows])[inverse]
+    return np.split(values, np.cumsum(np.asarray(ends) - np.asarray(starts))[:-1])
+
+
+class _PackedGroup:
+    """Read-only view on a nested dictionary, indexed like an :class:`h5py.Group`."""
+
+    def __init__(self, items: Dict):
+        self._items = items
+
+    def __getitem__(self, path: str):
+        item = self
+        for name in path.split("/"):
+            if name != "":
+                item = item._items[name] # pylint: disable=protected-access
+        return item
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items)
+
+    def keys(self):
+        return self._items.keys()
+
+    def items(self):
+        return self._items.items()
+
+
+class PackedGraphs:
+    """Reads the graphs of an opened packed graphs file, written by :func:`pack_graphs`.
+
+    The entries are given as :class:`h5py.Group` look-alikes, such that the packed graphs
+    can be read in the same way as the processed .HDF5 files.
+
+    Args:
+        hdf5_file (:class:`h5py.File`): The opened packed graphs file.
+    """
+
+    def __init__(self, hdf5_file: h5py.File):
+
+        self._entry_names = [name.decode() if isinstance(name, bytes) else name for name in hdf5_file[ENTRY_NAMES][()]]
+        self._entry_indices = {name: index for index, name in enumerate(self._entry_names)}
+        self._node_offsets = hdf5_file[NODE_OFFSETS][()]
+        self._edge_offsets = hdf5_file[EDGE_OFFSETS][()]
+
+        self._layouts = {}
+        self._matrices = {}
+        for feat_type in [Nfeat.NODE, Efeat.EDGE]:
+            group = hdf5_file[feat_type]
+            names = [name.decode() if isinstance(name, bytes) else name for name in group.attrs[FEATURE_NAMES]]
+            column_offsets = np.concatenate(([0], np.cumsum(group.attrs[FEATURE_WIDTHS])))
+            self._layouts[feat_type] = [(name, column_offsets[index], column_offsets[index + 1], ndim)
+                                        for index, (name, ndim) in enumerate(zip(names, group.attrs[FEATURE_NDIMS]))]
+            self._matrices[feat_type] = _map_dataset(group["values"])
+
+        self._positions = _map_dataset(hdf5_file[f"{Nfeat.NODE}/{Nfeat.POSITION}"])
+        self._edge_index = _map_dataset(hdf5_file[f"{Efeat.EDGE}/{Efeat.INDEX}"])
+        self._target_values = {name: dataset[()] for name, dataset in hdf5_file[targets.VALUES].items()}
+
+        self._clustering = {}
+        if CLUSTERING in hdf5_file:
+            for method, method_group in hdf5_file[CLUSTERING].items():
+                self._clustering[method] = (method_group[DEPTH_1_OFFSETS][()],
+                                            _map_dataset(method_group["depth_0"]),
+                                            _map_dataset(method_group["depth_1"]))
+
+        # the last read entry, as its features are usually looked up one by one
+        self._cached_entry = (None, None)
+
+    def keys(self) -> List[str]:
+        return self._entry_names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entry_names)
+
+    def __contains__(self, entry_name: str) -> bool:
+        return entry_name in self._entry_indices
+
+    def items(self) -> Iterator[Tuple[str, _PackedGroup]]:
+        for entry_name in self._entry_names:
+            yield entry_name, self[entry_name]
+
+    def target_values(self, target_name: str) -> Optional[np.ndarray]:
+        """Gets the values of a target for all entries, NaN where missing, or None if the target is absent."""
+
+        return self._target_values.get(target_name)
+
+    def __getitem__(self, path: str) -> _PackedGroup:
+
+        entry_name, _, sub_path = path.strip("/").partition("/")
+        if self._cached_entry[0] != entry_name:
+            self._cached_entry = (entry_name, self._read_entry(self._entry_indices[entry_name]))
+        return self._cached_entry[1][sub_path]
+
+    def read_entries(self, entry_names: List[str]) -> List[_PackedGroup]:
+        """Reads several entries at once, with one read of the rows of all of them per matrix.
+
+        Args:
+            entry_names (List[str]): The names of the entries.
+
+        Returns:
+            List[:class:`_PackedGroup`]: The entries, read like the groups of a processed .HDF5 file.
+        """
+
+        entry_indices = np.array([self._entry_indices[entry_name] for entry_name in entry_names], dtype=np.int64)
+        node_starts, node_ends = self._node_offsets[entry_indices], self._node_offsets[entry_indices + 1]
+        edge_starts, edge_ends = self._edge_offsets[entry_indices], self._edge_offsets[entry_indices + 1]
+
+        node_rows = _read_ranges(self._matrices[Nfeat.NODE], node_starts, node_ends)
+        edge_rows = _read_ranges(self._matrices[Efeat.EDGE], edge_starts, edge_ends)
+        positions = _read_ranges(self._positions, node_starts, node_ends)
+        edge_index = _read_ranges(self._edge_index, edge_starts, edge_ends)
+        clusters = {}
+        for method, (depth_1_offsets, depth_0, depth_1) in self._clustering.items():
+            clusters[method] = list(zip(_read_ranges(depth_0, node_starts, node_ends),
+                                        _read_ranges(depth_1, depth_1_offsets[entry_indices], depth_1_offsets[entry_indices + 1])))
+
+        return [self._build_entry(entry_index, node_rows[position], edge_rows[position], positions[position],
+                                  edge_index[position], {method: clusters[method][position] for method in clusters})
+                for position, entry_index in enumerate(entry_indices)]
+
+    def _read_entry(self, entry_index: int) -> _PackedGroup:
+
+        node_start, node_end = self._node_offsets[entry_index], self._node_offsets[entry_index + 1]
+        edge_start, edge_end = self._edge_offsets[entry_index], self._edge_offsets[entry_index + 1]
+
+        # one read per matrix, the features are views on the slices
+        clusters = {}
+        for method, (depth_1_offsets, depth_0, depth_1) in self._clustering.items():
+            clusters[method] = (np.asarray(depth_0[node_start:node_end]),
+                                np.asarray(depth_1[depth_1_offsets[entry_index]:depth_1_offsets[entry_index + 1]]))
+        return self._build_entry(entry_index,
+                                 np.asarray(self._matrices[Nfeat.NODE][node_start:node_end]),
+                                 np.asarray(self._matrices[Efeat.EDGE][edge_start:edge_end]),
+                                 np.asarray(self._positions[node_start:node_end]),
+                                 np.asarray(self._edge_index[edge_start:edge_end]),
+                                 clusters)
+
+    def _build_entry( # pylint: disable=too-many-arguments
+        self,
+        entry_index: int,
+        node_rows: np.ndarray,
+        edge_rows: np.ndarray,
+        positions: np.ndarray,
+        edge_index: np.ndarray,
+        clusters: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ) -> _PackedGroup:
+
+        node_group = {name: node_rows[:, start] if ndim == 1 else node_rows[:, start:end]
+                      for name, start, end, ndim in self._layouts[Nfeat.NODE]}
+        node_group[Nfeat.POSITION] = positions
+
+        edge_group = {name: edge_rows[:, start] if ndim == 1 else edge_rows[:, start:end]
+                      for name, start, end, ndim in self._layouts[Efeat.EDGE]}
+        if len(edge_index) > 0:
+            edge_group[Efeat.INDEX] = edge_index
+
+        target_group = {name: values[entry_index] for name, values in self._target_values.items()
+                        if not np.isnan(values[entry_index])}
+
+        clustering_group = {method: _PackedGroup({"depth_0": depth_0, "depth_1": depth_1})
+                            for method, (depth_0, depth_1) in clusters.items()}
+
+        entry_group = _PackedGroup({
+            Nfeat.NODE: _PackedGroup(node_group),
+            Efeat.EDGE: _PackedGroup(edge_group),
+            targets.VALUES: _PackedGroup(target_group),
+        })
+        if clustering_group:
+            entry_group._items[CLUSTERING] = _PackedGroup(clustering_group) # pylint: disable=protected-access
+
+        return entry_group
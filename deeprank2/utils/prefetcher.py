@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+from time import perf_counter
+from typing import Iterable, Iterator, Optional
+
+import torch
+from torch_geometric.data.batch import Batch
+
+_log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Iterates over a data loader while the next batches are read in a background thread.
+
+    The loader is read ahead up to `depth` batches, such that reading from the .HDF5 files overlaps with
+    the computations on the current batch. This also works with `num_workers=0`, where the loader reads in
+    the main process otherwise. With a depth of 0, the loader is read synchronously.
+    Each iteration measures the loader throughput, and how long the consumer waited for batches.
+
+    Args:
+        loader (Iterable[:class:`Batch`]): The data loader.
+        depth (int, optional): Maximum number of batches read ahead. Defaults to 2.
+        device (Optional[:class:`torch.device`], optional): Device to move the batches to in the background thread.
+            Defaults to None (not moved).
+    """
+
+    def __init__(self, loader: Iterable[Batch], depth: int = 2, device: Optional[torch.device] = None):
+
+        if depth < 0:
+            raise ValueError(f"The prefetch depth can't be negative, got {depth}")
+
+        self._loader = loader
+        self._depth = depth
+        self._device = device
+
+        self.batch_count = 0
+        self.sample_count = 0
+        self.wait_time = 0.0
+        self.elapsed_time = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def __len__(self) -> int:
+        return len(self._loader)
+
+    @property
+    def samples_per_second(self) -> float:
+        if self.elapsed_time == 0.0:
+            return 0.0
+        return self.sample_count / self.elapsed_time
+
+    def _prepare(self, batch: Batch) -> Batch:
+        if self._device is not None:
+            batch = batch.to(self._device, non_blocking=True)
+        return batch
+
+    def _count(self, batch: Batch):
+        self.batch_count += 1
+        self.sample_count += batch.num_graphs
+
+    def __iter__(self) -> Iterator[Batch]:
+
+        self.batch_count = 0
+        self.sample_count = 0
+        self.wait_time = 0.0
+        start_time = perf_counter()
+
+        try:
+            if self._depth == 0:
+                iterator = iter(self._loader)
+                while True:
+                    wait_start = perf_counter()
+                    try:
+                        batch = self._prepare(next(iterator))
+                    except StopIteration:
+                        break
+                    self.wait_time += perf_counter() - wait_start
+                    self._count(batch)
+                    yield batch
+            else:
+                yield from self._iterate_prefetched()
+        finally:
+            self.elapsed_time = perf_counter() - start_time
+
+    def _iterate_prefetched(self) -> Iterator[Batch]:
+
+        batches = queue.Queue(maxsize=self._depth)
+        stop = threading.Event()
+        end = object()
+
+        def read():
+            try:
+                for batch in self._loader:
+                    item = self._prepare(batch)
+                    # wait for room in the queue, unless the consumer stopped iterating
+                    while not stop.is_set():
+                        try:
+                            batches.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                batches.put(end)
+            except Exception as e: # pylint: disable=broad-except
+                # raised in the consumer thread
+                batches.put(e)
+
+        thread = threading.Thread(target=read, name="deeprank2-prefetcher", daemon=True)
+        thread.start()
+        try:
+            while True:
+                wait_start = perf_counter()
+                item = batches.get()
+                self.wait_time += perf_counter() - wait_start
+
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                self._count(item)
+                yield item
+        finally:
+            stop.set()
+            # unblock the reader, if it's waiting for room in the queue
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    def log_metrics(self, pass_name: str):
+        """Logs the throughput of the last iteration over the loader.
+
+        Args:
+            pass_name (str): 'training', 'validation' or 'testing'
+        """
+
+        _log.info(f'{pass_name} loader {self.samples_per_second:.1f} samples/s | '
+                  f'{self.batch_count} batches | waited for data {self.wait_time:.3f}s of {self.elapsed_time:.3f}s')
@@ -0,0 +1,73 @@
+# This script can be used for measuring the time and memory of the community detection on atomic graphs,
+# with the former networkx graph and dense MCL, and with the sparse matrices built from the edge index.
+import time
+import tracemalloc
+
+import community
+import markov_clustering as mc
+import networkx as nx
+import numpy as np
+import torch
+from scipy.spatial import cKDTree
+
+from deeprank2.utils.community_pooling import community_detection
+
+#################### PARAMETERS ####################
+node_counts = [1000, 5000, 10000]
+methods = ["mcl", "louvain"]
+max_dense_node_count = 5000 # the dense MCL takes num_nodes**2 floats, and far longer
+atom_density = 0.05 # atoms per cubic Angstrom, about that of a protein
+distance_cutoff = 4.5 # Angstrom, as for the atomic graphs
+seed = 42
+####################################################
+
+
+def atomic_graph(node_count: int) -> torch.Tensor:
+    """Edge index of random atoms in a cube, with an edge between atoms closer than the cutoff."""
+    rng = np.random.default_rng(seed)
+    positions = rng.random((node_count, 3)) * (node_count / atom_density) ** (1 / 3)
+    pairs = cKDTree(positions).query_pairs(distance_cutoff, output_type="ndarray")
+    return torch.tensor(np.vstack((pairs, pairs[:, ::-1])).T, dtype=torch.long)
+
+
+def networkx_community_detection(edge_index: torch.Tensor, num_nodes: int, method: str) -> torch.Tensor:
+    """Reproduces the former community detection, on a networkx graph built edge by edge."""
+    g = nx.Graph()
+    g.add_nodes_from(range(num_nodes))
+    for i, j in edge_index.transpose(0, 1).tolist():
+        g.add_edge(i, j)
+
+    if method == "louvain":
+        cluster = community.best_partition(g)
+        return torch.tensor([v for k, v in cluster.items()])
+
+    result = mc.run_mcl(nx.to_scipy_sparse_array(g).toarray())
+    index = np.zeros(num_nodes).astype("int")
+    for ic, c in enumerate(mc.get_clusters(result)):
+        index[list(c)] = ic
+    return torch.tensor(index)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+
+if __name__=='__main__':
+
+    for node_count in node_counts:
+        edge_index = atomic_graph(node_count)
+        print(f'{node_count} nodes, {edge_index.shape[1] // 2} edges')
+        for method in methods:
+            cluster, elapsed, peak = measure(community_detection, edge_index, node_count, None, method)
+            print(f'   {method:8s} sparse   {elapsed:8.2f} s {peak:9.1f} MiB {len(cluster.unique()):6d} clusters')
+
+            if method == "mcl" and node_count > max_dense_node_count:
+                continue
+            reference, elapsed, peak = measure(networkx_community_detection, edge_index, node_count, method)
+            print(f'   {method:8s} networkx {elapsed:8.2f} s {peak:9.1f} MiB {len(reference.unique()):6d} clusters')
@@ -0,0 +1,83 @@
+# This script can be used for comparing the grid storage policies of the DeepRank2 package,
+# in terms of size of the generated HDF5 files and read throughput of the GridDataset.
+import os
+import time
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy
+
+from deeprank2.dataset import GridDataset
+from deeprank2.domain import targetstorage as targets
+from deeprank2.features import components, contact
+from deeprank2.query import ProteinProteinInterfaceResidueQuery, QueryCollection
+from deeprank2.utils.grid import GridSettings, GridStoragePolicy, MapMethod
+
+#################### PARAMETERS ####################
+grid_settings = GridSettings(
+    # the number of points on the x, y, z edges of the cube
+    points_counts = [35, 30, 30],
+    # x, y, z sizes of the box in Å
+    sizes = [35.0, 30.0, 30.0])
+grid_map_method = MapMethod.FAST_GAUSSIAN
+grid_augmentation_count = 9
+storage_policies = {
+    'float64, lzf, auto chunks (default)': GridStoragePolicy(),
+    'float32, lzf, auto chunks': GridStoragePolicy(dtype = 'float32'),
+    'float32, lzf, grid chunks': GridStoragePolicy(dtype = 'float32', chunks = 'grid'),
+    'float32, gzip 4, grid chunks': GridStoragePolicy(dtype = 'float32', chunks = 'grid', compression = 'gzip', compression_level = 4),
+    'float16, lzf, grid chunks': GridStoragePolicy(dtype = 'float16', chunks = 'grid'),
+    'float32, lzf, slab chunks': GridStoragePolicy(dtype = 'float32', chunks = 'slab'),
+    'float32, blosc, grid chunks': GridStoragePolicy(dtype = 'float32', chunks = 'grid', compression = 'blosc'),
+    'float32, lzf, sparse': GridStoragePolicy(dtype = 'float32', sparse = True),
+}
+read_repeats = 3
+####################################################
+
+
+if __name__=='__main__':
+
+    queries = QueryCollection()
+    queries.add(ProteinProteinInterfaceResidueQuery(
+        pdb_path = "tests/data/pdb/3C8P/3C8P.pdb",
+        chain_id1 = "A",
+        chain_id2 = "B",
+        targets = {targets.BINARY: 0}))
+
+    tmp_dir = mkdtemp()
+    try:
+        for policy_name, storage_policy in storage_policies.items():
+            prefix = os.path.join(tmp_dir, policy_name.replace(' ', '').replace(',', '_').replace('(', '').replace(')', ''))
+
+            try:
+                start = time.perf_counter()
+                output_paths = queries.process(
+                    prefix = prefix,
+                    feature_modules = [components, contact],
+                    cpu_count = 1,
+                    grid_settings = grid_settings,
+                    grid_map_method = grid_map_method,
+                    grid_augmentation_count = grid_augmentation_count,
+                    grid_storage = storage_policy)
+                write_time = time.perf_counter() - start
+            except ImportError as e:
+                print(f'{policy_name}: skipped ({e})\n')
+                continue
+
+            mb_file_size = os.path.getsize(output_paths[0]) / (10**6)
+
+            dataset = GridDataset(output_paths[0], target = targets.BINARY, tqdm = False)
+            read_timings = []
+            for _ in range(read_repeats):
+                start = time.perf_counter()
+                for index in range(len(dataset)):
+                    dataset.get(index)
+                read_timings.append(time.perf_counter() - start)
+            grids_per_second = len(dataset) / numpy.mean(read_timings)
+
+            print(f'{policy_name}:')
+            print(f'    processing time: {write_time:.3f} seconds')
+            print(f'    file size: {mb_file_size:.3f} MB')
+            print(f'    GridDataset read throughput: {grids_per_second:.1f} grids/second\n')
+    finally:
+        rmtree(tmp_dir)
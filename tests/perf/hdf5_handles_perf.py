@@ -0,0 +1,47 @@
+# This script can be used for measuring the loading throughput of the GraphDataset,
+# with the .HDF5 file handles kept open between samples or reopened for every sample.
+import time
+
+from torch_geometric.loader import DataLoader
+
+from deeprank2.dataset import GraphDataset, close_hdf5_files
+
+#################### PARAMETERS ####################
+hdf5_paths = ["tests/data/hdf5/1ATN_ppi.hdf5", "tests/data/hdf5/test.hdf5"]
+node_features = "all"
+edge_features = "all"
+num_workers = [0, 2]
+batch_size = 8
+epochs = 5
+####################################################
+
+
+class ReopeningGraphDataset(GraphDataset):
+    """Reproduces the former behaviour of opening and closing the .HDF5 file for each sample."""
+
+    def get(self, idx: int):
+        data = super().get(idx)
+        close_hdf5_files()
+        return data
+
+
+def samples_per_second(dataset: GraphDataset, workers: int) -> float:
+    loader = DataLoader(dataset, batch_size = batch_size, shuffle = True, num_workers = workers,
+                        persistent_workers = workers > 0)
+    start = time.perf_counter()
+    sample_count = 0
+    for _ in range(epochs):
+        for batch in loader:
+            sample_count += batch.num_graphs
+    return sample_count / (time.perf_counter() - start)
+
+
+if __name__=='__main__':
+
+    for dataset_class in [ReopeningGraphDataset, GraphDataset]:
+        dataset = dataset_class(hdf5_paths, node_features = node_features, edge_features = edge_features,
+                                target = "binary", tqdm = False)
+        for workers in num_workers:
+            rate = samples_per_second(dataset, workers)
+            print(f'{dataset_class.__name__:25s} workers: {workers} -> {rate:8.1f} samples/s')
+        close_hdf5_files()
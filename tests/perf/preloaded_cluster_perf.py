@@ -0,0 +1,41 @@
+# This script can be used for measuring the time to offset the preloaded clusters of the graphs in a batch,
+# with the former loop over the graphs and with the vectorized get_preloaded_cluster.
+import time
+
+import torch
+
+from deeprank2.utils.community_pooling import get_preloaded_cluster
+
+#################### PARAMETERS ####################
+batch_sizes = [128, 256, 512]
+nodes_per_graph = 150
+clusters_per_graph = 20
+repeats = 100
+####################################################
+
+
+def looped_preloaded_cluster(cluster: torch.Tensor, batch: torch.Tensor) -> torch.Tensor:
+    """Reproduces the former implementation, looping over the graphs of the batch."""
+    nbatch = torch.max(batch) + 1
+    for ib in range(1, nbatch):
+        cluster[batch == ib] += torch.max(cluster[batch == ib - 1]) + 1
+    return cluster
+
+
+def milliseconds_per_call(function, cluster: torch.Tensor, batch: torch.Tensor) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(cluster.clone(), batch)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+if __name__=='__main__':
+
+    for batch_size in batch_sizes:
+        batch = torch.arange(batch_size).repeat_interleave(nodes_per_graph)
+        cluster = torch.randint(0, clusters_per_graph, (batch_size * nodes_per_graph,))
+        assert torch.equal(looped_preloaded_cluster(cluster.clone(), batch), get_preloaded_cluster(cluster, batch))
+
+        looped = milliseconds_per_call(looped_preloaded_cluster, cluster, batch)
+        vectorized = milliseconds_per_call(get_preloaded_cluster, cluster, batch)
+        print(f'batch size {batch_size:4d}: looped {looped:8.3f} ms, vectorized {vectorized:8.3f} ms')
@@ -0,0 +1,65 @@
+# This script can be used for measuring the time to score new queries with a trained model: by processing them to an .HDF5
+# file which is read back as a test dataset, and by building the graphs in worker processes which stream them to the model.
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from deeprank2.dataset import GraphDataset
+from deeprank2.domain import edgestorage as Efeat
+from deeprank2.domain import nodestorage as Nfeat
+from deeprank2.domain import targetstorage as targets
+from deeprank2.neuralnets.gnn.ginet import GINet
+from deeprank2.query import ProteinProteinInterfaceResidueQuery, QueryCollection
+from deeprank2.trainer import Trainer
+from deeprank2.utils.exporters import HDF5OutputExporter
+
+#################### PARAMETERS ####################
+pdb_paths = sorted(glob.glob("tests/data/pdb/1ATN/*.pdb"))
+query_repeats = 8
+num_workers = 2
+batch_size = 16
+####################################################
+
+
+def _get_queries() -> QueryCollection:
+    queries = QueryCollection()
+    for _ in range(query_repeats):
+        for index, pdb_path in enumerate(pdb_paths):
+            queries.add(ProteinProteinInterfaceResidueQuery(pdb_path, "A", "B", targets = {targets.BINARY: index % 2}),
+                        warn_duplicate = False)
+    return queries
+
+
+if __name__=='__main__':
+
+    output_directory = tempfile.mkdtemp()
+    queries = _get_queries()
+    node_features = [Nfeat.RESTYPE, Nfeat.POLARITY, Nfeat.RESSIZE]
+    edge_features = [Efeat.DISTANCE]
+
+    train_paths = queries.process(os.path.join(output_directory, "train"), cpu_count = num_workers)
+    dataset_train = GraphDataset(train_paths, node_features = node_features, edge_features = edge_features,
+                                 clustering_method = "mcl", target = targets.BINARY, tqdm = False)
+    trainer = Trainer(GINet, dataset_train, val_size = 0, output_exporters = [HDF5OutputExporter(output_directory)])
+    trainer.train(nepoch = 1, batch_size = batch_size, validate = False, best_model = False, filename = None)
+
+    start = time.perf_counter()
+    test_paths = queries.process(os.path.join(output_directory, "test"), cpu_count = num_workers)
+    dataset_test = GraphDataset(test_paths, train = False, dataset_train = dataset_train, clustering_method = "mcl", tqdm = False)
+    trainer.dataset_test = dataset_test
+    trainer._precluster(dataset_test) # pylint: disable=protected-access
+    trainer.predict(dataset_test, batch_size = batch_size)
+    file_time = time.perf_counter() - start
+    file_size = sum(os.path.getsize(path) for path in test_paths)
+
+    start = time.perf_counter()
+    trainer.predict(queries, batch_size = batch_size, num_workers = num_workers)
+    stream_time = time.perf_counter() - start
+
+    print(f'{len(queries)} queries, {num_workers} workers')
+    print(f'process + dataset: {file_time:6.2f} s, {file_size / 2**20:.1f} MiB written')
+    print(f'streamed         : {stream_time:6.2f} s, 0.0 MiB written')
+
+    shutil.rmtree(output_directory)
@@ -0,0 +1,34 @@
+# This script can be used for measuring the epoch time of the Trainer on CPU,
+# in float32 and with bfloat16 mixed precision, for several numbers of PyTorch threads.
+import tempfile
+import time
+
+from deeprank2.dataset import GraphDataset
+from deeprank2.neuralnets.gnn.ginet import GINet
+from deeprank2.trainer import Trainer
+from deeprank2.utils.exporters import HDF5OutputExporter
+
+#################### PARAMETERS ####################
+hdf5_paths = ["tests/data/hdf5/1ATN_ppi.hdf5", "tests/data/hdf5/test.hdf5"]
+clustering_method = "mcl"
+thread_counts = [1, 2, 4]
+num_workers = 1
+batch_size = 4
+epochs = 5
+####################################################
+
+
+if __name__=='__main__':
+
+    dataset = GraphDataset(hdf5_paths, clustering_method = clustering_method, target = "binary", tqdm = False)
+    output_directory = tempfile.mkdtemp()
+
+    for mixed_precision in [False, True]:
+        for num_threads in thread_counts:
+            trainer = Trainer(GINet, dataset, val_size = 0, mixed_precision = mixed_precision, num_threads = num_threads,
+                              worker_affinity = True, output_exporters = [HDF5OutputExporter(output_directory)])
+            start = time.perf_counter()
+            trainer.train(nepoch = epochs, batch_size = batch_size, num_workers = num_workers, validate = False,
+                          best_model = False, filename = None)
+            epoch_time = (time.perf_counter() - start) / epochs
+            print(f'{"bfloat16" if mixed_precision else "float32 "} threads: {num_threads} -> {epoch_time:6.3f} s/epoch')
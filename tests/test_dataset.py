@@ -1,14 +1,21 @@
+import json
 import os
 import unittest
 import warnings
-from shutil import rmtree
+from shutil import copyfile, rmtree
 from tempfile import mkdtemp
 from typing import List, Union
+from unittest.mock import patch
 
 import h5py
 import numpy as np
 import pytest
-from deeprank2.dataset import GraphDataset, GridDataset, save_hdf5_keys
+import torch
+from torch_geometric.data.batch import Batch
+from deeprank2.dataset import (BatchLoader, DataCache, GraphDataset, GridDataset,
+                               SharedDataCache, _entry_catalogs,
+                               close_hdf5_files, save_hdf5_keys)
+from deeprank2.utils.packedgraphs import pack_graphs
 from torch_geometric.loader import DataLoader
 
 from deeprank2.domain import edgestorage as Efeat
@@ -253,6 +260,28 @@ class TestDataSet(unittest.TestCase):
             target_filter={targets.IRMSD: "<10"}
         )
 
+    def test_filter_values_graphdataset(self):
+        hdf5_path = "tests/data/hdf5/1ATN_ppi.hdf5"
+        with h5py.File(hdf5_path, 'r') as f5:
+            irmsds = {entry_name: f5[entry_name][targets.VALUES][targets.IRMSD][()] for entry_name in f5.keys()}
+        threshold = np.median(list(irmsds.values()))
+
+        for target_filter, condition in [
+            ({targets.IRMSD: f"<{threshold}"}, lambda irmsd: irmsd < threshold),
+            ({targets.IRMSD: f">= {threshold}"}, lambda irmsd: irmsd >= threshold),
+            ({targets.IRMSD: f">0 and <{threshold}"}, lambda irmsd: 0 < irmsd < threshold),
+            ({targets.IRMSD: f"<{threshold} or >{threshold}"}, lambda irmsd: irmsd != threshold),
+            ({targets.IRMSD: None}, lambda irmsd: True),
+            ({"missing_target": ">1"}, lambda irmsd: True),
+        ]:
+            dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.IRMSD, target_filter = target_filter)
+            assert [entry_name for _, entry_name in dataset.index_entries] == \
+                [entry_name for entry_name, irmsd in irmsds.items() if condition(irmsd)], target_filter
+
+        for target_filter in [{targets.IRMSD: "irmsd < 10"}, {targets.IRMSD: "<10 and"}, {targets.IRMSD: 10}]:
+            with pytest.raises(ValueError):
+                GraphDataset(hdf5_path = hdf5_path, target = targets.IRMSD, target_filter = target_filter)
+
     def test_multi_file_graphdataset(self):
         dataset = GraphDataset(
             hdf5_path=["tests/data/hdf5/train.hdf5", "tests/data/hdf5/valid.hdf5"],
@@ -454,6 +483,339 @@ class TestDataSet(unittest.TestCase):
 
         rmtree(output_directory)
 
+    def test_packed_graphdataset(self):
+
+        output_directory = mkdtemp()
+        hdf5_path = "tests/data/hdf5/test.hdf5"
+        packed_path = os.path.join(output_directory, "test_packed.hdf5")
+
+        try:
+            pack_graphs(hdf5_path, packed_path)
+
+            features_transform = {Nfeat.BSA: {'transform': lambda t: np.log(t+1), 'standardize': True}}
+            dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY,
+                                   features_transform = features_transform, clustering_method = "mcl")
+            packed_dataset = GraphDataset(hdf5_path = packed_path, target = targets.BINARY,
+                                          features_transform = features_transform, clustering_method = "mcl")
+
+            assert [entry_name for _, entry_name in packed_dataset.index_entries] == \
+                [entry_name for _, entry_name in dataset.index_entries]
+            assert packed_dataset.node_features == dataset.node_features
+            assert packed_dataset.edge_features == dataset.edge_features
+            assert packed_dataset.means == dataset.means
+            assert packed_dataset.devs == dataset.devs
+
+            for idx in range(len(dataset)):
+                data = dataset.get(idx)
+                packed_data = packed_dataset.get(idx)
+                for key in ["x", "edge_index", "edge_attr", "y", "pos", "cluster0", "cluster1"]:
+                    assert torch.equal(packed_data[key], data[key]), key
+                assert packed_data.entry_names == data.entry_names
+
+            # subset and target filters apply to the packed entries as well
+            subset = [entry_name for _, entry_name in dataset.index_entries][1:3]
+            packed_subset = GraphDataset(hdf5_path = packed_path, subset = subset, target = targets.BINARY)
+            assert [entry_name for _, entry_name in packed_subset.index_entries] == subset
+        finally:
+            close_hdf5_files()
+            rmtree(output_directory)
+
+    def test_write_after_building_graphdataset(self):
+        output_directory = mkdtemp()
+        hdf5_path = os.path.join(output_directory, "test.hdf5")
+        try:
+            copyfile("tests/data/hdf5/test.hdf5", hdf5_path)
+            dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY)
+
+            # building the dataset leaves no handle open
+            with h5py.File(hdf5_path, "a") as f5:
+                f5.attrs["written"] = True
+
+            # the handles kept open for loading samples are closed explicitly
+            dataset.get(0)
+            dataset.close_hdf5_files()
+            with h5py.File(hdf5_path, "a") as f5:
+                del f5.attrs["written"]
+        finally:
+            close_hdf5_files()
+            rmtree(output_directory)
+
+    def test_cache_graphdataset(self):
+        hdf5_path = "tests/data/hdf5/test.hdf5"
+
+        cache = DataCache()
+        dataset_train = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, cache = cache)
+        dataset_val = GraphDataset(hdf5_path = hdf5_path, train = False, dataset_train = dataset_train, cache = cache)
+
+        for idx in range(len(dataset_train)):
+            data = dataset_train.get(idx)
+            cached_data = dataset_train.get(idx)
+            assert cached_data is not data
+            assert torch.equal(cached_data.x, data.x)
+            assert torch.equal(cached_data.edge_attr, data.edge_attr)
+        assert len(cache) == len(dataset_train)
+        assert cache.misses == len(dataset_train)
+        assert cache.hits == len(dataset_train)
+
+        # the validation set loads its entries the same way, so it shares the cached items
+        for idx in range(len(dataset_val)):
+            dataset_val.get(idx)
+        assert cache.misses == len(dataset_train)
+
+        # a different feature selection doesn't
+        dataset_other = GraphDataset(hdf5_path = hdf5_path, node_features = [Nfeat.BSA], target = targets.BINARY, cache = cache)
+        dataset_other.get(0)
+        assert cache.misses == len(dataset_train) + 1
+
+        # transformations and standardization are compared by content, not by identity
+        dataset_transformed = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, cache = cache,
+                                           features_transform = {'all': {'transform': lambda t: t * 2, 'standardize': True}})
+        dataset_same = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, cache = cache,
+                                    features_transform = {'all': {'transform': lambda t: t * 2, 'standardize': True}})
+        dataset_transformed.get(0)
+        dataset_same.get(0)
+        assert cache.misses == len(dataset_train) + 2
+        dataset_same.features_transform = {'all': {'transform': lambda t: t * 3, 'standardize': True}}
+        dataset_same.get(0)
+        assert cache.misses == len(dataset_train) + 3
+        dataset_transformed.means = {col: mean + 1.0 for col, mean in dataset_transformed.means.items()}
+        data = dataset_transformed.get(0)
+        assert cache.misses == len(dataset_train) + 4
+        assert not torch.allclose(data.x, dataset_same.get(0).x)
+
+        # as well as when they are edited in place
+        dataset_transformed.means[Nfeat.BSA] += 1.0
+        edited_data = dataset_transformed.get(0)
+        assert cache.misses == len(dataset_train) + 5
+        assert not torch.allclose(edited_data.x, data.x)
+        assert torch.allclose(edited_data.x, dataset_transformed.load_one_graph(*dataset_transformed.index_entries[0]).x)
+        dataset_same.features_transform['all']['transform'] = lambda t: t * 4
+        edited_data = dataset_same.get(0)
+        assert cache.misses == len(dataset_train) + 6
+        assert torch.allclose(edited_data.x, dataset_same.load_one_graph(*dataset_same.index_entries[0]).x)
+
+        # least recently used items are evicted when over budget
+        item_size = DataCache.get_data_size(dataset_train.get(0))
+        small_cache = DataCache(max_bytes = item_size)
+        dataset_small = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, cache = small_cache)
+        dataset_small.get(0)
+        dataset_small.get(1)
+        assert len(small_cache) <= 1
+        assert small_cache.size_bytes <= item_size
+
+    def test_shared_cache_graphdataset(self):
+        hdf5_path = "tests/data/hdf5/test.hdf5"
+
+        cache = SharedDataCache()
+        dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, cache = cache)
+        cache.fill(dataset)
+
+        assert cache.is_shared
+        assert len(cache) == len(dataset)
+
+        # the items are read from shared memory, and not cached anymore once shared
+        data = dataset.get(0)
+        assert data.x.is_shared()
+        assert data.edge_index.is_shared()
+        assert torch.equal(data.x, dataset.load_one_graph(*dataset.index_entries[0]).x)
+        with pytest.raises(ValueError):
+            cache.fill(dataset)
+
+        # the workers read the same items
+        entry_names = []
+        for batch in DataLoader(dataset, batch_size = 2, num_workers = 2):
+            entry_names += batch.entry_names
+        assert sorted(entry_names) == sorted(entry_name for _, entry_name in dataset.index_entries)
+        assert cache.misses == len(dataset)
+
+        # a cache can only be filled by a dataset using it
+        with pytest.raises(ValueError):
+            SharedDataCache().fill(dataset)
+
+    def test_streaming_statistics_graphdataset(self):
+
+        output_directory = mkdtemp()
+        hdf5_paths = [os.path.join(output_directory, "test_0.hdf5"), os.path.join(output_directory, "test_1.hdf5")]
+        for hdf5_path in hdf5_paths:
+            copyfile("tests/data/hdf5/test.hdf5", hdf5_path)
+
+        try:
+            features_transform = {'all': {'transform': lambda t: np.log(abs(t)+1), 'standardize': True}}
+            dataset = GraphDataset(hdf5_path = hdf5_paths, target = targets.BINARY,
+                                   features_transform = features_transform, statistics_sidecar = True)
+
+            # same statistics as from the DataFrame
+            dataset.hdf5_to_pandas()
+            streaming_means, streaming_devs = dataset.means, dataset.devs
+            dataset._compute_mean_std() # pylint: disable=protected-access
+            assert streaming_means.keys() == dataset.means.keys()
+            for col in dataset.means:
+                assert np.isclose(streaming_means[col], dataset.means[col]), col
+                assert np.isclose(streaming_devs[col], dataset.devs[col]), col
+
+            # the statistics are saved next to the files, and reused for the same settings
+            for hdf5_path in hdf5_paths:
+                assert os.path.isfile(f"{hdf5_path}.stats.json")
+            with open(f"{hdf5_paths[0]}.stats.json", encoding = "utf-8") as sidecar_file:
+                sidecar = json.load(sidecar_file)
+            signature = list(sidecar["statistics"])[0]
+            sidecar["statistics"][signature][Nfeat.BSA][1] = 1000.0
+            with open(f"{hdf5_paths[0]}.stats.json", "w", encoding = "utf-8") as sidecar_file:
+                json.dump(sidecar, sidecar_file)
+
+            reloaded_dataset = GraphDataset(hdf5_path = hdf5_paths, target = targets.BINARY,
+                                            features_transform = features_transform, statistics_sidecar = True)
+            assert reloaded_dataset.means[Nfeat.BSA] > streaming_means[Nfeat.BSA]
+
+            other_dataset = GraphDataset(hdf5_path = hdf5_paths, target = targets.BINARY, statistics_sidecar = True,
+                                         features_transform = {'all': {'standardize': True}})
+            with open(f"{hdf5_paths[0]}.stats.json", encoding = "utf-8") as sidecar_file:
+                assert len(json.load(sidecar_file)["statistics"]) == 2
+            assert other_dataset.means[Nfeat.BSA] != reloaded_dataset.means[Nfeat.BSA]
+
+            # the files are processed in parallel with several cores, with the same results
+            with patch("os.cpu_count", return_value = 2):
+                parallel_dataset = GraphDataset(hdf5_path = hdf5_paths, target = targets.BINARY,
+                                                features_transform = features_transform)
+            assert parallel_dataset.means == streaming_means
+            assert parallel_dataset.devs == streaming_devs
+        finally:
+            rmtree(output_directory)
+
+    def test_entry_catalog_graphdataset(self):
+
+        output_directory = mkdtemp()
+        hdf5_paths = [os.path.join(output_directory, f"test_{index}.hdf5") for index in range(10)]
+        for hdf5_path in hdf5_paths:
+            copyfile("tests/data/hdf5/test.hdf5", hdf5_path)
+
+        try:
+            # enough files to build the catalogs in parallel
+            dataset = GraphDataset(hdf5_path = hdf5_paths, target = targets.BINARY)
+            with h5py.File(hdf5_paths[0], 'r') as f5:
+                entry_names = list(f5.keys())
+            assert dataset.index_entries == [(hdf5_path, entry_name) for hdf5_path in hdf5_paths for entry_name in entry_names]
+            for hdf5_path in hdf5_paths:
+                assert hdf5_path in _entry_catalogs
+
+            catalog_entry_names, target_values = _entry_catalogs[hdf5_paths[0]][1]
+            assert catalog_entry_names == entry_names
+            with h5py.File(hdf5_paths[0], 'r') as f5:
+                for entry_index, entry_name in enumerate(entry_names):
+                    assert target_values[targets.BINARY][entry_index] == f5[entry_name][targets.VALUES][targets.BINARY][()]
+
+            # subsets keep their order
+            subset = entry_names[::-1][:2]
+            dataset = GraphDataset(hdf5_path = hdf5_paths[:1], subset = subset, target = targets.BINARY)
+            assert [entry_name for _, entry_name in dataset.index_entries] == subset
+
+            # a modified file is cataloged again
+            close_hdf5_files()
+            with h5py.File(hdf5_paths[0], 'a') as f5:
+                del f5[entry_names[0]]
+            dataset = GraphDataset(hdf5_path = hdf5_paths[:1], target = targets.BINARY)
+            assert [entry_name for _, entry_name in dataset.index_entries] == entry_names[1:]
+        finally:
+            close_hdf5_files()
+            rmtree(output_directory)
+
+    def test_catalog_sidecar_graphdataset(self):
+
+        output_directory = mkdtemp()
+        hdf5_path = os.path.join(output_directory, "test.hdf5")
+        packed_path = os.path.join(output_directory, "test_packed.hdf5")
+        copyfile("tests/data/hdf5/test.hdf5", hdf5_path)
+
+        try:
+            pack_graphs(hdf5_path, packed_path)
+            for path in [hdf5_path, packed_path]:
+                dataset = GraphDataset(hdf5_path = path, target = targets.BINARY, target_filter = {targets.BINARY: "==1"},
+                                       catalog_sidecar = True)
+                assert os.path.isfile(f"{path}.catalog.npz")
+                expected_catalog = _entry_catalogs.pop(path)[1]
+
+                # another process reads the catalog from the sidecar, instead of the file
+                with patch("deeprank2.dataset._read_entry_catalog", side_effect = AssertionError):
+                    other_dataset = GraphDataset(hdf5_path = path, target = targets.BINARY,
+                                                 target_filter = {targets.BINARY: "==1"}, catalog_sidecar = True)
+                assert other_dataset.index_entries == dataset.index_entries
+                catalog_entry_names, target_values = _entry_catalogs[path][1]
+                assert catalog_entry_names == expected_catalog[0]
+                assert target_values.keys() == expected_catalog[1].keys()
+                for target_name, values in expected_catalog[1].items():
+                    assert np.array_equal(target_values[target_name], values, equal_nan = True)
+
+            # the sidecar of a modified file is outdated
+            close_hdf5_files()
+            _entry_catalogs.clear()
+            with h5py.File(hdf5_path, 'a') as f5:
+                entry_names = list(f5.keys())
+                del f5[entry_names[0]]
+            dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, catalog_sidecar = True)
+            assert [entry_name for _, entry_name in dataset.index_entries] == entry_names[1:]
+            _entry_catalogs.clear()
+            with patch("deeprank2.dataset._read_entry_catalog", side_effect = AssertionError):
+                dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY, catalog_sidecar = True)
+            assert [entry_name for _, entry_name in dataset.index_entries] == entry_names[1:]
+        finally:
+            close_hdf5_files()
+            rmtree(output_directory)
+
+    def test_get_batch_graphdataset(self):
+        hdf5_paths = ["tests/data/hdf5/test.hdf5", "tests/data/hdf5/1ATN_ppi.hdf5"]
+        dataset = GraphDataset(hdf5_path = hdf5_paths, node_features = [Nfeat.BSA], edge_features = [Efeat.DISTANCE],
+                               target = targets.BINARY)
+
+        indices = [5, 0, 3, 6, 1]
+        batch = dataset.get_batch(indices)
+        expected_batch = Batch.from_data_list([dataset.get(index) for index in indices])
+        assert batch.entry_names == expected_batch.entry_names
+        for key in ["x", "edge_index", "edge_attr", "y", "pos", "batch", "ptr"]:
+            assert torch.equal(batch[key], expected_batch[key]), key
+
+        # features of the entries of a file read together, with transformations per entry, and packed files
+        output_directory = mkdtemp()
+        packed_path = os.path.join(output_directory, "test_packed.hdf5")
+        try:
+            pack_graphs(hdf5_paths[0], packed_path)
+            features_transform = {Nfeat.BSA: {'transform': lambda t: t / t.max(), 'standardize': True},
+                                  Efeat.DISTANCE: {'standardize': True}}
+            for hdf5_path in [hdf5_paths[0], packed_path]:
+                transformed_dataset = GraphDataset(hdf5_path = hdf5_path, target = targets.BINARY,
+                                                   features_transform = features_transform, clustering_method = "mcl")
+                indices = [3, 0, 3, 1]
+                batch = transformed_dataset.get_batch(indices)
+                expected_batch = Batch.from_data_list([transformed_dataset.get(index) for index in indices])
+                assert batch.entry_names == expected_batch.entry_names
+                for key in ["x", "edge_index", "edge_attr", "y", "pos", "cluster0", "cluster1", "batch", "ptr"]:
+                    assert torch.allclose(batch[key], expected_batch[key]), key
+        finally:
+            close_hdf5_files()
+            rmtree(output_directory)
+
+        for num_workers in [0, 2]:
+            loader = BatchLoader(dataset, batch_size = 3, shuffle = True, num_workers = num_workers)
+            assert len(loader) == 3
+            entry_names = []
+            for batch in loader:
+                assert batch.num_graphs <= 3
+                entry_names += batch.entry_names
+            assert sorted(entry_names) == sorted(entry_name for _, entry_name in dataset.index_entries)
+
+    def test_get_target_values_graphdataset(self):
+        hdf5_paths = ["tests/data/hdf5/test.hdf5", "tests/data/hdf5/1ATN_ppi.hdf5"]
+        dataset = GraphDataset(hdf5_path = hdf5_paths, node_features = [Nfeat.BSA], edge_features = [Efeat.DISTANCE],
+                               target = targets.BINARY)
+        expected = [dataset.get(index).y.item() for index in range(len(dataset))]
+        assert np.array_equal(dataset.get_target_values(), expected)
+
+        subset = dataset.index_select([4, 1, 2])
+        assert np.array_equal(subset.get_target_values(), [expected[4], expected[1], expected[2]])
+
+        dataset.target = "missing_target"
+        with pytest.raises(ValueError):
+            dataset.get_target_values()
+
     def test_logic_train_graphdataset(self):# noqa: MC0001, pylint: disable=too-many-locals
         hdf5_path = "tests/data/hdf5/train.hdf5"
 
@@ -5,17 +5,26 @@ import shutil
 import tempfile
 import unittest
 import warnings
+from typing import List
+from unittest.mock import patch
 
 import h5py
+import numpy as np
+import pandas as pd
 import pytest
 import torch
-from deeprank2.dataset import GraphDataset, GridDataset
+from deeprank2.dataset import (BatchLoader, GraphDataset, GridDataset,
+                               close_hdf5_files)
 from deeprank2.neuralnets.cnn.model3d import CnnClassification, CnnRegression
 from deeprank2.neuralnets.gnn.foutnet import FoutNet
 from deeprank2.neuralnets.gnn.ginet import GINet
 from deeprank2.neuralnets.gnn.naive_gnn import NaiveNetwork
 from deeprank2.neuralnets.gnn.sgat import SGAT
-from deeprank2.trainer import Trainer, _divide_dataset
+from deeprank2.query import (ProteinProteinInterfaceResidueQuery,
+                             QueryCollection)
+from deeprank2.trainer import Trainer, _divide_dataset, _OutputAccumulator
+from deeprank2.utils.community_pooling import (community_detection,
+                                               community_pooling)
 from deeprank2.utils.exporters import (HDF5OutputExporter, ScatterPlotExporter,
                                        TensorboardBinaryClassificationExporter)
 
@@ -108,6 +117,40 @@ def _model_base_test( # pylint: disable=too-many-arguments, too-many-locals
             dataset_test,
             pretrained_model=save_path)
 
+def _train_distributed(rank: int, world_size: int, init_file: str, save_path: str, output_directory: str, # pylint: disable=too-many-arguments
+                       train_entries: List[str], train_hdf5_path: str = "tests/data/hdf5/test.hdf5",
+                       val_hdf5_path: str = "tests/data/hdf5/1ATN_ppi.hdf5", neuralnet = NaiveNetwork,
+                       clustering_method: str = None):
+    torch.distributed.init_process_group("gloo", init_method = f"file://{init_file}", rank = rank, world_size = world_size)
+    try:
+        dataset_train = GraphDataset(
+            hdf5_path = train_hdf5_path,
+            subset = train_entries,
+            target = targets.BINARY,
+            clustering_method = clustering_method,
+            tqdm = False,
+        )
+        dataset_val = GraphDataset(
+            hdf5_path = val_hdf5_path,
+            train = False,
+            dataset_train = dataset_train,
+            clustering_method = clustering_method,
+            tqdm = False,
+        )
+        trainer = Trainer(
+            neuralnet = neuralnet,
+            dataset_train = dataset_train,
+            dataset_val = dataset_val,
+            dataset_test = dataset_val,
+            distributed = True,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.train(nepoch = 2, batch_size = 1, validate = True, filename = save_path)
+        trainer.test()
+    finally:
+        torch.distributed.destroy_process_group()
+
+
 class TestTrainer(unittest.TestCase):
     @classmethod
     def setUpClass(class_):
@@ -397,6 +440,440 @@ class TestTrainer(unittest.TestCase):
         assert len(trainer.train_loader) == int(0.75 * len(dataset))
         assert len(trainer.valid_loader) == int(0.25 * len(dataset))
 
+    def test_precluster(self):
+        hdf5_path = os.path.join(self.work_directory, "precluster.hdf5")
+        shutil.copy("tests/data/hdf5/test.hdf5", hdf5_path)
+        with h5py.File(hdf5_path, "a") as f5:
+            for mol in f5:
+                if "clustering" in f5[mol]:
+                    del f5[f"{mol}/clustering"]
+
+        dataset = GraphDataset(
+            hdf5_path = hdf5_path,
+            clustering_method = "mcl",
+            target = targets.BINARY,
+        )
+        with patch("deeprank2.trainer._PRECLUSTER_PARALLEL_MIN_ENTRIES", 1):
+            Trainer(neuralnet = GINet, dataset_train = dataset)
+        close_hdf5_files([hdf5_path])
+
+        # same clusters as detected on the loaded graphs
+        expected_depth_1 = {}
+        with h5py.File(hdf5_path, "r") as f5:
+            for _, mol in dataset.index_entries:
+                data = dataset.load_one_graph(hdf5_path, mol)
+                close_hdf5_files([hdf5_path])
+                cluster = community_detection(data.edge_index, data.num_nodes, method = "mcl")
+                assert np.array_equal(f5[f"{mol}/clustering/mcl/depth_0"][()], cluster.numpy())
+                data = community_pooling(cluster, data)
+                cluster = community_detection(data.edge_index, data.num_nodes, method = "mcl")
+                assert np.array_equal(f5[f"{mol}/clustering/mcl/depth_1"][()], cluster.numpy())
+                expected_depth_1[mol] = cluster.numpy()
+
+        # clusters stored with the signature of the graph are kept, others are detected again
+        _, kept_mol = dataset.index_entries[0]
+        _, unsigned_mol = dataset.index_entries[1]
+        _, changed_mol = dataset.index_entries[2]
+        with h5py.File(hdf5_path, "a") as f5:
+            for mol in (kept_mol, unsigned_mol, changed_mol):
+                method_grp = f5[f"{mol}/clustering/mcl"]
+                method_grp["depth_0"][...] = 5
+                if mol == unsigned_mol:
+                    del method_grp.attrs["graph_hash"]
+                elif mol == changed_mol:
+                    # clusters detected on a graph with the same number of nodes, but other edges
+                    method_grp.attrs["graph_hash"] = "0" * 40
+        Trainer(neuralnet = GINet, dataset_train = dataset)
+        close_hdf5_files([hdf5_path])
+        with h5py.File(hdf5_path, "r") as f5:
+            assert np.all(f5[f"{kept_mol}/clustering/mcl/depth_0"][()] == 5)
+            for mol in (unsigned_mol, changed_mol):
+                assert np.all(f5[f"{mol}/clustering/mcl/depth_0"][()] != 5)
+                assert np.array_equal(f5[f"{mol}/clustering/mcl/depth_1"][()], expected_depth_1[mol])
+
+    def test_class_weights(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            class_weights = True,
+            output_exporters = [HDF5OutputExporter(self.work_directory)],
+        )
+        trainer.train(nepoch = 1, batch_size = 2, best_model = False, filename = None)
+
+        targets_all = torch.cat([batch.y for batch in trainer.train_loader]).tolist()
+        counts = torch.tensor([targets_all.count(i) for i in trainer.classes], dtype = torch.float32)
+        assert torch.allclose(trainer.weights, (1.0 / counts) / (1.0 / counts).sum())
+
+    def test_batched_loading(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        dataset_test = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            train = False,
+            dataset_train = dataset,
+        )
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            dataset_test = dataset_test,
+            output_exporters = [HDF5OutputExporter(self.work_directory)],
+        )
+        trainer.train(nepoch = 2, batch_size = 2, best_model = False, filename = None, batched_loading = True)
+        assert isinstance(trainer.train_loader, BatchLoader)
+        assert len(trainer.train_loader) == 2
+
+        trainer.test(batch_size = 3, batched_loading = True)
+        assert isinstance(trainer.test_loader, BatchLoader)
+        assert sum(batch.num_graphs for batch in trainer.test_loader) == len(dataset_test)
+
+    def test_mixed_precision(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            clustering_method = "mcl",
+            target = targets.BINARY,
+        )
+        num_threads = torch.get_num_threads()
+        try:
+            trainer = Trainer(
+                neuralnet = GINet,
+                dataset_train = dataset,
+                mixed_precision = True,
+                num_threads = 1,
+                worker_affinity = True,
+                output_exporters = [HDF5OutputExporter(self.work_directory)],
+            )
+            assert torch.get_num_threads() == 1
+            trainer.train(nepoch = 2, batch_size = 2, num_workers = 1, filename = self.save_path)
+        finally:
+            torch.set_num_threads(num_threads)
+
+        state = torch.load(self.save_path)
+        assert state["mixed_precision"]
+        assert state["num_threads"] == 1
+        assert state["worker_affinity"]
+
+        dataset_test = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            clustering_method = "mcl",
+            train = False,
+            dataset_train = dataset,
+        )
+        trainer = Trainer(
+            neuralnet = GINet,
+            dataset_test = dataset_test,
+            pretrained_model = self.save_path,
+            output_exporters = [HDF5OutputExporter(self.work_directory)],
+        )
+        assert trainer.mixed_precision
+
+    def test_distributed(self):
+        world_size = 2
+        output_directory = tempfile.mkdtemp()
+        init_file = os.path.join(output_directory, "distributed_init")
+        save_path = os.path.join(output_directory, "model.pth.tar")
+        self.addCleanup(shutil.rmtree, output_directory)
+        # an odd number of training entries, which the sampler pads to train on the same number in each process
+        with h5py.File("tests/data/hdf5/test.hdf5", "r") as f5:
+            train_entries = sorted(f5.keys())[:3]
+        torch.multiprocessing.spawn(_train_distributed, args = (world_size, init_file, save_path, output_directory, train_entries),
+                                    nprocs = world_size)
+
+        state = torch.load(save_path)
+        assert not any(key.startswith("module.") for key in state["model_state"])
+
+        # the validation and test entries are evaluated once each, over both processes
+        with h5py.File("tests/data/hdf5/1ATN_ppi.hdf5", "r") as f5:
+            val_entries = sorted(f5.keys())
+        output = pd.read_hdf(os.path.join(output_directory, "output_exporter.hdf5"), key = "testing")
+        assert sorted(output.entry) == val_entries
+        output = pd.read_hdf(os.path.join(output_directory, "output_exporter.hdf5"), key = "training")
+        assert sorted(output[(output.phase == "validation") & (output.epoch == 1)].entry) == val_entries
+
+        # the padded training entries are left out of the training outputs
+        for epoch in [0, 1, 2]:
+            assert sorted(output[(output.phase == "training") & (output.epoch == epoch)].entry) == train_entries
+
+    def test_distributed_clustering(self):
+        world_size = 2
+        output_directory = tempfile.mkdtemp()
+        init_file = os.path.join(output_directory, "distributed_init")
+        save_path = os.path.join(output_directory, "model.pth.tar")
+        self.addCleanup(shutil.rmtree, output_directory)
+        # the clusters are written to copies of the files
+        train_hdf5_path = shutil.copy("tests/data/hdf5/test.hdf5", output_directory)
+        val_hdf5_path = shutil.copy("tests/data/hdf5/1ATN_ppi.hdf5", output_directory)
+        with h5py.File(train_hdf5_path, "r") as f5:
+            train_entries = sorted(f5.keys())[:3]
+        torch.multiprocessing.spawn(_train_distributed, args = (world_size, init_file, save_path, output_directory, train_entries,
+                                                                train_hdf5_path, val_hdf5_path, GINet, "mcl"),
+                                    nprocs = world_size)
+
+        assert os.path.isfile(save_path)
+        for hdf5_path, entries in [(train_hdf5_path, train_entries), (val_hdf5_path, None)]:
+            with h5py.File(hdf5_path, "r") as f5:
+                for mol in entries or f5.keys():
+                    assert "depth_0" in f5[f"{mol}/clustering/mcl"]
+                    assert "depth_1" in f5[f"{mol}/clustering/mcl"]
+
+    def test_output_accumulator(self):
+        accumulator = _OutputAccumulator(3)
+        outputs = torch.rand(7, 2)
+        targets = torch.tensor([0, 1, 1, 0, 1, 0, 0])
+        for start in range(0, 7, 2):
+            accumulator.add(outputs[start:start + 2], targets[start:start + 2])
+        assert np.array_equal(accumulator.outputs(), outputs.numpy())
+        assert np.array_equal(accumulator.targets(), targets.numpy())
+
+        accumulator = _OutputAccumulator(2)
+        accumulator.add(outputs[:, 0])
+        assert accumulator.outputs().shape == (7,)
+        assert accumulator.targets().shape == (0,)
+
+    def test_exported_outputs(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.train(nepoch = 1, batch_size = 3, best_model = False, filename = None)
+
+        output = pd.read_hdf(os.path.join(output_directory, "output_exporter.hdf5"), key = "training")
+        training = output[(output.phase == "training") & (output.epoch == 1)]
+        assert sorted(training.entry) == sorted(entry_name for _, entry_name in trainer.dataset_train.index_entries)
+        assert all(len(probabilities) == 2 and abs(sum(probabilities) - 1.0) < 1e-5 for probabilities in training.output)
+        assert set(training.target) <= {0, 1}
+
+    def test_predict(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        dataset_test = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            train = False,
+            dataset_train = dataset,
+        )
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            dataset_test = dataset_test,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.train(nepoch = 1, batch_size = 2, best_model = False, filename = None)
+        trainer.test(batch_size = 2)
+        tested = pd.read_hdf(os.path.join(output_directory, "output_exporter.hdf5"), key = "testing")
+
+        predicted = trainer.predict(dataset_test, batch_size = 3)
+        assert list(predicted.columns) == ["entry", "output_0", "output_1"]
+        assert list(predicted.entry) == list(tested.entry)
+        assert np.allclose(predicted[["output_0", "output_1"]].to_numpy(), np.array(tested.output.tolist()), atol = 1e-6)
+
+        csv_path = os.path.join(output_directory, "predictions.csv")
+        assert trainer.predict(dataset_test, csv_path, batch_size = 3) is None
+        assert np.allclose(pd.read_csv(csv_path)[["output_0", "output_1"]].to_numpy(),
+                           predicted[["output_0", "output_1"]].to_numpy())
+
+        hdf5_path = os.path.join(output_directory, "predictions.hdf5")
+        trainer.predict(dataset_test, hdf5_path, batch_size = 3, batched_loading = True)
+        with h5py.File(hdf5_path, "r") as f5:
+            assert [name.decode() for name in f5["entry"][()]] == list(predicted.entry)
+            assert np.allclose(f5["output"][()], predicted[["output_0", "output_1"]].to_numpy())
+
+        with pytest.raises(ValueError):
+            trainer.predict(dataset_test, os.path.join(output_directory, "predictions.txt"))
+
+    def test_predict_queries(self):
+        queries = QueryCollection()
+        for index, pdb_path in enumerate(sorted(glob.glob("tests/data/pdb/1ATN/*.pdb"))):
+            queries.add(ProteinProteinInterfaceResidueQuery(pdb_path, "A", "B", targets = {targets.BINARY: index % 2}))
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        hdf5_paths = queries.process(os.path.join(output_directory, "processed"), cpu_count = 1)
+
+        dataset = GraphDataset(
+            hdf5_path = hdf5_paths,
+            node_features = [Nfeat.RESTYPE, Nfeat.POLARITY, Nfeat.RESSIZE],
+            edge_features = [Efeat.DISTANCE],
+            features_transform = {Nfeat.RESSIZE: {"standardize": True}},
+            clustering_method = "mcl",
+            target = targets.BINARY,
+        )
+        trainer = Trainer(
+            neuralnet = GINet,
+            dataset_train = dataset,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.train(nepoch = 1, batch_size = 2, best_model = False, filename = None)
+
+        # the graphs built in memory give the same outputs as the processed .HDF5 file
+        from_file = trainer.predict(dataset).sort_values("entry", ignore_index = True)
+        from_queries = trainer.predict(queries, batch_size = 3).sort_values("entry", ignore_index = True)
+        assert list(from_queries.entry) == list(from_file.entry)
+        assert np.allclose(from_queries[["output_0", "output_1"]].to_numpy(), from_file[["output_0", "output_1"]].to_numpy(), atol = 1e-6)
+
+        # built by worker processes through a bounded queue, and also written to .HDF5 files
+        prefix = os.path.join(output_directory, "streamed")
+        streamed = trainer.predict(queries, batch_size = 3, num_workers = 2, queue_size = 1, hdf5_prefix = prefix)
+        streamed = streamed.sort_values("entry", ignore_index = True)
+        assert list(streamed.entry) == list(from_file.entry)
+        assert np.allclose(streamed[["output_0", "output_1"]].to_numpy(), from_file[["output_0", "output_1"]].to_numpy(), atol = 1e-6)
+
+        streamed_paths = glob.glob(f"{prefix}-*.hdf5")
+        assert len(streamed_paths) == 2
+        entry_names = []
+        for streamed_path in streamed_paths:
+            with h5py.File(streamed_path, "r") as f5:
+                entry_names += list(f5.keys())
+                assert all("clustering/mcl/depth_1" in f5[entry_name] for entry_name in f5)
+        assert sorted(entry_names) == list(from_file.entry)
+
+    def test_checkpoints(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        checkpoint_directory = os.path.join(output_directory, "checkpoints")
+        save_path = os.path.join(output_directory, "model.pth.tar")
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            val_size = 0,
+            class_weights = True,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.configure_optimizers(torch.optim.Adamax)
+        trainer.train(nepoch = 5, batch_size = 2, filename = save_path, checkpoint_directory = checkpoint_directory,
+                      checkpoint_interval = 2, checkpoint_keep_last = 1, checkpoint_keep_best = 2)
+
+        assert sorted(name for name in os.listdir(checkpoint_directory) if name.startswith("epoch-")) == ["epoch-4.pth.tar"]
+        assert len([name for name in os.listdir(checkpoint_directory) if name.startswith("best-epoch-")]) == 2
+        assert os.path.isfile(os.path.join(checkpoint_directory, f"best-epoch-{trainer.epoch_saved_model}.pth.tar"))
+
+        # only settings are saved, no live objects, and the snapshot is not changed by later epochs
+        state = torch.load(save_path, weights_only = True)
+        assert "optimizer" not in state and "lossfunction" not in state
+        assert state["optimizer_class"] == "torch.optim.adamax.Adamax"
+        assert state["epoch_saved_model"] == trainer.epoch_saved_model
+        periodic_state = torch.load(os.path.join(checkpoint_directory, "epoch-4.pth.tar"), weights_only = True)
+        assert periodic_state["epoch_saved_model"] == 4
+        if trainer.epoch_saved_model != 4:
+            assert not all(torch.equal(state["model_state"][key], periodic_state["model_state"][key]) for key in state["model_state"])
+
+        trainer_pretrained = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_test = dataset,
+            pretrained_model = save_path,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        assert isinstance(trainer_pretrained.optimizer, torch.optim.Adamax)
+        assert trainer_pretrained.optimizer.param_groups[0]["params"][0] is next(trainer_pretrained.model.parameters())
+        assert isinstance(trainer_pretrained.lossfunction, torch.nn.CrossEntropyLoss)
+        assert torch.allclose(trainer_pretrained.lossfunction.weight, trainer.weights)
+        trainer_pretrained.test()
+
+    def test_legacy_checkpoint(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        save_path = os.path.join(output_directory, "model.pth.tar")
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            val_size = 0,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        trainer.configure_optimizers(torch.optim.Adamax)
+        trainer.train(nepoch = 1, batch_size = 2, best_model = False, filename = None)
+
+        # the format of earlier versions, with the optimizer and loss function objects pickled
+        state = trainer._save_model() # pylint: disable=protected-access
+        for key in ("optimizer_class", "lossfunction_class", "weights", "epoch_saved_model"):
+            del state[key]
+        state["optimizer"] = trainer.optimizer
+        state["lossfunction"] = trainer.lossfunction
+        torch.save(state, save_path)
+
+        # the fully pickled format is only loaded when it is trusted explicitly
+        with pytest.raises(ValueError, match = "trust_legacy_checkpoint"):
+            Trainer(
+                neuralnet = NaiveNetwork,
+                dataset_test = dataset,
+                pretrained_model = save_path,
+                output_exporters = [HDF5OutputExporter(output_directory)],
+            )
+
+        with self.assertLogs("deeprank2.trainer", level = "WARNING") as logs:
+            trainer_pretrained = Trainer(
+                neuralnet = NaiveNetwork,
+                dataset_test = dataset,
+                pretrained_model = save_path,
+                output_exporters = [HDF5OutputExporter(output_directory)],
+                trust_legacy_checkpoint = True,
+            )
+        assert any("weights_only=False" in line for line in logs.output)
+        assert isinstance(trainer_pretrained.optimizer, torch.optim.Adamax)
+        assert isinstance(trainer_pretrained.lossfunction, torch.nn.CrossEntropyLoss)
+        for key, value in trainer_pretrained.model.state_dict().items():
+            assert torch.equal(value, state["model_state"][key])
+
+    def test_checkpoints_stale_epoch(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        output_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_directory)
+        checkpoint_directory = os.path.join(output_directory, "checkpoints")
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            val_size = 0,
+            output_exporters = [HDF5OutputExporter(output_directory)],
+        )
+        # the epoch of a model saved before, as set by a previous training or a pretrained model
+        trainer.epoch_saved_model = 1
+        trainer.train(nepoch = 2, batch_size = 2, best_model = False, filename = None,
+                      checkpoint_directory = checkpoint_directory, checkpoint_interval = 1)
+
+        assert trainer.epoch_saved_model == 2
+        for epoch in (1, 2):
+            state = torch.load(os.path.join(checkpoint_directory, f"epoch-{epoch}.pth.tar"), weights_only = True)
+            assert state["epoch_saved_model"] == epoch
+
+    def test_prefetching(self):
+        dataset = GraphDataset(
+            hdf5_path = "tests/data/hdf5/test.hdf5",
+            target = targets.BINARY,
+        )
+        trainer = Trainer(
+            neuralnet = NaiveNetwork,
+            dataset_train = dataset,
+            output_exporters = [HDF5OutputExporter(self.work_directory)],
+        )
+        with self.assertLogs("deeprank2.utils.prefetcher", level = "INFO") as logs:
+            trainer.train(nepoch = 1, batch_size = 2, best_model = False, filename = None, prefetch_depth = 2)
+        assert trainer.prefetch_depth == 2
+        assert any("training loader" in line and "samples/s" in line for line in logs.output)
+
     def test_no_valid_full_train(self):
         dataset = GraphDataset(
             hdf5_path = "tests/data/hdf5/test.hdf5",
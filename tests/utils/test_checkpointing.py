@@ -0,0 +1,60 @@
+import os
+
+import pytest
+import torch
+
+from deeprank2.utils.checkpointing import (CheckpointWriter, cpu_snapshot,
+                                           get_class_name, import_class)
+
+
+def test_cpu_snapshot():
+    model = torch.nn.Linear(3, 2)
+    state = {"model_state": model.state_dict(), "epochs": [1, (2, torch.ones(1))], "name": "linear"}
+    snapshot = cpu_snapshot(state)
+
+    with torch.no_grad():
+        model.weight.add_(1.0)
+    assert not torch.equal(snapshot["model_state"]["weight"], model.weight)
+    assert torch.equal(snapshot["model_state"]["weight"] + 1.0, model.weight)
+    assert isinstance(snapshot["epochs"][1], tuple)
+    assert snapshot["name"] == "linear"
+
+
+def test_class_names():
+    assert import_class(get_class_name(torch.optim.Adam)) is torch.optim.Adam
+    assert import_class(get_class_name(torch.nn.CrossEntropyLoss)) is torch.nn.CrossEntropyLoss
+
+    class LocalLoss(torch.nn.MSELoss):
+        pass
+
+    with pytest.raises(ValueError):
+        import_class(get_class_name(LocalLoss))
+
+
+def test_retention(tmp_path):
+    # at epoch 6, both a periodic and a best checkpoint are removed
+    losses = [0.5, 0.4, 0.6, 0.3, 0.7, 0.35]
+    with CheckpointWriter(str(tmp_path), interval = 2, keep_last = 2, keep_best = 2) as checkpoints:
+        for epoch, loss in enumerate(losses, start = 1):
+            if checkpoints.is_due(epoch, loss):
+                checkpoints.save_epoch(epoch, loss, {"epoch": epoch, "value": torch.tensor(loss)})
+        checkpoints.save(str(tmp_path / "model.pth.tar"), {"epoch": 4})
+        best_paths = checkpoints.best_paths
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["epoch-4.pth.tar", "epoch-6.pth.tar", "best-epoch-4.pth.tar", "best-epoch-6.pth.tar", "model.pth.tar"])
+    assert best_paths == [str(tmp_path / "best-epoch-4.pth.tar"), str(tmp_path / "best-epoch-6.pth.tar")]
+    assert torch.load(best_paths[0])["epoch"] == 4
+
+
+def test_write_error(tmp_path):
+    # the error of the background thread is raised in the training thread
+    with pytest.raises(AttributeError):
+        with CheckpointWriter() as checkpoints:
+            checkpoints.save(str(tmp_path / "model.pth.tar"), {"model": lambda: None})
+    assert os.listdir(tmp_path) == []
+
+
+def test_no_directory():
+    with CheckpointWriter(interval = 1, keep_best = 1) as checkpoints:
+        assert not checkpoints.is_due(1, 0.5)
@@ -1,10 +1,15 @@
 import unittest
 
+import markov_clustering as mc
+import networkx as nx
 import numpy as np
 import torch
-from deeprank2.utils.community_pooling import (community_detection,
+from deeprank2.utils.community_pooling import (_adjacency_matrix,
+                                               community_detection,
                                                community_detection_per_batch,
-                                               community_pooling)
+                                               community_pooling,
+                                               get_preloaded_cluster,
+                                               markov_clustering)
 from torch_geometric.data import Batch, Data
 
 
@@ -58,6 +63,42 @@ class TestCommunity(unittest.TestCase):
             method="xxxx",
         )
 
+    def test_sparse_mcl(self):
+        rng = np.random.default_rng(0)
+        num_nodes = 80
+        edge_index = torch.tensor(rng.integers(0, num_nodes, (2, 300)))
+        edge_attr = torch.tensor(rng.random(300))
+
+        # same adjacency matrix as a networkx graph
+        g = nx.Graph()
+        g.add_nodes_from(range(num_nodes))
+        for iedge, (i, j) in enumerate(edge_index.transpose(0, 1).tolist()):
+            g.add_edge(i, j, weight=edge_attr[iedge])
+        matrix = nx.to_scipy_sparse_array(g).toarray()
+        assert np.allclose(_adjacency_matrix(edge_index, num_nodes, edge_attr).toarray(), matrix)
+
+        # same clusters as the dense MCL
+        expected = np.zeros(num_nodes).astype("int")
+        for ic, c in enumerate(mc.get_clusters(mc.run_mcl(matrix))):
+            expected[list(c)] = ic
+        assert np.array_equal(markov_clustering(_adjacency_matrix(edge_index, num_nodes, edge_attr)), expected)
+
+        cluster = community_detection(edge_index, num_nodes, edge_attr=edge_attr, method="mcl")
+        assert np.array_equal(cluster.numpy(), expected)
+
+    def test_preloaded_cluster(self):
+        rng = np.random.default_rng(0)
+        node_counts = rng.integers(1, 20, 50)
+        batch = torch.repeat_interleave(torch.arange(len(node_counts)), torch.tensor(node_counts))
+        cluster = torch.cat([torch.tensor(rng.integers(0, count, count)) for count in node_counts])
+
+        expected = cluster.clone()
+        for ib in range(1, len(node_counts)):
+            expected[batch == ib] += torch.max(expected[batch == ib - 1]) + 1
+
+        offset_cluster = get_preloaded_cluster(cluster, batch)
+        assert torch.equal(offset_cluster, expected)
+
     def test_pooling(self):
 
         batch = Batch().from_data_list([self.data, self.data])
@@ -7,9 +7,11 @@ from unittest.mock import patch
 
 import h5py
 import pandas as pd
+import numpy as np
+import pytest
 from deeprank2.utils.exporters import (HDF5OutputExporter,
                                        OutputExporterCollection,
-                                       ScatterPlotExporter,
+                                       PredictionWriter, ScatterPlotExporter,
                                        TensorboardBinaryClassificationExporter)
 
 logging.getLogger(__name__)
@@ -147,3 +149,30 @@ class TestOutputExporters(unittest.TestCase):
         # assert there are 6 columns ('phase', 'epoch', 'entry', 'output', 'target', 'loss')
         assert df_test_1[df_test_1.phase == pass_name_1].shape[1] == 6
         assert df_test_2[df_test_2.phase == pass_name_2].shape[1] == 6
+
+    def test_prediction_writer(self):
+        entry_names = ["entry1", "entry2", "entry3"]
+        outputs = np.array([[0.2, 0.8], [0.7, 0.3], [0.4, 0.6]])
+
+        for extension in [".csv", ".hdf5", ".h5"]:
+            output_path = os.path.join(self._work_dir, f"predictions{extension}")
+            with PredictionWriter(output_path) as writer:
+                writer.write(entry_names[:2], outputs[:2])
+                writer.write(entry_names[2:], outputs[2:])
+            assert writer.dataframe() is None
+
+            if extension == ".csv":
+                df = pd.read_csv(output_path)
+                assert list(df.entry) == entry_names
+                assert np.allclose(df[["output_0", "output_1"]].values, outputs)
+            else:
+                with h5py.File(output_path, "r") as f5:
+                    assert list(f5["entry"].asstr()[()]) == entry_names
+                    assert np.allclose(f5["output"][()], outputs)
+
+        with PredictionWriter() as writer:
+            writer.write(entry_names, outputs[:, 1])
+        assert list(writer.dataframe().entry) == entry_names
+
+        with pytest.raises(ValueError, match = r"\.csv, \.hdf5, \.h5"):
+            PredictionWriter(os.path.join(self._work_dir, "predictions.txt"))
@@ -242,3 +242,72 @@ def test_graph_augmented_write_as_grid_to_hdf5(graph):
 
     finally:
         shutil.rmtree(tmp_dir_path)  # clean up after the test
+
+
+def test_graph_augmented_grids_batch_write_to_hdf5(graph):
+    """Test that augmented grids written in one batch match the ones written one by one.
+    """
+
+    tmp_dir_path = tempfile.mkdtemp()
+
+    batch_hdf5_path = os.path.join(tmp_dir_path, "101m_batch.hdf5")
+    single_hdf5_path = os.path.join(tmp_dir_path, "101m_single.hdf5")
+
+    try:
+        grid_settings = GridSettings([20, 20, 20], [20.0, 20.0, 20.0])
+
+        augmentations = []
+        for _ in range(3):
+            axis, angle = get_rot_axis_angle(randrange(100))
+            augmentations.append(Augmentation(axis, angle))
+
+        graph.write_as_grid_to_hdf5(batch_hdf5_path, grid_settings, MapMethod.GAUSSIAN)
+        graph.write_as_augmented_grids_to_hdf5(batch_hdf5_path, grid_settings, MapMethod.GAUSSIAN, augmentations)
+
+        for augmentation in augmentations:
+            graph.write_as_grid_to_hdf5(single_hdf5_path, grid_settings, MapMethod.GAUSSIAN, augmentation)
+
+        with h5py.File(batch_hdf5_path, "r") as f5_batch, h5py.File(single_hdf5_path, "r") as f5_single:
+            assert list(f5_batch.keys()) == [entry_id, f"{entry_id}_000", f"{entry_id}_001", f"{entry_id}_002"]
+
+            for aug_id in [f"{entry_id}_000", f"{entry_id}_001", f"{entry_id}_002"]:
+                batch_group = f5_batch[f"{aug_id}/{gridstorage.MAPPED_FEATURES}"]
+                single_group = f5_single[f"{aug_id}/{gridstorage.MAPPED_FEATURES}"]
+
+                assert sorted(batch_group.keys()) == sorted(single_group.keys())
+                for feature_name in batch_group:
+                    assert np.allclose(batch_group[feature_name][()], single_group[feature_name][()])
+
+                assert f5_batch[aug_id][Target.VALUES][target_name][()] == target_value
+    finally:
+        shutil.rmtree(tmp_dir_path)  # clean up after the test
+
+
+def test_graph_write_atomic_densities_as_grid_to_hdf5(graph):
+    """Test that the atomic densities are written as one grid channel per element.
+    """
+
+    tmp_dir_path = tempfile.mkdtemp()
+
+    hdf5_path = os.path.join(tmp_dir_path, "101m.hdf5")
+
+    try:
+        grid_settings = GridSettings([20, 20, 20], [20.0, 20.0, 20.0])
+
+        graph.write_as_grid_to_hdf5(hdf5_path, grid_settings, MapMethod.GAUSSIAN, atomic_densities=True)
+
+        axis, angle = get_rot_axis_angle(randrange(100))
+        graph.write_as_augmented_grids_to_hdf5(hdf5_path, grid_settings, MapMethod.GAUSSIAN,
+                                               [Augmentation(axis, angle)], atomic_densities=True)
+
+        with h5py.File(hdf5_path, "r") as f5:
+            for entry_name in [entry_id, f"{entry_id}_000"]:
+                mapped_group = f5[entry_name][gridstorage.MAPPED_FEATURES]
+                for element in ["C", "N", "O", "S", "P", "H"]:
+                    assert f"{gridstorage.ATOMIC_DENSITY}_{element}" in mapped_group
+
+                carbon_density = mapped_group[f"{gridstorage.ATOMIC_DENSITY}_C"][()]
+                assert np.all(carbon_density.shape == tuple(grid_settings.points_counts))
+                assert np.sum(carbon_density) > 0.0
+    finally:
+        shutil.rmtree(tmp_dir_path)  # clean up after the test
@@ -1,8 +1,17 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest.mock import patch
+
 import h5py
 import numpy as np
+import pytest
+from deeprank2.dataset import _read_grid_feature
+from deeprank2.domain import gridstorage
 from deeprank2.query import (ProteinProteinInterfaceAtomicQuery,
                              ProteinProteinInterfaceResidueQuery)
-from deeprank2.utils.grid import Grid, GridSettings, MapMethod
+from deeprank2.utils.grid import (Grid, GridSettings, GridStoragePolicy,
+                                  MapMethod)
 
 
 def test_residue_grid_orientation():
@@ -99,3 +108,145 @@ def test_atomic_grid_orientation():
 
     assert grid.zs.shape == target_zs.shape
     assert np.all(np.abs(grid.zs - target_zs) < coord_error_margin), f"\n{grid.zs} != \n{target_zs}"
+
+
+def test_grid_storage_policy():
+
+    grid_settings = GridSettings([10, 12, 14], [10.0, 12.0, 14.0])
+    grid = Grid("test_grid", [0.0, 0.0, 0.0], grid_settings)
+    grid.map_features(np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0]]), "feature", [1.0, 2.0], MapMethod.GAUSSIAN)
+
+    policies = [
+        GridStoragePolicy(),
+        GridStoragePolicy(dtype="float32", chunks="grid", compression="gzip", compression_level=4),
+        GridStoragePolicy(dtype="float16", chunks="slab", compression=None),
+        GridStoragePolicy(dtype="float32", chunks=(5, 100, 5)),
+    ]
+    expected = [
+        (np.float64, None),
+        (np.float32, (10, 12, 14)),
+        (np.float16, (1, 12, 14)),
+        (np.float32, (5, 12, 5)),
+    ]
+
+    tmp_dir = mkdtemp()
+    try:
+        for index, policy in enumerate(policies):
+            hdf5_path = os.path.join(tmp_dir, f"grid{index}.hdf5")
+            grid.to_hdf5(hdf5_path, policy)
+
+            with h5py.File(hdf5_path, 'r') as data_file:
+                dataset = data_file[f"test_grid/{gridstorage.MAPPED_FEATURES}/feature"]
+                expected_dtype, expected_chunks = expected[index]
+
+                assert dataset.dtype == expected_dtype
+                if expected_chunks is not None:
+                    assert dataset.chunks == expected_chunks
+                assert np.allclose(dataset[()], grid.features["feature"], rtol=1e-2)
+    finally:
+        rmtree(tmp_dir)
+
+    with pytest.raises(ValueError):
+        GridStoragePolicy(dtype="int8")
+
+
+def test_atomic_densities():
+
+    grid_settings = GridSettings([20, 16, 18], [10.0, 8.0, 9.0])
+    grid = Grid("test_grid", [0.0, 0.0, 0.0], grid_settings)
+
+    positions = np.array([[0.0, 0.0, 0.0], [1.2, -0.7, 0.3], [-4.5, 3.9, 4.4], [20.0, 0.0, 0.0]])
+    element_names = ["C", "O", "C", "N"]
+    radii = np.array([1.7, 1.52, 1.7, 1.55])
+
+    grid.map_atomic_densities(positions, element_names, radii, channel_names=["C", "N", "O", "S"], max_atoms_per_pass=3)
+
+    for channel_name in ["C", "N", "O", "S"]:
+        expected = np.zeros(grid.xgrid.shape)
+        for position, element_name, radius in zip(positions, element_names, radii):
+            if element_name == channel_name:
+                expected += grid._get_atomic_density_koes(position, radius)  # pylint: disable=protected-access
+
+        assert np.allclose(grid.features[f"{gridstorage.ATOMIC_DENSITY}_{channel_name}"], expected)
+
+    # the atom outside of the box must not contribute
+    assert np.all(grid.features[f"{gridstorage.ATOMIC_DENSITY}_N"] == 0.0)
+    assert np.any(grid.features[f"{gridstorage.ATOMIC_DENSITY}_C"] > 0.0)
+
+
+def test_sparse_grid_storage():
+
+    grid_settings = GridSettings([20, 20, 20], [20.0, 20.0, 20.0])
+    grid = Grid("test_grid", [0.0, 0.0, 0.0], grid_settings)
+    grid.map_features(np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0]]), "sparse_feature", [1.0, 2.0], MapMethod.FAST_GAUSSIAN)
+    grid.map_features(np.array([[0.0, 0.0, 0.0]]), "dense_feature", [1.0], MapMethod.GAUSSIAN)
+    grid.add_feature_values("empty_feature", np.zeros((20, 20, 20)))
+
+    tmp_dir = mkdtemp()
+    try:
+        hdf5_path = os.path.join(tmp_dir, "grid.hdf5")
+        grid.to_hdf5(hdf5_path, GridStoragePolicy(dtype="float32", sparse=True))
+
+        with h5py.File(hdf5_path, 'r') as data_file:
+            features_group = data_file[f"test_grid/{gridstorage.MAPPED_FEATURES}"]
+
+            # mostly empty features are stored sparse, the others dense
+            assert isinstance(features_group["sparse_feature"], h5py.Group)
+            assert isinstance(features_group["empty_feature"], h5py.Group)
+            assert isinstance(features_group["dense_feature"], h5py.Dataset)
+
+            for feature_name in ["sparse_feature", "dense_feature", "empty_feature"]:
+                data = _read_grid_feature(features_group[feature_name])
+                assert data.shape == (20, 20, 20)
+                assert np.allclose(data, grid.features[feature_name], rtol=1e-5)
+    finally:
+        rmtree(tmp_dir)
+
+
+def test_nearest_neighbours_mapping():
+
+    grid_settings = GridSettings([10, 10, 10], [10.0, 10.0, 10.0])
+    grid = Grid("test_grid", [0.0, 0.0, 0.0], grid_settings)
+
+    # a point between grid points, with different x, y and z
+    position = np.array([grid.xs[2] + 0.25, grid.ys[5] + 0.5, grid.zs[7]])
+    grid.map_features(np.array([position]), "feature", [2.0], MapMethod.NEAREST_NEIGHBOURS)
+
+    data = grid.features["feature"]
+
+    # the value is conserved and only spread over the surrounding grid points
+    assert np.isclose(np.sum(data), 2.0)
+    assert set(zip(*np.nonzero(data))) == {(2, 5, 7), (3, 5, 7), (2, 6, 7), (3, 6, 7)}
+    assert np.isclose(data[2, 5, 7], 2.0 * 0.75 * 0.5)
+    assert np.isclose(data[3, 6, 7], 2.0 * 0.25 * 0.5)
+
+    # the trilinear weights reproduce the position
+    assert np.allclose(np.sum(data * grid.xgrid) / 2.0, position[0])
+    assert np.allclose(np.sum(data * grid.ygrid) / 2.0, position[1])
+    assert np.allclose(np.sum(data * grid.zgrid) / 2.0, position[2])
+
+    # points outside of the box are skipped
+    grid.map_features(np.array([[100.0, 0.0, 0.0]]), "outside", [1.0], MapMethod.NEAREST_NEIGHBOURS)
+    assert np.all(grid.features["outside"] == 0.0)
+
+
+@pytest.mark.parametrize("method", list(MapMethod))
+def test_map_features_equivalence(method):
+
+    grid_settings = GridSettings([20, 16, 18], [10.0, 12.0, 9.0])
+    grid = Grid("test_grid", [1.0, -2.0, 0.5], grid_settings)
+
+    # points inside, on the border and outside of the box, with two channels
+    rng = np.random.default_rng(12)
+    positions = np.concatenate((rng.uniform(-6.0, 6.0, (50, 3)), [[-4.0, -8.0, -4.0], [30.0, 0.0, 0.0]]))
+    values = rng.normal(size=(len(positions), 2))
+
+    with patch("deeprank2.utils.grid._MAX_KERNEL_VALUES_PER_PASS", 10000):
+        grid.map_features(positions, "feature", list(values), method)
+
+    # the same as mapping the points one by one over the whole grid
+    for channel_index in range(2):
+        expected = np.zeros(grid.xgrid.shape)
+        for position, value in zip(positions, values[:, channel_index]):
+            expected += grid._get_mapped_feature(position, value, method)  # pylint: disable=protected-access
+        assert np.allclose(grid.features[f"feature_{channel_index:03d}"], expected, rtol=1e-10, atol=1e-12)
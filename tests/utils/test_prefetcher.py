@@ -0,0 +1,50 @@
+import pytest
+import torch
+from torch_geometric.data import Data
+from torch_geometric.loader import DataLoader
+
+from deeprank2.utils.prefetcher import Prefetcher
+
+
+def _loader(count=10, batch_size=3):
+    data_list = [Data(x = torch.full((2, 1), float(i))) for i in range(count)]
+    return DataLoader(data_list, batch_size = batch_size)
+
+
+@pytest.mark.parametrize("depth", [0, 1, 4])
+def test_prefetched_batches(depth):
+    loader = _loader()
+    prefetcher = Prefetcher(loader, depth)
+
+    batches = list(prefetcher)
+    expected = list(loader)
+    assert len(batches) == len(expected) == len(prefetcher)
+    for batch, expected_batch in zip(batches, expected):
+        assert torch.equal(batch.x, expected_batch.x)
+
+    assert prefetcher.batch_count == 4
+    assert prefetcher.sample_count == 10
+    assert prefetcher.samples_per_second > 0.0
+    assert prefetcher.wait_time <= prefetcher.elapsed_time
+
+
+def test_prefetcher_early_stop():
+    prefetcher = Prefetcher(_loader(count=100, batch_size=1), depth=2)
+    for i, _ in enumerate(prefetcher):
+        if i == 3:
+            break
+    # the background thread is stopped, and a new iteration starts from the beginning
+    assert prefetcher.batch_count == 4
+    assert next(iter(prefetcher)).x[0, 0] == 0.0
+
+
+def test_prefetcher_error():
+    def failing_loader():
+        yield from _loader()
+        raise RuntimeError("unreadable entry")
+
+    with pytest.raises(RuntimeError, match="unreadable entry"):
+        list(Prefetcher(failing_loader(), depth=2))
+
+    with pytest.raises(ValueError):
+        Prefetcher(_loader(), depth=-1)